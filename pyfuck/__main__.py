@@ -5,150 +5,144 @@
 
 
 import argparse
+import json
 import sys
 import logging
+from contextlib import nullcontext
 
-from pyfuck.png import PNG, ValidationException
-from pyfuck.brainfuck import Brainfuck
-from pyfuck.brainloller import Brainloller
-from pyfuck.braincopter import Braincopter
+from pyfuck.api import Engine
+from pyfuck.stats import Stats
 
 
 class Interpreter(object):
 
-    # for determining image type: braincopter / brainloller
-    _THRESHOLD = 0.8  # percent
+    """
+    Command line front end of pyfuck.api.Engine.
+
+    Files named in arguments are opened only for the time of an action, "-" stands for standard input or output.
+    Modules needed only by some actions or options (the cache, tree conversion, the server) are imported
+    when used, see also pyfuck.api.Engine.
+
+    Author:
+        Tomas Bedrich
+    """
+
+    def __init__(self, args, engine=None):
+        """
+        Args:
+            args: Parsed command line arguments.
+            engine: A pyfuck.api.Engine to use (default: a new one, with a cache if requested).
+        """
+        super(Interpreter, self).__init__()
+        self.args = args
+        if engine is None:
+            cache = None
+            if args.cache:
+                from pyfuck.cache import Cache
+                cache = Cache(args.cache, args.cache_size * 1024 * 1024)
+            engine = Engine(cache, args.jobs or 1)
+        self.engine = engine
 
-    def __init__(self, args):
-        self.__dict__ = args.__dict__
-        self.image = None
-        self.contents = None
-        self.brainfuck = Brainfuck()
-        self.brainloller = Brainloller()
-        self.braincopter = Braincopter()
-
-        # normalize source
-        if self.source.name == "<stdin>":
-            self.source = open(sys.stdin.fileno(), "rb")
-
-        # normalize destination
-        if hasattr(self, "destination") and self.destination.name == "<stdout>":
-            self.destination = open(sys.stdout.fileno(), "wb")
-
-        # decetect source type and load an image
-        if self.type == "auto":
-            self.type = self.guess_type(self.source)
+    def run(self):
+        args = self.args
+        logging.info("Running source file '{}' of type {}.".format(args.source, args.type))
 
-        # type manually set or plain brainfuck => load either contents or image
-        if self.type == "brainfuck":
+        stats = Stats() if args.stats else None
+        with _open(args.source, "rb") as source:
             try:
-                self.source.seek(0)
-                with self.source as f:
-                    self.contents = f.read().decode()
+                compiled, input = self.engine.compile(source, args.type, args.limit, stats)
             except UnicodeDecodeError as e:
-                logging.error("Unable to read file '{}': {}".format(self.source.name, e))
-
-        elif not self.image:
-            self.image = PNG().load(self.source)
-
-        # load braincopter target as image
-        if hasattr(self, "target") and self.target:
-            with self.target:
-                image = PNG().load(self.target)
-            self.target = image
+                logging.error("Unable to read file '{}': {}".format(args.source, e))
+                return
 
-    def __del__(self):
-        self.source.close()
-        if hasattr(self, "destination"):
-            self.destination.close()
-
-    def guess_type(self, target):
         try:
-            self.image = PNG().load(target)
-
-            i = 0
-            score = 0
-            stop = len(self.image.pixels) * self._THRESHOLD
-            for y, row in enumerate(self.image.pixels):
-                for pixel in row:
-                    i += 1
-                    if pixel in Brainloller.COMMANDS:
-                        score += 1
-                if y > stop:
-                    break
-
-            if (i * self._THRESHOLD) < score:
-                res, msg = "brainloller", "probability {:.1f}%".format(100 * i / score)
-            else:
-                res, msg = "braincopter", "fallback"
-
-        except ValidationException:
-            res, msg = "brainfuck", "not a valid PNG"
-
-        logging.info("Detected source type: {} ({}).".format(res, msg))
-        return res
-
-    def run(self):
-        if not self.contents and not self.image:
-            return
-
-        logging.info("Running source file '{}' of type {}.".format(self.source.name, self.type))
-
-        if self.type == "brainfuck":
-            self.brainfuck.eval(self.contents)
-
-        elif self.type == "brainloller":
-            self.brainfuck.eval(self.brainloller.to_brainfuck(self.image))
-
-        elif self.type == "braincopter":
-            self.brainfuck.eval(self.braincopter.to_brainfuck(self.image))
+            self.engine.execute(compiled, stdin=input or None, stats=stats)
+        finally:
+            self._report(stats)
 
     def convert(self):
-        if not self.contents and not self.image:
-            return
-
-        def outText(data):
-            self.destination.write(data.encode())
-
+        """
+        Returns:
+            Exit status - 1 if some files of a tree failed to convert, None otherwise.
+        """
+        args = self.args
+        if args.recursive:
+            return self.convert_tree()
         logging.info("Converting source file '{}' of type {} to '{}' of type {}.".format(
-            self.source.name, self.type, self.destination.name, self.output))
-
-        # source = Brainfuck
-        if self.type == "brainfuck":
-
-            if self.output == "brainfuck":
-                outText(self.contents)
-
-            elif self.output == "brainloller":
-                self.brainloller.to_brainloller(self.contents).save(self.destination)
-
-            elif self.output == "braincopter":
-                self.braincopter.to_braincopter(self.contents, self.target).save(self.destination)
-
-        # source = Brainloller
-        elif self.type == "brainloller":
-
-            if self.output == "brainfuck":
-                outText(self.brainloller.to_brainfuck(self.image))
+            args.source, args.type, args.destination, args.output))
 
-            elif self.output == "brainloller":
-                self.image.save(self.destination)
-
-            elif self.output == "braincopter":
-                self.braincopter.to_braincopter(
-                    self.brainloller.to_brainfuck(self.image), self.target).save(self.destination)
-
-        # source = Braincopter
-        elif self.type == "braincopter":
-
-            if self.output == "brainfuck":
-                outText(self.braincopter.to_brainfuck(self.image))
-
-            elif self.output == "brainloller":
-                self.brainloller.to_brainloller(self.braincopter.to_brainfuck(self.image)).save(self.destination)
-
-            elif self.output == "braincopter":
-                self.image.save(self.destination)
+        with _open(args.source, "rb") as source, _open(args.destination, "wb") as destination, \
+                _open(args.target, "rb") as carrier:
+            stats = Stats() if args.stats else None
+            try:
+                self.engine.convert(
+                    source, args.output, carrier, destination, type=args.type, limit=args.limit,
+                    optimize=args.optimize, strip=args.strip, verify=args.verify,
+                    compression=args.compression, width=args.width, ratio=args.ratio, stats=stats)
+            except UnicodeDecodeError as e:
+                logging.error("Unable to read file '{}': {}".format(args.source, e))
+            self._report(stats)
+
+    def convert_tree(self):
+        from pyfuck.batch import convert_tree
+
+        args = self.args
+        logging.info("Converting source tree '{}' of type {} to '{}' of type {}.".format(
+            args.source, args.type, args.destination, args.output))
+
+        result = convert_tree(
+            args.source, args.destination, args.output, args.target, args.jobs, type=args.type, limit=args.limit,
+            optimize=args.optimize, strip=args.strip, verify=args.verify,
+            compression=args.compression, width=args.width, ratio=args.ratio)
+        logging.info("Converted {converted}, skipped {skipped} up to date, failed {failed} files.".format(**result))
+        return 1 if result["failed"] else 0
+
+    def _report(self, stats):
+        """
+        Prints collected stats to sys.stderr.
+        """
+        if stats is not None:
+            print(stats.report(self.args.stats_format), file=sys.stderr)
+
+
+def benchmark(args):
+    """
+    Runs a benchmark suite (see pyfuck.bench), prints its results and compares them to a baseline.
+
+    Returns:
+        Exit status - 1 if a case regressed beyond the threshold, 0 otherwise.
+    """
+    from pyfuck import bench
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    progress = lambda name, result: logging.info("{}: {:.1f} ms".format(name, 1000 * result["time"]))
+    results = bench.run(args.suite, args.scale, args.repeat, args.filter, not args.no_memory, progress)
+    print(bench.report(results, baseline, args.format))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            f.write(bench.report(results, format="json") + "\n")
+    if baseline is not None:
+        regressions = bench.compare(results, baseline, args.threshold)
+        for name, metric, ratio in regressions:
+            logging.error("Regression of {}: {} is {:.2f} times the baseline.".format(name, metric, ratio))
+        return 1 if regressions else 0
+    return 0
+
+
+def _open(filename, mode):
+    """
+    Opens a file named on the command line, "-" is standard input or output (left open), None is nothing.
+    """
+    if filename is None:
+        return nullcontext()
+    if filename == "-":
+        return nullcontext(sys.stdin.buffer if "r" in mode else sys.stdout.buffer)
+    return open(filename, mode)
 
 
 # common parser ====================================
@@ -160,10 +154,39 @@ parser_common.add_argument(
     help="Source type (default: auto).")
 parser_common.add_argument(
     "source",
-    type=argparse.FileType("rb"),
     nargs="?",
-    default=sys.stdin,
-    help="Source file to interpret (default: sys.stdin).")
+    default="-",
+    help="Source file to interpret (default: -, sys.stdin).")
+parser_common.add_argument(
+    "-l", "--limit",
+    type=int,
+    metavar="<length>",
+    help="Maximum length of a program decoded from an image (default: unlimited).")
+parser_common.add_argument(
+    "-j", "--jobs",
+    type=int,
+    metavar="<count>",
+    help="Number of processes classifying pixels of a large Braincopter image by bands of rows (default: 1), " +
+         "or converting files of a tree (default: number of CPUs).")
+parser_common.add_argument(
+    "--cache",
+    metavar="<dir>",
+    help="Directory of a cache of conversions, consulted before decoding images (default: no cache).")
+parser_common.add_argument(
+    "--cache-size",
+    type=int,
+    default=256,
+    metavar="<MB>",
+    help="Maximum size of the cache (default: 256 MB).")
+parser_common.add_argument(
+    "--stats",
+    action="store_true",
+    help="Print time and counters of processing stages to sys.stderr.")
+parser_common.add_argument(
+    "--stats-format",
+    choices=["human", "json"],
+    default="human",
+    help="Format of the stats - a table or JSON (default: human).")
 # parser_common.add_argument(
 #     "-v", "--verbose",
 #     action="count",
@@ -194,16 +217,145 @@ parser_conversion.add_argument(
     help="Output type.")
 parser_conversion.add_argument(
     "destination",
-    type=argparse.FileType("wb"),
     nargs="?",
-    default=sys.stdout,
-    help="Destination filename (default: sys.stdout).")
+    default="-",
+    help="Destination filename (default: -, sys.stdout).")
 parser_conversion.add_argument(
     "-i", "--image",
     dest="target",
     metavar="<image>",
-    type=argparse.FileType("rb"),
     help="A PNG file where to encode the Braincopter data. Required for all conversions to Braincopter.")
+parser_conversion.add_argument(
+    "-c", "--compression",
+    choices=["fast", "default", "best"],
+    default="default",
+    help="PNG compression preset, trades speed for size (default: default).")
+parser_conversion.add_argument(
+    "-w", "--width",
+    type=int,
+    metavar="<pixels>",
+    help="Width of Brainloller image, the program is folded to rows (default: computed from ratio).")
+parser_conversion.add_argument(
+    "-r", "--ratio",
+    type=float,
+    default=1.0,
+    metavar="<ratio>",
+    help="Desired width to height ratio of Brainloller image (default: 1).")
+parser_conversion.add_argument(
+    "-O", "--optimize",
+    action="store_true",
+    help="Minify the program before conversion - strip comments, cancel opposite commands and drop dead loops.")
+parser_conversion.add_argument(
+    "--strip",
+    action="store_true",
+    help="Copy only critical PNG chunks (drop metadata) when the output type is the source type.")
+parser_conversion.add_argument(
+    "--verify",
+    action="store_true",
+    help="Decode and check the source program before copying it to the same type (default: copy as is).")
+parser_conversion.add_argument(
+    "-R", "--recursive",
+    action="store_true",
+    help="Source and destination are directories - mirror the source tree, skipping up-to-date outputs.")
+
+
+# serve subparser ====================================
+parser_serve = actions.add_parser(
+    "serve", description="Serves run and convert requests over HTTP, keeping compiled programs in memory.")
+parser_serve.set_defaults(func="serve")
+parser_serve.add_argument(
+    "-s", "--socket",
+    metavar="<path>",
+    help="Unix socket to listen on (default: TCP, see --host and --port).")
+parser_serve.add_argument(
+    "--host",
+    default="127.0.0.1",
+    help="Address to listen on (default: 127.0.0.1).")
+parser_serve.add_argument(
+    "-p", "--port",
+    type=int,
+    default=8181,
+    help="Port to listen on (default: 8181).")
+parser_serve.add_argument(
+    "-j", "--workers",
+    type=int,
+    metavar="<count>",
+    help="Number of workers (default: number of CPUs).")
+parser_serve.add_argument(
+    "--pool",
+    choices=["thread", "process"],
+    default="thread",
+    help="Kind of workers (default: thread).")
+parser_serve.add_argument(
+    "--cache-entries",
+    type=int,
+    default=128,
+    metavar="<entries>",
+    help="Number of compiled and decoded programs kept in memory (default: 128).")
+parser_serve.add_argument(
+    "--carriers",
+    metavar="<dir>",
+    help="Directory of images carrying Braincopter output, named by the carrier parameter of conversions " +
+         "(default: none, conversions to Braincopter are refused).")
+parser_serve.add_argument(
+    "--steps",
+    type=int,
+    default=10 ** 8,
+    metavar="<count>",
+    help="Maximum number of instructions executed by a run, 0 is unlimited (default: 100000000).")
+
+
+# bench subparser ====================================
+parser_bench = actions.add_parser(
+    "bench", description="Runs a benchmark suite and compares it to a saved baseline (see benchmarks/).")
+parser_bench.set_defaults(func="bench")
+parser_bench.add_argument(
+    "-s", "--suite",
+    choices=["brainfuck", "png", "languages"],
+    default="brainfuck",
+    help="Benchmark suite - brainfuck (workloads run in each language and optimizer level), png (loading and " +
+         "saving each filter type and palette depth) or languages (image programs of each density) " +
+         "(default: brainfuck).")
+parser_bench.add_argument(
+    "--scale",
+    type=float,
+    default=1.0,
+    metavar="<factor>",
+    help="Size of workloads relative to the default, image suites go up to <factor> million pixels " +
+         "(default: 1, at most 100).")
+parser_bench.add_argument(
+    "-r", "--repeat",
+    type=int,
+    default=3,
+    metavar="<count>",
+    help="Number of timed runs of each case, the fastest counts (default: 3).")
+parser_bench.add_argument(
+    "-k", "--filter",
+    metavar="<text>",
+    help="Run only cases whose name contains the text, e.g. sieve/brainfuck (default: all).")
+parser_bench.add_argument(
+    "--baseline",
+    metavar="<file>",
+    help="Results saved earlier to compare to, the exit status is 1 on a regression (default: no comparison).")
+parser_bench.add_argument(
+    "--save",
+    metavar="<file>",
+    help="Save the results as JSON, to be used as a baseline.")
+parser_bench.add_argument(
+    "--threshold",
+    type=float,
+    default=0.25,
+    metavar="<ratio>",
+    help="Allowed relative increase of time and peak memory over the baseline (default: 0.25).")
+parser_bench.add_argument(
+    "--no-memory",
+    action="store_true",
+    help="Skip measuring peak memory (an extra run of each case traced by tracemalloc).")
+parser_bench.add_argument(
+    "--format",
+    choices=["human", "json"],
+    default="human",
+    help="Format of the results (default: human).")
 
 
 # MAIN ==================================================================================================
@@ -211,9 +363,21 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     if len(sys.argv) > 1:
         args = parser_main.parse_args()
-        if hasattr(args, "output") and args.output == "braincopter" and not args.target:
+        if args.func == "serve":
+            from pyfuck.server import serve
+            serve(args.socket or (args.host, args.port), args.workers, args.pool, args.cache_entries, args.carriers,
+                  args.steps or None)
+        elif args.func == "bench":
+            sys.exit(benchmark(args))
+        elif hasattr(args, "output") and args.output == "braincopter" and not args.target:
             parser_main.error("the following argument is required for conversions to Braincopter: -i/--image")
-        interpreter = Interpreter(args)
-        getattr(interpreter, args.func)()
+        elif getattr(args, "recursive", False) and "-" in (args.source, args.destination):
+            parser_main.error("source and destination directories are required with -R/--recursive")
+        elif getattr(args, "recursive", False) and (args.cache or args.stats):
+            parser_main.error("--cache and --stats are not supported with -R/--recursive " +
+                              "(up-to-date outputs are skipped by the manifest of the destination)")
+        else:
+            interpreter = Interpreter(args)
+            sys.exit(getattr(interpreter, args.func)())
     else:
         parser_main.error("please specify an action")
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+
+import io
+import logging
+import sys
+from io import IOBase
+
+from pyfuck.brainfuck import Brainfuck, Bytecode
+from pyfuck.stats import NULL_STATS
+
+
+_SIGNATURE = b"\x89PNG\r\n\x1a\n"  # pyfuck.png.PNG.SIGNATURE, checked before importing the module
+
+
+class Engine(object):
+
+    """
+    Interpreter and converter of Brainfuck, Brainloller and Braincopter programs.
+
+    An engine keeps no state between calls, so one instance can be shared by threads. Sources are Brainfuck
+    text (str), raw file contents (bytes), binary file objects or PNG images - types are detected from
+    the data unless given. Image modules (pyfuck.png and the image languages) are imported only when
+    an image is involved, so running plain Brainfuck starts fast.
+
+    Author:
+        Tomas Bedrich
+
+    Examples:
+        >>> engine = Engine()
+        >>> engine.run(b",.,.,.,.", input="echo")
+        b'echo'
+        >>> image = engine.convert("+++++++++[>+++++++<-]>.", "brainloller")
+        >>> image[:4], engine.run(image)
+        (b'\\x89PNG', b'?')
+    """
+
+    TYPES = ("brainfuck", "brainloller", "braincopter")
+
+    def __init__(self, cache=None, workers=1):
+        """
+        Args:
+            cache: A pyfuck.cache.Cache of conversion results consulted before any PNG work (default: none).
+            workers: Number of processes classifying pixels of large Braincopter images (default: one, this process).
+        """
+        super(Engine, self).__init__()
+        self.brainfuck = Brainfuck()
+        self._brainloller = None
+        self._braincopter = None  # created on first use
+        self.cache = cache
+        self.workers = workers
+
+    @property
+    def brainloller(self):
+        if self._brainloller is None:
+            from pyfuck.brainloller import Brainloller
+            self._brainloller = Brainloller()
+        return self._brainloller
+
+    @property
+    def braincopter(self):
+        if self._braincopter is None:
+            from pyfuck.braincopter import Braincopter
+            self._braincopter = Braincopter(self.workers)
+        return self._braincopter
+
+    def load(self, source, type="auto", stats=None):
+        """
+        Loads a program.
+
+        Args:
+            source: Brainfuck text, file contents, binary file object or an image.
+            type: Source type - one of TYPES or "auto".
+            stats: pyfuck.stats.Stats recording time and counters of processing stages.
+
+        Raises:
+            IOError, ValueError, pyfuck.png.ValidationException
+
+        Returns:
+            A tuple of source type and Brainfuck text or a (lazily loaded) image.
+
+        Examples:
+            >>> Engine().load(b"++.")
+            ('brainfuck', '++.')
+            >>> Engine().load(open("test/assets/hello_world.braincopter.png", "rb")) #doctest: +ELLIPSIS
+            ('braincopter', <pyfuck.png.PNG object at ...>)
+        """
+        if type not in self.TYPES + ("auto",):
+            raise ValueError("Unknown source type '{}'.".format(type))
+        if stats is None:
+            stats = NULL_STATS
+
+        if isinstance(source, str):
+            return "brainfuck", source
+
+        if _image(source):
+            image = source
+        else:
+            source = self._buffer(source)
+            start = source.tell()
+            signature = source.read(len(_SIGNATURE))
+            source.seek(start)
+            image = None
+            if type != "brainfuck" and (type != "auto" or signature == _SIGNATURE):
+                from pyfuck.png import PNG, ValidationException
+                try:
+                    image = PNG().load(source, lazy=True, stats=stats)
+                except ValidationException:
+                    if type != "auto":
+                        raise
+                    logging.debug("Detected source type: brainfuck (not a valid PNG).")
+            elif type == "auto":
+                logging.debug("Detected source type: brainfuck (no PNG signature).")
+            if image is None:
+                source.seek(start)
+                return "brainfuck", source.read().decode()
+
+        if type == "auto":
+            with stats.stage("sniff"):
+                brainloller, share, sampled = self.brainloller.sniff(image)
+            type = "brainloller" if brainloller else "braincopter"
+            logging.debug("Detected source type: {} ({:.1f}% of {} sampled pixels are commands).".format(
+                type, 100 * share, sampled))
+        return type, image
+
+    def compile(self, source, type="auto", limit=None, stats=None):
+        """
+        Compiles a program.
+
+        Args:
+            source: See load.
+            type: See load.
+            limit: Maximum length of a program decoded from an image (default: unlimited).
+            stats: See load.
+
+        Raises:
+            IOError, ValueError, pyfuck.png.ValidationException
+
+        Returns:
+            A tuple of compiled program (a pyfuck.brainfuck.Bytecode) and user input given in the source.
+        """
+        # cached images are compiled from their Brainfuck text
+        if self.cache is not None and not isinstance(source, str) and not _image(source):
+            data = self._buffer(source).read()
+            if data.startswith(_SIGNATURE):
+                source = self.convert(data, "brainfuck", type=type, limit=limit, stats=stats).decode()
+            else:
+                source = data  # the source is read already
+
+        type, program = self.load(source, type, stats)
+        if type == "brainfuck":
+            preprocessed = self.brainfuck.preprocess(program)
+            return self.brainfuck._compile(preprocessed.program, stats), preprocessed.input
+        return getattr(self, type).compile(program, limit, stats), ""
+
+    def execute(self, compiled, stdout=None, stdin=None, stats=None, steps=None):
+        """
+        Executes a compiled program (see pyfuck.brainfuck.Brainfuck.execute).
+        """
+        self.brainfuck.execute(compiled, stdout, stdin, stats, steps)
+
+    def run(self, source, input="", type="auto", limit=None, stats=None, steps=None):
+        """
+        Runs a program.
+
+        Args:
+            source: See load, or a compiled program.
+            input: User input, the program fails when it reads more (default: input after "!" in the source).
+            type: See load.
+            limit: See compile.
+            stats: See load.
+            steps: Maximum number of executed instructions (default: unlimited).
+
+        Raises:
+            EOFError, IOError, ValueError, pyfuck.png.ValidationException
+
+        Returns:
+            The program output, a byte per output cell.
+
+        Examples:
+            >>> Engine().run(open("test/assets/hello_world.brainloller.png", "rb"))
+            b'Hello World!\\n'
+        """
+        if isinstance(source, Bytecode):
+            compiled, inline = source, ""
+        else:
+            compiled, inline = self.compile(source, type, limit, stats)
+        output = io.StringIO()
+        self.execute(compiled, output, input or inline, stats, steps)
+        return output.getvalue().encode("latin-1")
+
+    def to_brainfuck(self, source, type="auto", limit=None, optimize=False, stats=None):
+        """
+        Decodes a program to Brainfuck.
+
+        Args:
+            source: See load.
+            type: See load.
+            limit: See compile.
+            optimize: Minify the program (see pyfuck.brainfuck.Brainfuck.minify).
+            stats: See load.
+
+        Raises:
+            IOError, ValueError, pyfuck.png.ValidationException
+
+        Returns:
+            A tuple of source type and Brainfuck text.
+        """
+        if stats is None:
+            stats = NULL_STATS
+        type, program = self.load(source, type, stats)
+        if type != "brainfuck":
+            program = getattr(self, type).to_brainfuck(program, limit, stats)
+        if optimize:
+            with stats.stage("brainfuck.minify"):
+                program = self.brainfuck.minify(program)
+        return type, program
+
+    def convert(self, source, to, carrier=None, destination=None, type="auto", limit=None, optimize=False,
+                strip=False, verify=False, compression="default", width=None, ratio=1.0, stats=None):
+        """
+        Converts a program to another type.
+
+        Conversions to the source type copy the source as is, without decoding it (unless verified).
+
+        Args:
+            source: See load.
+            to: Output type - one of TYPES.
+            carrier: An image carrying Braincopter output - filename, file contents or binary file object.
+            destination: Binary file object to write to (default: return the result).
+            type: See load.
+            limit: See compile.
+            optimize: Minify the program first (see pyfuck.brainfuck.Brainfuck.minify).
+            strip: Copy only critical PNG chunks when converting an image to its own type.
+            verify: Compile the source before copying it to its own type.
+            compression: PNG compression preset (see pyfuck.png.PNG.PRESETS).
+            width: Width of Brainloller image (default: computed from ratio).
+            ratio: Desired width to height ratio of Brainloller image.
+            stats: See load.
+
+        Raises:
+            IOError, ValueError, pyfuck.png.ValidationException
+
+        Returns:
+            The converted program (bytes), or None if it was written to destination.
+        """
+        if to not in self.TYPES:
+            raise ValueError("Unknown output type '{}'.".format(to))
+        if stats is None:
+            stats = NULL_STATS
+        options = {"type": type, "limit": limit, "optimize": optimize, "strip": strip, "verify": verify,
+                   "compression": compression, "width": width, "ratio": ratio, "stats": stats}
+
+        if self.cache is None or _image(source):
+            return self._convert(source, to, carrier, destination, **options)
+
+        # cached by the source, the carrier and options affecting the output
+        data = source.encode() if isinstance(source, str) else self._buffer(source).read()
+        if to == "braincopter" and isinstance(carrier, str):
+            with open(carrier, "rb") as f:
+                carrier = f.read()
+        elif to == "braincopter" and carrier is not None:
+            carrier = self._buffer(carrier).read()
+        key = self.cache.key(data, to, type, limit, optimize, verify, *(
+            () if to == "brainfuck" else (strip, compression, width, ratio) if to == "brainloller" else
+            (strip, compression, carrier)))
+
+        result = self.cache.get(key)
+        stats.add("cache.hits" if result is not None else "cache.misses", 1)
+        if result is None:
+            result = self._convert(data, to, carrier, None, **options)
+            self.cache.put(key, result)
+        if destination is None:
+            return result
+        destination.write(result)
+
+    def _convert(self, source, to, carrier, destination, type, limit, optimize, strip, verify, compression,
+                 width, ratio, stats):
+        """
+        Converts a program to another type, without a cache (see convert).
+        """
+        if not isinstance(source, str) and not _image(source):
+            source = self._buffer(source)
+        out = destination if destination is not None else io.BytesIO()
+
+        if optimize:
+            type, program = "brainfuck", self.to_brainfuck(source, type, limit, optimize, stats)[1]
+        else:
+            type, program = self.load(source, type, stats)
+
+        # same type => copy the original
+        if type == to:
+            if verify:
+                self.compile(program, type, limit, stats)
+            with stats.stage("copy"):
+                if type == "brainfuck":
+                    out.write(program.encode())
+                elif _image(source):
+                    source.save(out, compression)
+                else:
+                    source.seek(0)
+                    if strip:
+                        from pyfuck.png import copyChunks
+                        copyChunks(source, out, strip=True)
+                    else:
+                        import shutil
+                        shutil.copyfileobj(source, out)
+
+        else:
+            if type != "brainfuck":
+                program = getattr(self, type).to_brainfuck(program, limit, stats)
+
+            if to == "braincopter" and carrier is None:
+                raise ValueError("A carrier image is required for conversions to Braincopter.")
+            with stats.stage(to + ".encode"):
+                if to == "brainfuck":
+                    out.write(program.encode())
+                elif to == "brainloller":
+                    self.brainloller.to_brainloller(program, width, ratio).save(out, compression)
+                else:
+                    if isinstance(carrier, (bytes, bytearray, memoryview)):
+                        carrier = io.BytesIO(carrier)
+                    self.braincopter.transcode(program, carrier, out, preset=compression)
+
+        return None if destination is not None else out.getvalue()
+
+    @staticmethod
+    def _buffer(source):
+        """
+        Returns:
+            A seekable binary file object with the source.
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return io.BytesIO(source)
+        if isinstance(source, IOBase) and not source.seekable():
+            return io.BytesIO(source.read())
+        return source
+
+
+def _image(source):
+    """
+    Returns:
+        Whether the source is a pyfuck.png.PNG, without importing the module (if it is not loaded,
+        there are no images yet).
+    """
+    png = sys.modules.get("pyfuck.png")
+    return png is not None and isinstance(source, png.PNG)
+
+
+def run(source, input="", type="auto", limit=None):
+    """
+    Runs a program (see Engine.run).
+
+    Examples:
+        >>> run("+++++++++[>+++++++<-]>.")
+        b'?'
+    """
+    return Engine().run(source, input, type, limit)
+
+
+def convert(source, to, carrier=None, **options):
+    """
+    Converts a program to another type (see Engine.convert).
+
+    Examples:
+        >>> convert(open("test/assets/hello_world.brainloller.png", "rb"), "brainfuck")[:10]
+        b'++++++++++'
+    """
+    return Engine().convert(source, to, carrier, **options)
+
+
+if __name__ == '__main__':
+    print("This file is not meant to be executed directly. Please use it as a module instead.")
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+
+import json
+import logging
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from pyfuck.api import Engine
+from pyfuck.cache import Cache
+from pyfuck.png import ValidationException
+
+
+# file name suffixes of program types, the first one is used for outputs
+SUFFIXES = {
+    "brainfuck": (".brainfuck", ".bf", ".b"),
+    "brainloller": (".brainloller.png",),
+    "braincopter": (".braincopter.png",),
+}
+_KNOWN = sorted([suffix for suffixes in SUFFIXES.values() for suffix in suffixes] + [".png"], key=len, reverse=True)
+
+
+def convert_tree(source, destination, to, carrier=None, jobs=None, **options):
+    """
+    Converts every file in a directory tree, mirroring the tree to another directory.
+
+    Files are read and written by threads, while conversions run in a pool of processes, so reading and writing
+    of files and zlib (which releases the GIL) overlap with the interpreting. Outputs are skipped if they are
+    up to date: a manifest in the destination keeps source modification times and content hashes.
+
+    Args:
+        source: Source directory.
+        destination: Destination directory, created if missing.
+        to: Output type.
+        carrier: Filename of an image carrying Braincopter output.
+        jobs: Number of processes (default: number of CPUs), 1 converts in this process.
+        options: pyfuck.api.Engine.convert options.
+
+    Returns:
+        A dict with numbers of converted, skipped and failed files.
+
+    Examples:
+        >>> source, destination = tempfile.mkdtemp(), tempfile.mkdtemp()
+        >>> os.mkdir(os.path.join(source, "examples"))
+        >>> _ = shutil.copy("test/assets/hello_world.brainloller.png", os.path.join(source, "examples"))
+        >>> convert_tree(source, destination, "brainfuck", jobs=2)
+        {'converted': 1, 'skipped': 0, 'failed': 0}
+        >>> open(os.path.join(destination, "examples", "hello_world.brainfuck")).read()[:10]
+        '++++++++++'
+        >>> convert_tree(source, destination, "brainfuck", jobs=2)  # up to date
+        {'converted': 0, 'skipped': 1, 'failed': 0}
+    """
+    carrierData = None
+    if carrier is not None:
+        with open(carrier, "rb") as f:
+            carrierData = f.read()
+    fingerprint = Cache.key(to, carrierData, sorted(options.items()))
+
+    manifestPath = os.path.join(destination, MANIFEST)
+    try:
+        with open(manifestPath) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+
+    result = {"converted": 0, "skipped": 0, "failed": 0}
+    pending = deque()
+    window = 2 * (jobs or os.cpu_count() or 1)  # files in flight
+
+    def finish(relative, stamp, future):
+        try:
+            stamp["hash"] = future.result()
+            manifest[relative] = stamp
+            result["converted"] += 1
+        except (Exception, ValidationException) as e:  # report and go on with other files
+            manifest.pop(relative, None)
+            logging.error("Unable to convert '{}': {}".format(relative, e))
+            result["failed"] += 1
+
+    targets = {}  # output => source, to find sources differing only in suffix
+    if jobs == 1:
+        _init()  # before threads convert in this process
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(jobs, initializer=_init)
+    with ThreadPoolExecutor(window) as files:
+        for relative in _walk(source, destination):
+            path = os.path.join(source, relative)
+            target = os.path.join(destination, _rename(relative, to))
+            if targets.setdefault(target, relative) != relative:
+                logging.error("Unable to convert '{}': output '{}' is converted from '{}'.".format(
+                    relative, target, targets[target]))
+                result["failed"] += 1
+                continue
+            stamp = {"mtime": os.stat(path).st_mtime_ns, "options": fingerprint}
+
+            # up to date - unchanged modification time or content
+            previous = manifest.get(relative)
+            if previous and previous["options"] == fingerprint and os.path.exists(target):
+                if previous["mtime"] == stamp["mtime"]:
+                    result["skipped"] += 1
+                    continue
+                with open(path, "rb") as f:
+                    stamp["hash"] = Cache.key(f.read())
+                if previous.get("hash") == stamp["hash"]:
+                    manifest[relative] = stamp
+                    result["skipped"] += 1
+                    continue
+
+            pending.append((relative, stamp, files.submit(_process, path, target, to, carrierData, options, pool)))
+            while len(pending) >= window:
+                finish(*pending.popleft())
+
+        while pending:
+            finish(*pending.popleft())
+    if pool:
+        pool.shutdown()
+
+    os.makedirs(destination, exist_ok=True)
+    _write(manifestPath, json.dumps(manifest, indent=1, sort_keys=True).encode())
+    return result
+
+
+MANIFEST = ".pyfuck-manifest.json"
+
+
+def _walk(source, destination):
+    """
+    Returns:
+        A generator of paths of files in a tree, relative to the tree root. Hidden files and the destination
+        tree (if nested) are skipped.
+    """
+    skip = os.path.realpath(destination)
+    for root, directories, files in os.walk(source):
+        directories[:] = sorted(d for d in directories
+                                if not d.startswith(".") and os.path.realpath(os.path.join(root, d)) != skip)
+        for name in sorted(files):
+            if not name.startswith("."):
+                yield os.path.relpath(os.path.join(root, name), source)
+
+
+def _rename(relative, to):
+    """
+    Replaces a known type suffix of a file name by the suffix of an output type.
+
+    Examples:
+        >>> _rename("a/hello.brainloller.png", "brainfuck")
+        'a/hello.brainfuck'
+        >>> _rename("photo.png", "braincopter")
+        'photo.braincopter.png'
+    """
+    lower = relative.lower()
+    for suffix in _KNOWN:
+        if lower.endswith(suffix):
+            relative = relative[:-len(suffix)]
+            break
+    return relative + SUFFIXES[to][0]
+
+
+def _process(path, target, to, carrier, options, pool):
+    """
+    Reads a file, converts it in the pool (or here) and writes the result.
+
+    Returns:
+        A hash of the file content.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if pool is not None:
+        result = pool.submit(_convert, data, to, carrier, options).result()
+    else:
+        result = _convert(data, to, carrier, options)
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    _write(target, result)
+    return Cache.key(data)
+
+
+def _write(path, data):
+    """
+    Writes a file atomically - a temporary file is renamed.
+    """
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+# jobs run in the pool ==============
+_engine = None  # one per process
+
+
+def _init():
+    """
+    Creates the engine of this process with image languages loaded - their lazy imports are not thread safe.
+    """
+    global _engine
+    if _engine is None:
+        engine = Engine()
+        engine.brainloller, engine.braincopter
+        _engine = engine
+
+
+def _convert(data, to, carrier, options):
+    return _engine.convert(data, to, carrier, **options)
+
+
+if __name__ == '__main__':
+    print("This file is not meant to be executed directly. Please use it as a module instead.")
@@ -0,0 +1,774 @@
+#!/usr/bin/env python3
+
+
+import io
+import json
+import math
+import platform
+import random
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from pyfuck.api import Engine
+from pyfuck.brainfuck import Brainfuck
+from pyfuck.stats import Stats
+
+
+# Brainfuck workloads ==============
+# Generated, so no files or network are needed. Each returns a tuple of program, input and expected output.
+
+def hello(scale=1.0):
+    """
+    The classic Hello World - mostly startup and compilation.
+
+    Examples:
+        >>> Engine().run(hello()[0])
+        b'Hello World!\\n'
+    """
+    program = "++++++++++[>+++++++>++++++++++>+++>+<<<<-]>++.>+.+++++++..+++.>++.<<+++++++++++++++.>.+++.------." \
+              "--------.>+.>."
+    return program, "", "Hello World!\n"
+
+
+def sieve(scale=1.0):
+    """
+    Sieve of Eratosthenes, unrolled for numbers up to 2000 * scale - long straight code, few loops.
+
+    Flag of number i is at cell 2i, cell 2i + 1 is a zero temporary. A flag is tested by moving it
+    to its temporary and entering a loop there, which ends on the (then zero) temporary.
+
+    Examples:
+        >>> program, input, expected = sieve(0.01)
+        >>> expected
+        '2 3 5 7 11 13 17 19 '
+        >>> Engine().run(program).decode() == expected
+        True
+    """
+    limit = max(2, int(2000 * scale))
+    code = []
+    position = 0
+
+    def move(cell):
+        nonlocal position
+        code.append(">" * (cell - position) if cell > position else "<" * (position - cell))
+        position = cell
+
+    for i in range(2, limit + 1):  # all numbers are candidates
+        move(2 * i)
+        code.append("+")
+
+    primes = []
+    for i in range(2, limit + 1):
+        if all(i % p for p in primes if p * p <= i):
+            primes.append(i)
+
+    for p in primes:
+        if p * p > limit:
+            break
+        move(2 * p)
+        code.append("[>+<-]>[-<+>")  # if flag p: (restored)
+        position = 2 * p + 1
+        for multiple in range(p * p, limit + 1, p):
+            move(2 * multiple)
+            code.append("[-]")
+        move(2 * p + 1)
+        code.append("]")
+
+    for i in range(2, limit + 1):
+        move(2 * i)
+        code.append("[>+<-]>[-")  # if flag i: print i
+        position = 2 * i + 1
+        for char in "{} ".format(i):
+            code.append("+" * ord(char) + ".[-]")
+        code.append("]")
+
+    return "".join(code), "", "".join("{} ".format(p) for p in primes)
+
+
+def loops(scale=1.0):
+    """
+    Three nested loops, about 500 000 * scale innermost iterations - the interpreter loop.
+
+    Examples:
+        >>> program, input, expected = loops(0.01)
+        >>> Engine().run(program).decode() == expected
+        True
+    """
+    count = max(1, round(80 * scale ** (1 / 3)))
+    loop = "+" * count
+    program = ">{0}[>{0}[>{0}[>+<-]<-]<-]>>>.".format(loop)
+    return program, "", chr(count ** 3 % 256)
+
+
+def output(scale=1.0):
+    """
+    Prints about 100 000 * scale characters - output handling.
+
+    Examples:
+        >>> program, input, expected = output(0.001)
+        >>> Engine().run(program).decode() == expected
+        True
+    """
+    outer = max(1, min(255, round(200 * scale)))
+    program = "++++++++[>++++++++<-]>+>{}[>{}[<<..>>-]<-]".format("+" * outer, "+" * 250)
+    return program, "", "A" * (2 * outer * 250)
+
+
+def echo(scale=1.0):
+    """
+    Copies about 50 000 * scale characters of input to output - input handling.
+
+    Examples:
+        >>> program, input, expected = echo(0.01)
+        >>> Engine().run(program, input).decode() == input == expected
+        True
+    """
+    outer = max(1, min(255, round(200 * scale)))
+    program = ">{}[>{}[<<,.>>-]<-]".format("+" * outer, "+" * 250)
+    text = "".join(random.Random(outer).choice("abcdefghijklmnopqrstuvwxyz \n") for _ in range(outer * 250))
+    return program, text, text
+
+
+def hanoi(scale=1.0):
+    """
+    Towers of Hanoi of 13 + log2(scale) disks, solved by the program - nested conditionals, one move per step.
+
+    A binary counter of moves decides the disk: a step moves the disk of the lowest zero bit, and each disk cycles
+    over the pegs in one direction. Each move prints the disk (a, b, ...) and its target peg (A, B or C).
+
+    Examples:
+        >>> program, input, expected = hanoi(0.001)
+        >>> expected
+        'aCbBaBcCaAbCaC'
+        >>> Engine().run(program).decode() == expected
+        True
+    """
+    disks = max(1, min(26, round(13 + math.log2(scale))))
+    tape = _Tape()
+    run = tape.var(1)
+    scratch, temp = tape.var(), tape.var()
+    bits = [tape.var() for _ in range(disks)]
+    pegs = [[tape.var(1), tape.var(), tape.var()] for _ in range(disks)]  # one-hot, all disks on A
+
+    def move(disk):
+        a, b, c = pegs[disk]
+        # the smallest disk goes A, C, B, A... for odd number of disks, then directions alternate
+        for source, target in ((a, temp), (b, a), (c, b), (temp, c)) if (disks - disk) % 2 else \
+                ((c, temp), (b, c), (a, b), (temp, a)):
+            tape.transfer(source, target)
+        tape.put(scratch, chr(ord("a") + disk))
+        tape.at(scratch, ".[-]")
+        tape.add(scratch, ord("A"))
+        tape.transfer(b, scratch, temp)
+        tape.transfer(temp, b)
+        tape.transfer(c, scratch, scratch, temp)
+        tape.transfer(temp, c)
+        tape.at(scratch, ".[-]")
+
+    def step(disk):
+        if disk == disks:  # all moves done
+            tape.add(run, -1)
+            return
+        tape.ifZero(bits[disk], lambda: (tape.add(bits[disk], 1), move(disk)),
+                    lambda: (tape.add(bits[disk], -1), step(disk + 1)))
+
+    tape.loop(run, lambda: step(0))
+
+    moves = []
+
+    def solve(disk, source, target, spare):
+        if disk >= 0:
+            solve(disk - 1, source, spare, target)
+            moves.append(chr(ord("a") + disk) + target)
+            solve(disk - 1, spare, target, source)
+
+    solve(disks - 1, "A", "C", "B")
+    return tape.program(), "", "".join(moves)
+
+
+def mandelbrot(scale=1.0):
+    """
+    The Mandelbrot set in fixed-point arithmetic, up to 10 * scale iterations per point - arithmetic in loops.
+
+    Numbers are kept as sign and magnitude cells in units of 1/6 (products are truncated), so the image is
+    a coarse 19x7 one, "*" for points in the set and "-" for the rest.
+
+    Examples:
+        >>> program, input, expected = mandelbrot(0.5)
+        >>> print(expected, end="")
+        -----------**------
+        -----**********----
+        ---*************---
+        ****************---
+        ---*************---
+        -----**********----
+        -----------**------
+        >>> Engine().run(program).decode() == expected
+        True
+    """
+    unit, iterations = 6, max(1, round(10 * scale))
+    tape = _Tape()
+    x, y, x2, y2, product, cx, cy = [(tape.var(), tape.var()) for _ in range(7)]  # (sign, magnitude) pairs
+    rows, columns, run, left, escape, copy, count, room, temp, flip, differ = [tape.var() for _ in range(11)]
+
+    def multiply(a, b, result):
+        # result = a * b / unit, the magnitude is truncated
+        tape.copy(a[1], copy, temp)
+        tape.add(room, unit)
+        tape.loop(copy, lambda: (tape.add(copy, -1), tape.copy(b[1], count, temp), tape.loop(count, lambda: (
+            tape.add(count, -1), tape.add(room, -1),
+            tape.ifZero(room, lambda: (tape.add(room, unit), tape.add(result[1], 1)))))))
+        tape.clear(room)
+        tape.ifZero(a[0], None, lambda: tape.add(result[0], 1))
+        tape.ifZero(b[0], None, lambda: tape.negate(result[0], flip))
+
+    def subtract(number, cell=None, constant=0):
+        # moves number towards zero by a cell (drained) or a constant, the sign flips when crossing zero
+        def decrement():
+            tape.ifZero(number[1], lambda: tape.add(temp, 1), lambda: tape.add(number[1], -1))
+        for _ in range(constant):
+            decrement()
+        if cell is not None:
+            tape.loop(cell, lambda: (tape.add(cell, -1), decrement()))
+        tape.ifZero(temp, None, lambda: (tape.transfer(temp, number[1]), tape.negate(number[0], flip)))
+
+    def add(number, other):
+        # number += other
+        tape.copy(other[1], count, temp)
+        tape.copy(number[0], differ, temp)
+        tape.ifZero(other[0], None, lambda: tape.negate(differ, flip))
+        tape.ifZero(differ, lambda: tape.transfer(count, number[1]), lambda: subtract(number, count))
+        tape.clear(differ)
+
+    def increase(number, constant):
+        # number += a positive constant
+        tape.ifZero(number[0], lambda: tape.add(number[1], constant), lambda: subtract(number, constant=constant))
+
+    def drain(value):
+        # escape -= value (a copy), stopping at zero
+        tape.copy(value, copy, temp)
+        tape.loop(copy, lambda: (tape.add(copy, -1), tape.ifZero(escape, None, lambda: tape.add(escape, -1))))
+
+    def iterate():
+        multiply(x, x, x2)
+        multiply(y, y, y2)
+        tape.add(escape, 4 * unit + 1)  # |z|^2 <= 4
+        drain(x2[1])
+        drain(y2[1])
+
+        def update():
+            multiply(x, y, product)
+            for cell in x + y:
+                tape.clear(cell)
+            tape.transfer(x2[1], x[1])
+            subtract(x, y2[1])
+            add(x, cx)
+            tape.transfer(product[0], y[0])
+            tape.transfer(product[1], y[1], y[1])
+            add(y, cy)
+            tape.add(left, -1)
+            tape.ifZero(left, lambda: tape.add(run, -1))
+
+        tape.ifZero(escape, lambda: tape.add(run, -1), update)
+        for cell in (escape,) + x2 + y2:
+            tape.clear(cell)
+
+    def point():
+        for cell in x + y:
+            tape.clear(cell)
+        tape.add(run, 1)
+        tape.add(left, iterations)
+        tape.loop(run, iterate)
+        tape.ifZero(left, lambda: tape.put(temp, "*"), lambda: (tape.put(temp, "-"), tape.clear(left)))
+        tape.at(temp, ".[-]")
+        increase(cx, 1)
+        tape.add(columns, -1)
+
+    def row():
+        tape.add(cx[0], 1)
+        tape.add(cx[1], 2 * unit)
+        tape.add(columns, 3 * unit + 1)
+        tape.loop(columns, point)
+        for cell in cx:
+            tape.clear(cell)
+        tape.put(temp, "\n")
+        tape.at(temp, ".[-]")
+        increase(cy, 2)
+        tape.add(rows, -1)
+
+    tape.add(cy[0], 1)
+    tape.add(cy[1], unit)
+    tape.add(rows, unit + 1)
+    tape.loop(rows, row)
+
+    expected = "".join("".join("*" if _escapes(cx, cy, unit, iterations) is None else "-" for cx in
+                               range(-2 * unit, unit + 1)) + "\n" for cy in range(-unit, unit + 1, 2))
+    return tape.program(), "", expected
+
+
+def _escapes(cx, cy, unit, iterations):
+    """
+    Returns:
+        The iteration escaping a point from the Mandelbrot set (in the arithmetic of `mandelbrot`), or None.
+    """
+    multiply = lambda a, b: (-1 if (a < 0) != (b < 0) else 1) * (abs(a) * abs(b) // unit)
+    x = y = 0
+    for i in range(iterations):
+        x2, y2 = multiply(x, x), multiply(y, y)
+        if x2 + y2 > 4 * unit:
+            return i
+        x, y = x2 - y2 + cx, 2 * multiply(x, y) + cy
+    return None
+
+
+class _Tape(object):
+
+    """
+    Generator of Brainfuck code, keeping track of the cell pointer.
+
+    Variables are cells three apart - the two cells after a variable belong to its zero tests.
+
+    Author:
+        Tomas Bedrich
+
+    Examples:
+        >>> tape = _Tape()
+        >>> a, b = tape.var(2), tape.var()
+        >>> tape.ifZero(a, lambda: tape.put(b, "z"), lambda: tape.put(b, "n"))
+        >>> tape.at(b, ".")
+        >>> Engine().run(tape.program())
+        b'n'
+    """
+
+    def __init__(self):
+        super(_Tape, self).__init__()
+        self.code = []
+        self.position = 0
+        self.cells = 0
+
+    def var(self, value=0):
+        """
+        Returns:
+            A new variable (a cell index), set to the value.
+        """
+        cell, self.cells = self.cells, self.cells + 3
+        self.add(cell, value)
+        return cell
+
+    def at(self, cell, code=""):
+        """
+        Moves to a cell and appends code, which must end at the cell.
+        """
+        self.code.append(">" * (cell - self.position) if cell > self.position else "<" * (self.position - cell))
+        self.code.append(code)
+        self.position = cell
+
+    def add(self, cell, value):
+        self.at(cell, "+" * value if value > 0 else "-" * -value)
+
+    def put(self, cell, char):
+        """
+        Sets a zero cell to a character code.
+        """
+        self.add(cell, ord(char))
+
+    def clear(self, cell):
+        self.at(cell, "[-]")
+
+    def loop(self, cell, body):
+        """
+        Repeats code generated by body() while the cell is not zero.
+        """
+        self.at(cell, "[")
+        body()
+        self.at(cell, "]")
+
+    def transfer(self, source, *targets):
+        """
+        Adds a cell to targets (a target given twice gets it twice), the source ends zero.
+        """
+        self.loop(source, lambda: [self.add(cell, -1 if cell == source else 1) for cell in (source,) + targets])
+
+    def copy(self, source, target, temp):
+        self.transfer(source, target, temp)
+        self.transfer(temp, source)
+
+    def negate(self, cell, temp):
+        """
+        Changes a cell of 0 or 1 to the other value.
+        """
+        self.add(temp, 1)
+        self.loop(cell, lambda: (self.add(cell, -1), self.add(temp, -1)))
+        self.transfer(temp, cell)
+
+    def ifZero(self, cell, zero=None, nonzero=None):
+        """
+        Generates code run if the cell is zero and code run otherwise, without changing the cell (unless
+        the code does). Both run in constant time, using the cells after the cell - tests of one cell
+        must not nest.
+        """
+        self.at(cell + 1, "+")
+        self.at(cell, "[")
+        if nonzero:
+            nonzero()
+        self.at(cell, ">-]>[<")
+        self.position = cell
+        if zero:
+            zero()
+        self.at(cell, ">->]<<")
+        self.position = cell
+
+    def program(self):
+        return "".join(self.code)
+
+
+WORKLOADS = OrderedDict([("hello", hello), ("sieve", sieve), ("loops", loops), ("output", output), ("echo", echo),
+                         ("hanoi", hanoi), ("mandelbrot", mandelbrot)])
+LANGUAGES = Engine.TYPES
+LEVELS = (0, 1)  # optimizer levels: none, minified (pyfuck convert -O)
+
+
+def brainfuck_cases(scale=1.0):
+    """
+    Cases of running each workload written in each language, with each optimizer level.
+
+    Images are converted before the measurement, so a case measures loading, decoding, compilation and execution.
+
+    Returns:
+        A generator of (name, setup) tuples, setup() returns a function running the case once.
+    """
+    for workload, generator in WORKLOADS.items():
+        for language in LANGUAGES:
+            for level in LEVELS:
+                yield "{}/{}/O{}".format(workload, language, level), \
+                    lambda generator=generator, language=language, level=level: \
+                    _brainfuck_case(generator(scale), language, level)
+
+
+def _brainfuck_case(workload, language, level):
+    program, input, expected = workload
+    engine = Engine()
+    if level:
+        program = Brainfuck().minify(program)
+    if language == "brainfuck":
+        source = program.encode()
+    elif language == "brainloller":
+        source = engine.convert(program, "brainloller")
+    else:
+        source = engine.convert(program, "braincopter", carrier=carrier(len(program)))
+    expected = expected.encode("latin-1")
+
+    def case():
+        stats = Stats()
+        if engine.run(source, input, type=language, stats=stats) != expected:
+            raise AssertionError("Wrong output.")
+        return {"instructions": stats.counters["brainfuck.instructions"]}
+
+    return case
+
+
+def carrier(length):
+    """
+    Creates a noise image able to carry a Braincopter program.
+
+    Args:
+        length: Program length.
+
+    Returns:
+        PNG file contents (bytes).
+    """
+    from pyfuck.png import PNGWriter
+
+    width = int(length ** 0.5) + 3
+    noise = random.Random(length)
+    f = io.BytesIO()
+    with PNGWriter(f, width, width, preset="fast") as writer:
+        for _ in range(width):
+            writer.writeRow(bytes(noise.getrandbits(8) for _ in range(3 * width)))
+    return f.getvalue()
+
+
+# image workloads ==============
+# Synthetic images - rows are shifted copies of random data, so they compress like busy photos.
+
+SIZES = tuple(10 ** exponent for exponent in range(3, 9))  # pixels, 1 KP to 100 MP
+KINDS = OrderedDict([("none", 0), ("sub", 1), ("up", 2), ("average", 3), ("paeth", 4), ("adaptive", "adaptive"),
+                     ("palette1", 1), ("palette2", 2), ("palette4", 4), ("palette8", 8)])  # filter or depth
+DENSITIES = (0.01, 0.1, 1.0)  # share of pixels holding a program
+
+
+def synthetic(pixels, kind="none", seed=0):
+    """
+    Creates a square-ish image - truecolour saved with a filter type, or indexed-colour of a bit depth.
+
+    Args:
+        pixels: Number of pixels.
+        kind: One of KINDS.
+        seed: Seed of the random data.
+
+    Returns:
+        PNG file contents (bytes).
+
+    Examples:
+        >>> from pyfuck.png import PNG
+        >>> image = PNG().load(io.BytesIO(synthetic(1000, "palette2")))
+        >>> image.header.width, image.header.height, image.header.depth, len(image.palette.palette)
+        (32, 31, 2, 4)
+    """
+    from pyfuck.png import PNGWriter
+
+    width = max(1, round(pixels ** 0.5))
+    height = max(1, pixels // width)
+    noise = random.Random(seed)
+    if kind.startswith("palette"):
+        count = 2 ** KINDS[kind]
+        colours = [(noise.getrandbits(8), noise.getrandbits(8), noise.getrandbits(8)) for _ in range(count)]
+        length, options = width, {"colours": colours}
+        data = noise.randbytes(2 * length).translate(bytes(i % count for i in range(256)))
+    else:
+        length, options = 3 * width, {"filtering": KINDS[kind]}
+        data = noise.randbytes(2 * length)
+
+    f = io.BytesIO()
+    with PNGWriter(f, width, height, preset="fast", **options) as writer:
+        for y in range(height):
+            shift = y * 7 % length
+            writer.writeRow(data[shift:shift + length])
+    return f.getvalue()
+
+
+def png_cases(scale=1.0):
+    """
+    Cases of loading and saving images of each kind, up to scale million pixels.
+
+    Returns:
+        A generator of (name, setup) tuples (see brainfuck_cases).
+    """
+    for size in _sizes(scale):
+        for kind in KINDS:
+            yield "png.load/{}/{}".format(kind, _label(size)), lambda size=size, kind=kind: _png_case(size, kind, False)
+            yield "png.save/{}/{}".format(kind, _label(size)), lambda size=size, kind=kind: _png_case(size, kind, True)
+
+
+def _png_case(size, kind, save):
+    from pyfuck.png import PNG
+
+    data = synthetic(size, kind)
+    image = PNG().load(io.BytesIO(data))
+    counters = {"pixels": image.header.width * image.header.height,
+                "bytes": sum(map(len, image.indices if image.indices is not None else image.rgb))}
+    filtering = KINDS[kind] if not kind.startswith("palette") else None
+
+    def case():
+        if save:
+            image.save(io.BytesIO(), "fast", filtering=filtering)
+        else:
+            PNG().load(io.BytesIO(data))
+        return counters
+
+    return case
+
+
+def language_cases(scale=1.0):
+    """
+    Cases of decoding and encoding Brainloller and Braincopter programs of each density,
+    in images up to scale million pixels.
+
+    Returns:
+        A generator of (name, setup) tuples (see brainfuck_cases).
+    """
+    for size in _sizes(scale):
+        for language in "brainloller", "braincopter":
+            for density in DENSITIES:
+                yield "{}.to_brainfuck/{}/{}".format(language, density, _label(size)), \
+                    lambda size=size, language=language, density=density: \
+                    _language_case(size, language, density, False)
+            for density in DENSITIES if language == "braincopter" else (1.0,):
+                yield "{}.to_{}/{}/{}".format(language, language, density, _label(size)), \
+                    lambda size=size, language=language, density=density: \
+                    _language_case(size, language, density, True)
+
+
+def _language_case(size, language, density, encode):
+    from pyfuck.png import PNG
+    from pyfuck.brainloller import Brainloller
+    from pyfuck.braincopter import Braincopter
+
+    brainloller, braincopter = Brainloller(), Braincopter()
+    interpreter = brainloller if language == "brainloller" else braincopter
+    if language == "brainloller":
+        width = max(3, round(size ** 0.5))
+        height = max(1, size // width)
+        capacity = width * height
+    else:
+        carrier = PNG().load(io.BytesIO(synthetic(size)))
+        width, height = carrier.header.width, carrier.header.height
+        capacity = Braincopter.capacity(width, height)  # turns take some pixels
+    noise = random.Random(size)
+    program = "".join(noise.choice("+-<>.,") for _ in range(max(1, min(capacity, int(width * height * density)))))
+
+    if language == "brainloller":
+        image = brainloller.to_brainloller(program, width)
+        black = bytes(width).translate(Brainloller._INDICES)  # NOPs below the program
+        image.setIndices(image.palette.palette, image.indices + [black] * (height - image.header.height))
+    else:
+        image = carrier if encode else braincopter.to_braincopter(program, carrier)
+    counters = {"pixels": image.header.width * image.header.height, "commands": len(program)}
+
+    def case():
+        if not encode:
+            interpreter.to_brainfuck(image)
+        elif language == "brainloller":
+            brainloller.to_brainloller(program, width)
+        else:
+            braincopter.to_braincopter(program, image)
+        return counters
+
+    return case
+
+
+def _sizes(scale):
+    return [size for size in SIZES if size <= 10 ** 6 * scale] or SIZES[:1]
+
+
+def _label(size):
+    """
+    Examples:
+        >>> _label(1000), _label(10 ** 8)
+        ('1K', '100M')
+    """
+    for unit, value in ("M", 10 ** 6), ("K", 10 ** 3):
+        if size >= value:
+            return "{}{}".format(size // value, unit)
+    return str(size)
+
+
+SUITES = OrderedDict([("brainfuck", brainfuck_cases), ("png", png_cases), ("languages", language_cases)])
+
+
+# measurement ==============
+
+def run(suite="brainfuck", scale=1.0, repeat=3, only=None, memory=True, progress=None):
+    """
+    Runs a benchmark suite.
+
+    Args:
+        suite: Name of a suite from SUITES.
+        scale: Size of workloads relative to the default.
+        repeat: Number of timed runs of each case, the fastest counts.
+        only: Run only cases whose name contains this text.
+        memory: Measure peak memory by an extra run traced by tracemalloc.
+        progress: Function called with the name and result of each finished case.
+
+    Returns:
+        A dict of results - scale, Python version and per case wall time, peak memory (bytes), counters
+        of processed units and their rates per second.
+
+    Examples:
+        >>> results = run(scale=0.01, repeat=1, only="loops/brainfuck")
+        >>> list(results["cases"])
+        ['loops/brainfuck/O0', 'loops/brainfuck/O1']
+        >>> results["cases"]["loops/brainfuck/O0"]["instructions"]
+        26406
+    """
+    results = OrderedDict([("suite", suite), ("scale", scale), ("python", platform.python_version()),
+                           ("cases", OrderedDict())])
+    for name, setup in SUITES[suite](scale):
+        if only and only not in name:
+            continue
+        case = setup()
+        result = OrderedDict()
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            counters = case()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        result["time"] = best
+        for unit, count in counters.items():
+            result[unit] = count
+            result[unit + "/s"] = count / best if best else 0.0
+
+        if memory:
+            tracemalloc.start()
+            try:
+                case()
+                result["peak"] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        results["cases"][name] = result
+        if progress is not None:
+            progress(name, result)
+    return results
+
+
+def compare(results, baseline, threshold=0.25):
+    """
+    Compares results to a baseline.
+
+    Args:
+        results: Results of `run`.
+        baseline: Results of an earlier `run` (e.g. loaded from a saved JSON).
+        threshold: Allowed relative increase of time and peak memory.
+
+    Raises:
+        ValueError: The results are not comparable.
+
+    Returns:
+        A list of (case, metric, ratio) tuples of regressions - ratios of the result to the baseline.
+
+    Examples:
+        >>> baseline = {"suite": "x", "scale": 1, "cases": {"a": {"time": 1.0, "peak": 100}}}
+        >>> compare({"suite": "x", "scale": 1, "cases": {"a": {"time": 1.5, "peak": 110}}}, baseline)
+        [('a', 'time', 1.5)]
+    """
+    if (results["suite"], results["scale"]) != (baseline["suite"], baseline["scale"]):
+        raise ValueError("Results of suite {} at scale {} cannot be compared to a baseline of suite {} at scale {}."
+                         .format(results["suite"], results["scale"], baseline["suite"], baseline["scale"]))
+    regressions = []
+    for name, result in results["cases"].items():
+        previous = baseline["cases"].get(name)
+        if previous is None:
+            continue
+        for metric in "time", "peak":
+            if previous.get(metric) and metric in result and result[metric] > (1 + threshold) * previous[metric]:
+                regressions.append((name, metric, result[metric] / previous[metric]))
+    return regressions
+
+
+def report(results, baseline=None, format="human"):
+    """
+    Formats results, with ratios to a baseline if given.
+
+    Args:
+        results: Results of `run`.
+        baseline: Results to compare to.
+        format: "human" (a table) or "json".
+
+    Returns:
+        A string.
+    """
+    if format == "json":
+        return json.dumps(results, indent=1)
+
+    lines = ["{:<28}{:>11}{:>8}{:>12}{:>8}  {}".format("case", "time [ms]", "ratio", "peak [KB]", "ratio", "rates")]
+    for name, result in results["cases"].items():
+        previous = (baseline or {}).get("cases", {}).get(name, {})
+        rates = ", ".join("{:.3g} M {}".format(value / 1e6, key) for key, value in result.items() if key.endswith("/s"))
+        lines.append("{:<28}{:>11.1f}{:>8}{:>12}{:>8}  {}".format(
+            name, 1000 * result["time"], _ratio(result, previous, "time"),
+            "{:.0f}".format(result["peak"] / 1024) if "peak" in result else "", _ratio(result, previous, "peak"),
+            rates))
+    return "\n".join(lines)
+
+
+def _ratio(result, previous, metric):
+    if not previous.get(metric) or metric not in result:
+        return ""
+    return "{:.2f}".format(result[metric] / previous[metric])
+
+
+if __name__ == '__main__':
+    print("This file is not meant to be executed directly. Please use it as a module instead.")
@@ -1,8 +1,16 @@
 #!/usr/bin/env python3
 
 
-from pyfuck.png import PNG
+from operator import getitem
+
+from pyfuck.png import PNG, PNGReader, PNGWriter, BYTEORDER, RGB
 from pyfuck.brainloller import Brainloller
+from pyfuck.stats import NULL_STATS
+
+try:
+    import numpy
+except ImportError:  # optional, speeds up decoding
+    numpy = None
 
 
 class Braincopter(object):
@@ -35,19 +43,48 @@ class Braincopter(object):
     COMMANDS_REVERSE = [">", "<", "+", "-", ".", ",", "[", "]", "R", "L", None]
     COMMANDS_REVERSE_LEN = len(COMMANDS_REVERSE)
 
-    def __init__(self):
+    # command index => Brainloller command plane byte
+    _CODES = bytes(ord(command) if command else Brainloller.NOP for command in COMMANDS_REVERSE)
+
+    # colour component => its contribution to the command index (modulo 11)
+    _RED = bytes((-2 * value) % 11 for value in range(256))
+    _GREEN = bytes((3 * value) % 11 for value in range(256))
+    _BLUE = bytes(value % 11 for value in range(256))
+
+    # sum of contributions => command plane byte, command index
+    _SUMS = (_CODES * 3).ljust(256, b"\0")
+    _MOD = bytes(range(11)) * 3 + bytes(256 - 33)
+
+    # command plane byte => command index
+    _INDICES = bytes(map({ord(command): index for index, command in enumerate(COMMANDS_REVERSE[:-1])}.get,
+                         range(256), [COMMANDS_REVERSE_LEN - 1] * 256))
+
+    # shifted index difference (0-20) => translation of blue component to its new value
+    _SHIFTS = [bytes(blue + shift - 10 + (11 if blue + shift < 10 else -11 if blue + shift > 265 else 0)
+                     for blue in range(256)) for shift in range(21)]
+
+    PARALLEL_PIXELS = 4 * 1024 * 1024  # images with fewer pixels are classified by one process
+
+    def __init__(self, workers=1):
+        """
+        Args:
+            workers: Number of processes classifying pixels of large images, by bands of rows.
+        """
         super(Braincopter, self).__init__()
         self.brainloller = Brainloller()
+        self.workers = workers
 
-    def to_brainfuck(self, image):
+    def to_brainfuck(self, image, limit=None, stats=None):
         """
         Converts Braincopter to Brainfuck.
 
         Args:
             image: An image containing the Braincopter program.
+            limit: Maximum program length (number of commands), unlimited by default.
+            stats: pyfuck.stats.Stats recording time of pixel grouping and the walk.
 
         Raises:
-            AttributeError, EOFError, ValueError
+            AttributeError, EOFError, ValueError, pyfuck.brainloller.LoopException
 
         Returns:
             A Brainfuck program
@@ -59,10 +96,145 @@ class Braincopter(object):
         if not isinstance(image, PNG):
             raise AttributeError("Image is not an instance of pyfuck.png.PNG.")
 
-        newPixels = [[self.COMMANDS[(-2 * r + 3 * g + b) % 11] for r, g, b in row] for row in image.pixels]
-        image.pixels = newPixels
+        if stats is None:
+            stats = NULL_STATS
+        width, height = image.header.width, image.header.height
+        with stats.stage("braincopter.plane"):
+            plane = self._plane(image)
+        stats.add("braincopter.pixels", width * height)
+        with stats.stage("braincopter.walk"):
+            program = self.brainloller._decode(plane, width, height, limit)
+        stats.add("braincopter.commands", len(program))
+        return program
+
+    def compile(self, image, limit=None, stats=None):
+        """
+        Compiles Braincopter program directly, without creating a Brainfuck string.
+
+        Args:
+            image: An image containing the Braincopter program.
+            limit: Maximum program length (number of commands), unlimited by default.
+            stats: pyfuck.stats.Stats recording time of pixel grouping and the compilation.
+
+        Raises:
+            AttributeError, ValueError, pyfuck.brainloller.LoopException
+
+        Returns:
+            A pyfuck.brainfuck.Bytecode object (see Brainloller.compile).
+        """
+        if not isinstance(image, PNG):
+            raise AttributeError("Image is not an instance of pyfuck.png.PNG.")
+
+        if stats is None:
+            stats = NULL_STATS
+        width, height = image.header.width, image.header.height
+        with stats.stage("braincopter.plane"):
+            plane = self._plane(image)
+        stats.add("braincopter.pixels", width * height)
+        with stats.stage("braincopter.compile"):
+            return self.brainloller._compile(plane, width, height, limit, stats)
+
+    def _plane(self, image):
+        """
+        Creates a Brainloller command plane of an image, without changing the image.
+
+        Pixels of truecolour images are classified by `_classify`. Images of at least PARALLEL_PIXELS pixels
+        are split to bands of rows classified by a pool of processes, the pixels and the plane are passed
+        in shared memory.
+
+        Args:
+            image: An image containing the Braincopter program.
+
+        Returns:
+            A list of bytes (see Brainloller._plane).
+
+        Examples:
+            >>> image = PNG()
+            >>> image.pixels = [[(0, 0, 0), (0, 0, 2), (255, 255, 249)], [(1, 1, 1), (0, 0, 10), (0, 0, 14)]]
+            >>> Braincopter()._plane(image)
+            [b'>+L', b'+\\x00-']
+        """
+        if image.indices is not None:
+            table = bytes(self._CODES[(-2 * r + 3 * g + b) % 11] for r, g, b in image.palette.palette)
+            return [row.translate(table.ljust(256, b"\0")) for row in image.indices]
+
+        width, height = image.header.width, image.header.height
+        if self.workers > 1 and width * height >= self.PARALLEL_PIXELS:
+            plane = self._classify_bands(image.rgb, width, height)
+        else:
+            plane = self._classify(b"".join(image.rgb), width)
+        return [plane[y:y + width] for y in range(0, len(plane), width)]
+
+    @classmethod
+    def _classify(cls, samples, width):
+        """
+        Translates pixels to Brainloller command plane bytes.
+
+        The command index (-2 * r + 3 * g + b) % 11 is computed by NumPy if available. Otherwise each colour
+        component plane is translated by a table to its contribution modulo 11, the three planes are summed
+        at once as big integers (each byte sum is at most 30, so there are no carries) and the sums are
+        translated to commands.
+
+        Args:
+            samples: Interleaved RGB samples of whole rows (a bytes-like object).
+            width: Row width in pixels.
+
+        Returns:
+            The plane rows joined (bytes).
+
+        Examples:
+            >>> Braincopter._classify(b"\\x00\\x00\\x00\\x00\\x00\\x02", 2)
+            b'>+'
+        """
+        if numpy is not None:
+            samples = numpy.frombuffer(samples, numpy.uint8).reshape(-1, width, 3).astype(numpy.int16)
+            indices = (-2 * samples[:, :, 0] + 3 * samples[:, :, 1] + samples[:, :, 2]) % 11
+            return numpy.frombuffer(cls._CODES, numpy.uint8)[indices].tobytes()
+
+        plane = []
+        for start in range(0, len(samples), RGB * width):
+            row = bytes(samples[start:start + RGB * width])
+            total = int.from_bytes(row[0::3].translate(cls._RED), BYTEORDER) + \
+                int.from_bytes(row[1::3].translate(cls._GREEN), BYTEORDER) + \
+                int.from_bytes(row[2::3].translate(cls._BLUE), BYTEORDER)
+            plane.append(total.to_bytes(width, BYTEORDER).translate(cls._SUMS))
+        return b"".join(plane)
+
+    def _classify_bands(self, rgb, width, height):
+        """
+        Classifies pixels by bands of rows in a pool of processes (see _classify).
 
-        return self.brainloller.to_brainfuck(image)
+        Rows are copied to shared memory once, the processes get only its name and their band
+        and write their part of the plane to another shared memory block.
+
+        Args:
+            rgb: A list of rows of interleaved RGB samples (bytes).
+            width: Row width in pixels.
+            height: Number of rows.
+
+        Returns:
+            The plane rows joined (bytes).
+        """
+        from concurrent.futures import ProcessPoolExecutor  # imported only for large images
+        from multiprocessing.shared_memory import SharedMemory
+
+        rowLength = RGB * width
+        source = SharedMemory(create=True, size=rowLength * height)
+        target = SharedMemory(create=True, size=width * height)
+        try:
+            for y, row in enumerate(rgb):
+                source.buf[y * rowLength:(y + 1) * rowLength] = row
+
+            band = -(-height // (4 * self.workers))  # a few bands per process balance the load
+            with ProcessPoolExecutor(self.workers) as pool:
+                for future in [pool.submit(_classify_band, source.name, target.name, width, top,
+                                           min(top + band, height)) for top in range(0, height, band)]:
+                    future.result()
+            return bytes(target.buf[:width * height])
+        finally:
+            for memory in source, target:
+                memory.close()
+                memory.unlink()
 
     def to_braincopter(self, program, image):
         """
@@ -82,66 +254,134 @@ class Braincopter(object):
             False
         """
 
-        def commands():
-            width = len(image.pixels) - 1
-            way_right = True
-            i = 0
-            for command in program:
-                # borders
-                if i == width:
-                    if way_right:
-                        yield "R"
-                        yield "R"
-                    else:
-                        yield "L"
-                        yield "L"
-                    way_right = not way_right
-                    i = 1
-
-                # commands
-                yield command
-                i += 1
-
-            # nop
-            while True:
-                yield None
-
-        command = commands()
-
-        # FIXME performance (maybe)
-        newPixels = [[self._find_similar(next(command), pixel)
-                     for pixel in (reversed(row) if i % 2 else row)]
-                     for i, row in enumerate(image.pixels)]
-        newPixels = [list(reversed(row)) if i % 2 else row for i, row in enumerate(newPixels)]
-        image.pixels = newPixels
-
-        if next(command):
+        width, height = image.header.width, image.header.height
+        code = self.brainloller._commands(program)
+        if len(code) > self.capacity(width, height):
             raise IOError("Image is too small to encode whole program.")
 
+        # only rows holding the program are changed, the rest is never reached by the program counter
+        rows = [row.translate(self._INDICES) for row in self.brainloller._serpentine(code, width)]
+        rgb = list(image.rgb)
+        rgb[:len(rows)] = self._encode(rgb[:len(rows)], rows, width)
+        image.rgb = rgb
         return image
 
-    @classmethod
-    def _find_similar(cls, command, pixel):
+    def transcode(self, program, source, destination, **options):
+        """
+        Encodes given Brainfuck program to an image, reading and writing it row by row.
+
+        Rows holding the program are changed the same way as by `to_braincopter`, the rest is passed through.
+        The memory used does not depend on the image size.
+
+        Args:
+            program: A Brainfuck program to encode.
+            source: A PNG image to change (filename or binary file object).
+            destination: Where to write the changed image (filename or binary file object).
+            options: pyfuck.png.PNGWriter options
+
+        Raises:
+            IOError, pyfuck.png.ValidationException
+
+        Examples:
+            >>> import io
+            >>> target = io.BytesIO()
+            >>> Braincopter().transcode(",[.,]", "test/assets/earth.png", target)
+            >>> Braincopter().to_brainfuck(PNG().load(io.BytesIO(target.getvalue())))
+            ',[.,]'
         """
-        Returns a similar colour according to desired command.
+        with PNGReader(source) as reader:
+            width, height = reader.header.width, reader.header.height
+            code = self.brainloller._commands(program)
+            if len(code) > self.capacity(width, height):
+                raise IOError("Image is too small to encode whole program.")
+
+            layout = self.brainloller._serpentine(code, width)
+            colours = [bytes(colour) for colour in reader.palette.palette] if reader.header.colour == 3 else None
+            with PNGWriter(destination, width, height, **options) as writer:
+                for row in reader.rows():
+                    if colours:
+                        row = b"".join(map(colours.__getitem__, row))
+                    targets = next(layout, None)
+                    if targets is not None:
+                        row = self._encode([row], [targets.translate(self._INDICES)], width)[0]
+                    writer.writeRow(row)
+
+    @staticmethod
+    def capacity(width, height):
+        """
+        Returns the maximum length of a program encodable to an image of given size.
+
+        The first row ends with a turn, next rows start and end with one, the last row holds
+        the rest (see Brainloller._serpentine). Images narrower than 3 pixels have no room for turns.
+
+        Args:
+            width: Image width.
+            height: Image height.
 
         Examples:
-            >>> Braincopter._find_similar("+", (0, 0, 0))
-            (0, 0, 2)
-            >>> Braincopter._find_similar(None, (0, 0, 0))
-            (0, 0, 10)
-            >>> Braincopter._find_similar("+", (255, 255, 255))
-            (255, 255, 253)
-            >>> Braincopter._find_similar("L", (255, 255, 253))
-            (255, 255, 249)
-        """
-        r, g, b = pixel
-        b += cls.COMMANDS_REVERSE.index(command) - (-2 * r + 3 * g + b) % 11
-        if b > 255:
-            b -= cls.COMMANDS_REVERSE_LEN
-        elif b < 0:
-            b += cls.COMMANDS_REVERSE_LEN
-        return (r, g, b)
+            >>> Braincopter.capacity(3, 5)
+            7
+            >>> Braincopter.capacity(351, 1)
+            351
+            >>> Braincopter.capacity(2, 10)
+            2
+        """
+        if height == 1 or width < 3:
+            return width
+        return 2 * (width - 1) + (height - 2) * (width - 2)
+
+    def _encode(self, rgb, targets, width):
+        """
+        Changes blue components of rows so they encode given command indices.
+
+        Args:
+            rgb: A list of rows of interleaved RGB samples (bytes).
+            targets: A list of rows of command indices (bytes), at most as long as rgb.
+            width: Row width in pixels.
+
+        Returns:
+            A list of changed rows.
+        """
+        if numpy is not None:
+            samples = numpy.frombuffer(b"".join(rgb[:len(targets)]), numpy.uint8).reshape(-1, width, 3)
+            samples = samples.astype(numpy.int16)
+            indices = (-2 * samples[:, :, 0] + 3 * samples[:, :, 1] + samples[:, :, 2]) % 11
+            blue = samples[:, :, 2] + numpy.frombuffer(b"".join(targets), numpy.uint8).reshape(-1, width) - indices
+            blue[blue > 255] -= self.COMMANDS_REVERSE_LEN
+            blue[blue < 0] += self.COMMANDS_REVERSE_LEN
+            samples[:, :, 2] = blue
+            data = samples.astype(numpy.uint8).tobytes()
+            return [data[y:y + 3 * width] for y in range(0, len(data), 3 * width)]
+
+        res = []
+        offset = int.from_bytes(b"\x0a" * width, BYTEORDER)
+        for row, target in zip(rgb, targets):
+            row = bytearray(row)
+            total = int.from_bytes(row[0::3].translate(self._RED), BYTEORDER) + \
+                int.from_bytes(row[1::3].translate(self._GREEN), BYTEORDER) + \
+                int.from_bytes(row[2::3].translate(self._BLUE), BYTEORDER)
+            indices = total.to_bytes(width, BYTEORDER).translate(self._MOD)
+            # index difference shifted to 0-20, each byte stays non-negative so there are no borrows
+            shifts = int.from_bytes(target, BYTEORDER) + offset - int.from_bytes(indices, BYTEORDER)
+            shifts = shifts.to_bytes(width, BYTEORDER)
+            row[2::3] = bytes(map(getitem, map(self._SHIFTS.__getitem__, shifts), row[2::3]))
+            res.append(bytes(row))
+        return res
+
+
+def _classify_band(source, target, width, top, bottom):
+    """
+    Classifies pixels of rows from top to bottom in shared memory - a job of Braincopter._classify_bands.
+    """
+    from multiprocessing.shared_memory import SharedMemory
+    source, target = SharedMemory(source), SharedMemory(target)
+    try:
+        samples = source.buf[top * RGB * width:bottom * RGB * width]
+        target.buf[top * width:bottom * width] = Braincopter._classify(samples, width)
+        samples.release()
+    finally:
+        source.close()
+        target.close()
 
 
 if __name__ == '__main__':
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 
 
+import re
 import sys
+import time
+from array import array
 from collections import namedtuple
 
+from pyfuck.stats import NULL_STATS
+
 
 class Brainfuck(object):
 
@@ -34,7 +39,14 @@ class Brainfuck(object):
 
     def __init__(self):
         super(Brainfuck, self).__init__()
+
+    def _getch(self):
+        """
+        Reads one character from the terminal. The platform specific implementation is found on first use
+        and replaces this method, so programs which never read the terminal never touch the tty modules.
+        """
         self._getch = Brainfuck._find_getch()
+        return self._getch()
 
     @staticmethod
     def _find_getch():
@@ -98,51 +110,136 @@ class Brainfuck(object):
             input = ""
         return namedtuple("Program", ['program', 'input'])(program, input)
 
-    def _compile(self, program):
+    def _compile(self, program, stats=None):
         """
         'Compiles' Brainfuck code.
 
         Args:
             program: A string with Brainfuck program.
+            stats: pyfuck.stats.Stats recording time and program size.
+
+        Raises:
+            ValueError
 
         Returns:
-            Two dimensional array with commands and possible jump destinations.
+            A pyfuck.brainfuck.Bytecode object with commands and their arguments - repeat counts or jump destinations.
 
         Examples:
-            >>> b._compile("+-.")
-            [['+', 0], ['-', 0], ['.', 0]]
-            >>> b._compile("comment.")
-            [['.', 0]]
-            >>> b._compile("print0:.[]")
-            [['.', 0], ['[', 2], [']', 1]]
+            >>> list(b._compile("++-."))
+            [('+', 2), ('-', 1), ('.', 1)]
+            >>> list(b._compile("comment."))
+            [('.', 1)]
+            >>> list(b._compile("print0:.[]"))
+            [('.', 1), ('[', 2), (']', 1)]
+            >>> b._compile("+]")
+            Traceback (most recent call last):
+            ...
+            ValueError: Unmatched ']' at 1.
         """
-        skipped = 0
-        compiled = []
-        stack = []
+        if stats is None:
+            stats = NULL_STATS
+        with stats.stage("brainfuck.compile"):
+            compiler = Compiler()
+            compiler.feed(program)
+            compiled = compiler.finish()
+        compiler.record(stats)
+        return compiled
 
-        for pos, command in enumerate(program):
+    def minify(self, program):
+        """
+        Returns the shortest equivalent of a Brainfuck! program.
 
-            if command not in self.COMMANDS:
-                skipped += 1
-                continue
+        Comments are stripped, runs of "+-" and "<>" are cancelled and dead loops (at the start of the program
+        or right after another loop, where the current cell is known to be zero) are dropped.
+        Since "<" stops at the first cell, "<" followed by ">" is cancelled only if the pointer is known to be
+        far enough from the first cell. User input (after "!") is kept.
 
-            # save while { pos to stack
-            if command is "[":
-                stack.append(pos - skipped)
-                compiled.append([command, 0])
+        Args:
+            program: A string with Brainfuck! program.
 
-            # pair while { and }
-            elif command is "]":
-                _ = stack.pop()
-                compiled.append([command, _])
-                compiled[_][1] = pos - skipped
+        Raises:
+            ValueError
 
+        Returns:
+            A string with Brainfuck! program.
+
+        Examples:
+            >>> b.minify("[comment, loop] +++-- >><. [-][->+<] >< +- >>><<.")
+            '+>.[-]>.'
+            >>> b.minify(",>>>><<" + "+" * 255 + ".!a")
+            ',>>-.!a'
+            >>> b.minify("<>.")
+            '<>.'
+        """
+        preprocessed = self.preprocess(program)
+        compiled = self._compile(preprocessed.program)
+        ops, args = compiled.ops.decode(), compiled.args
+
+        # (command, count, state after) - state is a lower bound of the pointer,
+        # whether the current cell is known to be zero and whether all cells are
+        out = []
+        initial = (0, True, True)
+
+        def push(command, count):
+            low, zero, pristine = out[-1][2] if out else initial
+
+            # cancel with the previous command
+            if command in "+-":
+                delta = count if command == "+" else -count
+                if out and out[-1][0] in "+-":
+                    previous = out.pop()
+                    delta += previous[1] if previous[0] == "+" else -previous[1]
+                    low, zero, pristine = out[-1][2] if out else initial
+                delta %= 256
+                if not delta:
+                    return
+                command, count = ("+", delta) if delta <= 128 else ("-", 256 - delta)
+
+            elif command in "<>" and out and out[-1][0] in "<>":
+                before = out[-2][2][0] if len(out) > 1 else initial[0]
+                # "<" then ">" can be cancelled only if "<" did not stop at the first cell
+                if out[-1][0] == ">" or before >= out[-1][1]:
+                    previous = out.pop()
+                    delta = (count if command == ">" else -count) + (previous[1] if previous[0] == ">" else -previous[1])
+                    if delta:
+                        push(*((">", delta) if delta > 0 else ("<", -delta)))
+                    return
+
+            if command in "+-":
+                state = (low, False, False)
+            elif command == ">":
+                state = (low + count, pristine, pristine)
+            elif command == "<":
+                state = (max(0, low - count), pristine, pristine)
+            elif command == ",":
+                state = (low, False, False)
+            elif command == "[":
+                state = (0, False, False)
+            elif command == "]":
+                state = (0, True, False)
             else:
-                compiled.append([command, 0])
+                state = (low, zero, pristine)
+            out.append((command, count, state))
+
+        pc = 0
+        while pc < len(ops):
+            command = ops[pc]
+            if command == "[" and (out[-1][2] if out else initial)[1]:
+                pc = args[pc] + 1  # dead loop, the cell is zero
+                continue
+            push(command, 1 if command in "[]" else args[pc])
+            pc += 1
 
-        return compiled
+        # moves and changes after the last output or loop have no effect
+        while out and out[-1][0] in "<>+-":
+            out.pop()
+
+        result = "".join(command * count for command, count, state in out)
+        if preprocessed.input:
+            result += "!" + preprocessed.input
+        return result
 
-    def eval(self, program, stdout=None, stdin=None):
+    def eval(self, program, stdout=None, stdin=None, stats=None):
         """
         Evaluates the Brainfuck! program.
 
@@ -150,6 +247,7 @@ class Brainfuck(object):
             program: A string with Brainfuck! program.
             stdout: Output destination. Passed to print() function. Default is sys.stdout.
             stdin: Input source. Any iterator returning individual chars can be passed. Default is sys.stdin.
+            stats: pyfuck.stats.Stats recording compilation and execution.
 
         Raises:
             EOFError, ValueError, IndexError
@@ -170,87 +268,290 @@ class Brainfuck(object):
             >>> b.eval(",", stdin="")
             Traceback (most recent call last):
             ...
-            EOFError: More input required.
+            EOFError: More input required at 0.
         """
         preprocessed = self.preprocess(program)
-        compiled = self._compile(preprocessed.program)
+        compiled = self._compile(preprocessed.program, stats)
+        self.execute(compiled, stdout, preprocessed.input or stdin, stats)
+
+    def execute(self, compiled, stdout=None, stdin=None, stats=None, steps=None):
+        """
+        Executes a compiled Brainfuck! program.
+
+        Args:
+            compiled: A pyfuck.brainfuck.Bytecode object (see _compile or Brainloller.compile).
+            stdout: Output destination. Passed to print() function. Default is sys.stdout.
+            stdin: Input source. Any iterator returning individual chars can be passed. Default is sys.stdin.
+            stats: pyfuck.stats.Stats recording time, executed instructions and tape size.
+            steps: Maximum number of executed instructions, checked at brackets (default: unlimited).
 
+        Raises:
+            EOFError, ValueError
+
+        Examples:
+            >>> b.execute(b._compile(",>,<.>."), stdin="ab")
+            ab
+            >>> import io
+            >>> from pyfuck.stats import Stats
+            >>> stats = Stats()
+            >>> b.execute(b._compile("++[>+<-]>>."), io.StringIO(), stats=stats)
+            >>> stats.counters
+            OrderedDict([('brainfuck.instructions', 14), ('brainfuck.tape', 3)])
+            >>> b.execute(b._compile("+[]"), steps=1000)
+            Traceback (most recent call last):
+            ...
+            ValueError: The program executed more than 1000 instructions.
+        """
         if stdout is None:
             stdout = sys.stdout
 
-        if preprocessed.input:
-            stdin = iter(preprocessed.input)
-        else:
-            try:
-                stdin = iter(stdin)
-            except TypeError:
-                stdin = None
+        try:
+            stdin = iter(stdin)
+        except TypeError:
+            stdin = None
+
+        ops, args = compiled.ops, compiled.args
+        LEFT, RIGHT, INC, DEC, OUT, IN, OPEN, CLOSE = Brainfuck.COMMANDS.encode()
 
         pc = 0  # = program counter
         cc = 0  # = cell counter
-        cc_max = 0  # = cell counter max
         cells = bytearray(1)
+        end = len(ops)
 
-        while True:
+        # executed instructions are counted per straight run, when a bracket is passed
+        if stats is None:
+            stats = NULL_STATS
+        limit = float("inf") if steps is None else steps
+        runs = None if stats is NULL_STATS and steps is None else compiled.runs()
+        steps = runs[0] if runs else 0
+        counting = runs is not None
+        start = time.perf_counter()
 
-            try:
-                command = compiled[pc][0]
-            except IndexError:
-                break
-
-            # logging.debug("Processing command: {}".format(compiled[pc]))
-
-            # move one cell left
-            if command is "<" and cc > 0:
-                cc -= 1
-
-            # move one cell right
-            elif command is ">":
-                cc += 1
-                if cc > cc_max:
-                    cells.append(0)
-                    cc_max += 1
-
-            # increment
-            elif command is "+":
-                if cells[cc] < 255:
-                    cells[cc] += 1
-                else:
-                    cells[cc] = 0
-
-            # decrement
-            elif command is "-":
-                if cells[cc] > 0:
-                    cells[cc] -= 1
-                else:
-                    cells[cc] = 255
-
-            # output current cc
-            elif command is ".":
-                print(chr(cells[cc]), end="", file=stdout)
-                stdout.flush()
-
-            # input and save to current
-            elif command is ",":
-                if stdin:
-                    try:
-                        _ = next(stdin)
-                    except StopIteration:
-                        raise EOFError("More input required.")
-                else:
-                    _ = self._getch()
-                cells[cc] = ord(_)
-
-            # while current is not 0
-            elif command is "[" and cells[cc] is 0:
-                pc = compiled[pc][1]
-
-            # end while
-            elif command is "]" and cells[cc] is not 0:
-                pc = compiled[pc][1]
+        try:
+            while pc < end:
+
+                command = ops[pc]
+
+                # increment
+                if command == INC:
+                    cells[cc] = (cells[cc] + args[pc]) & 0xFF
+
+                # decrement
+                elif command == DEC:
+                    cells[cc] = (cells[cc] - args[pc]) & 0xFF
+
+                # move cells right
+                elif command == RIGHT:
+                    cc += args[pc]
+                    if cc >= len(cells):
+                        cells.extend(bytes(cc - len(cells) + 1))
+
+                # move cells left, stop at the first one
+                elif command == LEFT:
+                    cc = max(0, cc - args[pc])
+
+                # while current is not 0
+                elif command == OPEN:
+                    if not cells[cc]:
+                        pc = args[pc]
+                    if counting:
+                        steps += runs[pc + 1]
+                        if steps > limit:
+                            raise ValueError("The program executed more than {} instructions.".format(limit))
+
+                # end while
+                elif command == CLOSE:
+                    if cells[cc]:
+                        pc = args[pc]
+                    if counting:
+                        steps += runs[pc + 1]
+                        if steps > limit:
+                            raise ValueError("The program executed more than {} instructions.".format(limit))
+
+                # output current cc
+                elif command == OUT:
+                    print(chr(cells[cc]), end="", file=stdout)
+                    stdout.flush()
+
+                # input and save to current
+                elif command == IN:
+                    if stdin:
+                        try:
+                            _ = next(stdin)
+                        except StopIteration:
+                            raise EOFError("More input required at {}.".format(compiled.location(pc)))
+                    else:
+                        _ = self._getch()
+                    cells[cc] = ord(_)
+
+                pc += 1
+        finally:
+            stats.time("brainfuck.execute", time.perf_counter() - start)
+            stats.add("brainfuck.instructions", steps)
+            stats.peak("brainfuck.tape", len(cells))
+
+
+class Bytecode(object):
+
+    """
+    Represents a compiled Brainfuck! program.
+
+    Commands are stored in `ops` (bytes), their arguments in `args` (repeat count of "<>+-.,"
+    or a jump destination of "[]") and positions of commands in the source in `origins`.
+    For image programs (width is set) the positions are y * width + x.
+
+    Author:
+        Tomas Bedrich
+    """
+
+    def __init__(self, width=None):
+        super(Bytecode, self).__init__()
+        self.ops = bytearray()
+        self.args = array("l")
+        self.origins = array("q")
+        self.width = width
+
+    def location(self, index):
+        """
+        Returns source location of a command - an offset in the source text or [x,y] pixel of an image.
+
+        Examples:
+            >>> compiler = Compiler(width=10)
+            >>> compiler.feed("+\\0.", 21, 10)
+            >>> compiler.finish().location(1)
+            '[1,4]'
+        """
+        return self.describe(self.origins[index])
+
+    def describe(self, origin):
+        """
+        Formats a source position.
+        """
+        if self.width is None:
+            return str(origin)
+        return "[{},{}]".format(origin % self.width, origin // self.width)
+
+    def runs(self):
+        """
+        Returns:
+            Lengths of straight runs - for each command, number of commands executed up to the next bracket
+            (inclusive), plus 0 for the end of the program.
+
+        Examples:
+            >>> list(b._compile("+[->+<]>.").runs())
+            [2, 1, 5, 4, 3, 2, 1, 2, 1, 0]
+        """
+        runs = [0] * (len(self.ops) + 1)
+        brackets = (_OPEN, _CLOSE)
+        for pc in range(len(self.ops) - 1, -1, -1):
+            runs[pc] = 1 if self.ops[pc] in brackets else runs[pc + 1] + 1
+        return runs
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __iter__(self):
+        return zip(self.ops.decode(), self.args)
+
+
+class Compiler(object):
+
+    """
+    Incremental Brainfuck! compiler.
+
+    Source code is fed in parts (e.g. straight segments of an image program) and compiled on the fly:
+    runs of "<>+-" are folded to one command, brackets are paired and positions of commands kept.
+
+    Author:
+        Tomas Bedrich
+
+    Examples:
+        >>> compiler = Compiler()
+        >>> compiler.feed("++[>")
+        >>> compiler.feed(">-]", 4)
+        >>> list(compiler.finish())
+        [('+', 2), ('[', 4), ('>', 2), ('-', 1), (']', 1)]
+    """
+
+    PATTERN = re.compile(r"\++|-+|>+|<+|[.,\[\]]")
+    FOLDED = frozenset(b"<>+-")
+
+    def __init__(self, width=None):
+        """
+        Args:
+            width: Image width, if the source is an image.
+        """
+        super(Compiler, self).__init__()
+        self.bytecode = Bytecode(width)
+        self.stack = []
+        self.length = 0  # source commands fed
+
+    def feed(self, code, start=0, step=1):
+        """
+        Compiles a part of source code.
+
+        Args:
+            code: A string with Brainfuck program, other characters are ignored.
+            start: Position of the first character in the source.
+            step: Position difference of two consecutive characters.
+
+        Raises:
+            ValueError
+        """
+        bytecode, stack, folded = self.bytecode, self.stack, self.FOLDED
+        ops, args, origins = bytecode.ops, bytecode.args, bytecode.origins
+
+        for match in self.PATTERN.finditer(code):
+            pos = match.start()
+            command = ord(code[pos])
+            count = match.end() - pos
+            self.length += count
+
+            # continue a run of the same command
+            if command in folded and ops and ops[-1] == command:
+                args[-1] += count
+                continue
+
+            # save while { pos to stack
+            if command == _OPEN:
+                stack.append(len(ops))
+                args.append(0)
+
+            # pair while { and }
+            elif command == _CLOSE:
+                if not stack:
+                    raise ValueError("Unmatched ']' at {}.".format(bytecode.describe(start + pos * step)))
+                _ = stack.pop()
+                args[_] = len(ops)
+                args.append(_)
+
+            else:
+                args.append(count)
+
+            ops.append(command)
+            origins.append(start + pos * step)
+
+    def record(self, stats):
+        """
+        Records size of the source and the compiled program.
+        """
+        stats.add("brainfuck.commands", self.length)
+        stats.add("brainfuck.ops", len(self.bytecode))
+
+    def finish(self):
+        """
+        Returns:
+            The compiled program - a pyfuck.brainfuck.Bytecode object.
+
+        Raises:
+            ValueError
+        """
+        if self.stack:
+            raise ValueError("Unmatched '[' at {}.".format(self.bytecode.location(self.stack[-1])))
+        return self.bytecode
 
-            pc += 1
 
+_OPEN, _CLOSE = b"[]"
 
 if __name__ == '__main__':
     print("This file is not meant to be executed directly. Please use it as a module instead.")
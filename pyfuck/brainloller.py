@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 
 
-import logging
+import re
+from bisect import bisect_left, bisect_right
+from math import ceil, log, sqrt
 
-from pyfuck.png import PNG
-from pyfuck.brainfuck import Brainfuck
+from pyfuck.png import PNG, RGB
+from pyfuck.brainfuck import Brainfuck, Compiler
+from pyfuck.stats import NULL_STATS
 
 
 class Brainloller(object):
@@ -36,19 +39,36 @@ class Brainloller(object):
     COMMANDS_REVERSE.pop("R")
     COMMANDS_REVERSE.pop("L")
 
+    # command plane bytes (see _plane)
+    CODES = {colour: ord(command) for colour, command in COMMANDS.items()}
+    NOP = 0
+
+    # palette of created images, NOP is black
+    _COLOURS = list(COMMANDS) + [(0, 0, 0)]
+    _INDICES = bytes(map({ord(command): index for index, command in enumerate(COMMANDS.values())}.get,
+                         range(256), [len(COMMANDS)] * 256))
+
+    # for telling Brainloller from Braincopter images (see sniff)
+    THRESHOLD = 0.8  # share of command pixels
+    SAMPLE = 4096  # max pixels sampled
+    SAMPLE_ROW = 64  # max pixels sampled from one row
+    CONFIDENCE = log(2 / 0.001)  # Hoeffding bound for 99.9% confidence
+
     def __init__(self):
         super(Brainloller, self).__init__()
         self.brainfuck = Brainfuck()
 
-    def to_brainfuck(self, image):
+    def to_brainfuck(self, image, limit=None, stats=None):
         """
         Converts Brainloller to Brainfuck.
 
         Args:
             image: An image containing the Brainloller program.
+            limit: Maximum program length (number of commands), unlimited by default.
+            stats: pyfuck.stats.Stats recording time of pixel grouping and the walk.
 
         Raises:
-            AttributeError, EOFError, ValueError
+            AttributeError, EOFError, ValueError, pyfuck.brainloller.LoopException
 
         Returns:
             A Brainfuck program
@@ -63,50 +83,298 @@ class Brainloller(object):
         if not isinstance(image, PNG):
             raise AttributeError("Image is not an instance of pyfuck.png.PNG.")
 
+        if stats is None:
+            stats = NULL_STATS
+        width, height = image.header.width, image.header.height
+        with stats.stage("brainloller.plane"):
+            plane = self._plane(image)
+        stats.add("brainloller.pixels", width * height)
+        with stats.stage("brainloller.walk"):
+            program = self._decode(plane, width, height, limit)
+        stats.add("brainloller.commands", len(program))
+        return program
+
+    def _decode(self, plane, width, height, limit=None):
+        """
+        Walks the command plane and collects the Brainfuck program.
+
+        Args:
+            plane: A command plane (see _plane).
+            width: Plane width.
+            height: Plane height.
+            limit: Maximum program length (number of commands), unlimited by default.
+
+        Raises:
+            ValueError, pyfuck.brainloller.LoopException
+
+        Returns:
+            A Brainfuck program
+        """
+        nop = bytes((self.NOP,))
         program = []
+        length = 0
+        for segment, start, step in self._walk(plane, width, height):
+            segment = segment.translate(None, nop)
+            length += len(segment)
+            if limit is not None and length > limit:
+                raise ValueError("The program is longer than {} commands.".format(limit))
+            program.append(segment)
+        return b"".join(program).decode()
+
+    def _walk(self, plane, width, height):
+        """
+        Walks the command plane the same way as the program counter does.
 
-        pcX = 0  # = program counter X
-        pcY = 0  # = program counter Y
-        NORTH, EAST, SOUTH, WEST = range(4)
-        way = EAST  # program counter way
+        Instead of stepping pixel by pixel, whole straight segments between turn (R or L) pixels are sliced
+        out of the plane. Positions of turns are found once per row (and per column, when needed).
 
-        while (0 <= pcX < image.header.width) and (0 <= pcY < image.header.height):
+        Args:
+            plane: A command plane (see _plane).
+            width: Plane width.
+            height: Plane height.
+
+        Raises:
+            pyfuck.brainloller.LoopException
 
-            colour = image.pixels[pcY][pcX]
-            command = self.COMMANDS.get(colour)
+        Returns:
+            A generator of (segment, start, step) tuples. The segment are the plane bytes in the order of
+            walking (NOPs included, turns excluded), start is the position of its first pixel (y * width + x)
+            and step the position difference of two consecutive pixels.
 
-            logging.debug("Processing pixel at [{},{}], colour {} - command: {}".format(pcX, pcY, colour, command))
+        Examples:
+            >>> plane = [b"+.R", b"-\\x00R"]
+            >>> list(Brainloller()._walk(plane, 3, 2))
+            [(b'+.', 0, 1), (b'', 5, 3), (b'\\x00-', 4, -1)]
+        """
+        NORTH, EAST, SOUTH, WEST = range(4)
+        R = ord("R")
+        turns = re.compile(b"[RL]")
 
-            # rotate right
-            if command is "R":
-                way = (way + 1) % 4
+        rows = {}  # y => turn positions
+        columns = {}  # x => (column, turn positions)
 
-            # rotate left
-            elif command is "L":
-                way = (way - 1) % 4
+        def row(y):
+            try:
+                return rows[y]
+            except KeyError:
+                rows[y] = [match.start() for match in turns.finditer(plane[y])]
+                return rows[y]
 
-            # command
-            elif command is not None:
-                program.append(command)
+        def column(x):
+            try:
+                return columns[x]
+            except KeyError:
+                data = bytes(row[x] for row in plane)
+                columns[x] = data, [match.start() for match in turns.finditer(data)]
+                return columns[x]
+
+        # The program counter state is (x, y, way), so after 4 * width * height turns some state must have
+        # been revisited. Each state has also exactly one predecessor, so a walk entering the image from
+        # outside always leaves it again and this is only a safety net - it is cheaper than a visited set.
+        turnsLeft = 4 * width * height
+
+        x, y, way = 0, 0, EAST
+        while True:
+
+            # straight segment to the next turn or image border
+            if way == EAST or way == WEST:
+                data, positions = plane[y], row(y)
+                if way == EAST:
+                    i = bisect_left(positions, x)
+                    end = positions[i] if i < len(positions) else width
+                    yield data[x:end], y * width + x, 1
+                    if end == width:
+                        return
+                else:
+                    i = bisect_right(positions, x) - 1
+                    end = positions[i] if i >= 0 else -1
+                    yield data[end + 1:x + 1][::-1], y * width + x, -1
+                    if end < 0:
+                        return
+                x = end
+            else:
+                data, positions = column(x)
+                if way == SOUTH:
+                    i = bisect_left(positions, y)
+                    end = positions[i] if i < len(positions) else height
+                    yield data[y:end], y * width + x, width
+                    if end == height:
+                        return
+                else:
+                    i = bisect_right(positions, y) - 1
+                    end = positions[i] if i >= 0 else -1
+                    yield data[end + 1:y + 1][::-1], y * width + x, -width
+                    if end < 0:
+                        return
+                y = end
+
+            # detect loops
+            turnsLeft -= 1
+            if turnsLeft < 0:
+                raise LoopException(x, y, way)
+
+            # rotate
+            way = (way + (1 if plane[y][x] == R else -1)) % 4
 
             # program counter depends on the way
             if way == EAST:
-                pcX += 1
+                x += 1
             elif way == SOUTH:
-                pcY += 1
+                y += 1
             elif way == WEST:
-                pcX -= 1
+                x -= 1
             else:
-                pcY -= 1
+                y -= 1
 
-        return "".join(program)
+            if not (0 <= x < width and 0 <= y < height):
+                return
 
-    def to_brainloller(self, program):
+    def compile(self, image, limit=None, stats=None):
+        """
+        Compiles Brainloller program directly, without creating a Brainfuck string.
+
+        Straight segments of the program are compiled as they are walked, source positions are pixels.
+
+        Args:
+            image: An image containing the Brainloller program.
+            limit: Maximum program length (number of commands), unlimited by default.
+            stats: pyfuck.stats.Stats recording time of pixel grouping and the compilation.
+
+        Raises:
+            AttributeError, ValueError, pyfuck.brainloller.LoopException
+
+        Returns:
+            A pyfuck.brainfuck.Bytecode object.
+
+        Examples:
+            >>> compiled = Brainloller().compile(PNG().load("test/assets/hello_world.brainloller.png"))
+            >>> Brainfuck().execute(compiled)
+            Hello World!
+            >>> compiled.location(len(compiled) - 1)
+            '[110,0]'
+        """
+        if not isinstance(image, PNG):
+            raise AttributeError("Image is not an instance of pyfuck.png.PNG.")
+
+        if stats is None:
+            stats = NULL_STATS
+        width, height = image.header.width, image.header.height
+        with stats.stage("brainloller.plane"):
+            plane = self._plane(image)
+        stats.add("brainloller.pixels", width * height)
+        with stats.stage("brainloller.compile"):
+            return self._compile(plane, width, height, limit, stats)
+
+    def _compile(self, plane, width, height, limit=None, stats=None):
+        """
+        Walks the command plane and compiles the Brainfuck program.
+
+        Args:
+            plane: A command plane (see _plane).
+            width: Plane width.
+            height: Plane height.
+            limit: Maximum program length (number of commands), unlimited by default.
+            stats: pyfuck.stats.Stats recording the program size.
+
+        Raises:
+            ValueError, pyfuck.brainloller.LoopException
+
+        Returns:
+            A pyfuck.brainfuck.Bytecode object.
+        """
+        compiler = Compiler(width)
+        for segment, start, step in self._walk(plane, width, height):
+            compiler.feed(segment.decode("latin-1"), start, step)
+            if limit is not None and compiler.length > limit:
+                raise ValueError("The program is longer than {} commands.".format(limit))
+        compiled = compiler.finish()
+        if stats is not None:
+            compiler.record(stats)
+        return compiled
+
+    def sniff(self, image):
+        """
+        Decides whether an image is a Brainloller program, from a sample of its pixels.
+
+        Only first rows of an image are decoded (see PNG.rows) - pixels are sampled evenly across each row
+        and the sampling stops as soon as the share of command colours is decided (Hoeffding bound).
+
+        Args:
+            image: An image (possibly lazily loaded).
+
+        Returns:
+            A tuple of decision, share of command pixels in the sample and the sample size.
+
+        Examples:
+            >>> Brainloller().sniff(PNG().load("test/assets/hello_world.brainloller.png", lazy=True))
+            (True, 1.0, 111)
+            >>> Brainloller().sniff(PNG().load("test/assets/earth.png", lazy=True))[0]
+            False
+        """
+        if image.header.colour == 3:  # truecolour images may have a suggested palette too
+            commands = {i for i, colour in enumerate(image.palette.palette) if colour in self.COMMANDS}
+            offsets = 1
+        else:
+            commands = set(map(bytes, self.COMMANDS))
+            offsets = RGB
+        step = max(1, image.header.width // self.SAMPLE_ROW) * offsets
+        start = step // 2 // offsets * offsets  # stratified - middles of row intervals
+
+        i = 0
+        score = 0
+        for row in image.rows():
+            for x in range(start, len(row) - offsets + 1, step):
+                i += 1
+                if (row[x] if offsets == 1 else row[x:x + RGB]) in commands:
+                    score += 1
+            if i >= self.SAMPLE or abs(score / i - self.THRESHOLD) > sqrt(self.CONFIDENCE / (2 * i)):
+                break
+
+        return i * self.THRESHOLD < score, score / i, i
+
+    def _plane(self, image):
+        """
+        Creates a command plane of an image.
+
+        The command plane is a list of rows (bytes), where each byte is either a command character or NOP.
+        Indexed-colour images are translated by a lookup table created from their palette, so each row
+        costs only one `bytes.translate` call.
+
+        Args:
+            image: An image containing the Brainloller program.
+
+        Returns:
+            A list of bytes.
+
+        Examples:
+            >>> Brainloller()._plane(PNG().load("test/assets/squares.png"))
+            [b'>+.', b'\\x00\\x00\\x00', b'[\\x00R']
+        """
+        if image.indices is not None:
+            table = bytearray(256)
+            for index, colour in enumerate(image.palette.palette):
+                table[index] = self.CODES.get(colour, self.NOP)
+            table = bytes(table)
+            return [row.translate(table) for row in image.indices]
+
+        lookup = self.CODES.get
+        nop = self.NOP
+        return [bytes(lookup(pixel, nop) for pixel in row) for row in image.pixels]
+
+    def to_brainloller(self, program, width=None, ratio=1.0):
         """
         Converts Brainfuck to Brainloller.
 
+        The program is folded to a serpentine (see _serpentine) using R and L turn pixels. The last row is padded
+        by turns out of the image rather than black NOPs, so narrow last rows do not hide the image from sniff.
+
         Args:
             program: A Brainfuck program to encode.
+            width: Image width, at least 3 for programs longer than one row. Computed from ratio by default.
+            ratio: Desired ratio of image width to height, used when width is not set.
+
+        Raises:
+            ValueError
 
         Returns:
             A PNG object containing Brainloller image.
@@ -118,20 +386,113 @@ class Brainloller(object):
             width: 1
             height: 1
             ...
+            >>> image = Brainloller().to_brainloller("+" * 100)
+            >>> image.header.width, image.header.height
+            (10, 13)
+            >>> image = Brainloller().to_brainloller("+" * 100, ratio=4)
+            >>> image.header.width, image.header.height
+            (20, 6)
         """
-        res = []
-
-        for command in program:
-            try:
-                res.append(self.COMMANDS_REVERSE[command])
-            except KeyError:
-                # unknown characters are comments in Brainfuck
-                continue
+        code = self._commands(program)
+        if width is None:
+            width = max(1, ceil(sqrt(len(code) * ratio)))
+            if len(code) > width:
+                width = max(width, 3)
 
         image = PNG()
-        image.pixels = [res]
+        rows = self._serpentine(code, width, exit=True)
+        image.setIndices(self._COLOURS, [row.translate(self._INDICES) for row in rows])
         return image
 
+    def _serpentine(self, program, width, exit=False):
+        """
+        Lays out a Brainfuck program along a boustrophedon path.
+
+        The first row is walked east, the next one west and so on. Turns are placed to the row ends only
+        when the program continues - two R turns from an east row to the next one, two L turns from a west row.
+        The last row is padded by NOPs, so the program counter leaves the image behind the last command.
+
+        Args:
+            program: A Brainfuck program (comments are ignored), string or bytes.
+            width: Row width, at least 3 for programs longer than one row.
+            exit: Pad the last row by turns to the south instead - the first one leads the program counter
+                out of the image, the rest is never reached.
+
+        Raises:
+            ValueError
+
+        Returns:
+            A generator of command plane rows (see _plane).
+
+        Examples:
+            >>> list(Brainloller()._serpentine("+++++.+", 3))
+            [b'++R', b'L+R', b'L+R', b'L+R', b'L.+']
+            >>> list(Brainloller()._serpentine("+.", 3))
+            [b'+.\\x00']
+            >>> list(Brainloller()._serpentine("+++++", 4, exit=True))
+            [b'+++R', b'L++R']
+        """
+        code = self._commands(program)
+        pos, y = 0, 0
+        while True:
+            entry = b"" if y == 0 else b"R" if y % 2 else b"L"
+            slots = width - len(entry)
+            last = len(code) - pos <= slots
+            if last:
+                line = entry + code[pos:]
+            elif slots < 2:
+                raise ValueError("The image is too narrow to turn the program.")
+            else:
+                line = entry + code[pos:pos + slots - 1] + (b"L" if y % 2 else b"R")
+                pos += slots - 1
+
+            line = line.ljust(width, (b"L" if y % 2 else b"R") if exit else bytes((self.NOP,)))
+            yield line[::-1] if y % 2 else line
+
+            if last:
+                return
+            y += 1
+
+    @staticmethod
+    def _commands(program):
+        """
+        Returns Brainfuck commands of a program as bytes, without comments.
+
+        Examples:
+            >>> Brainloller._commands("print: .")
+            b'.'
+        """
+        if isinstance(program, str):
+            program = program.encode()
+        return program.translate(None, _NOT_COMMANDS)
+
+
+# every byte except Brainfuck commands
+_NOT_COMMANDS = bytes(sorted(set(range(256)) - set(Brainfuck.COMMANDS.encode())))
+
+
+class LoopException(ValueError):
+
+    """
+    Raised when the program counter never leaves the image.
+
+    Attributes:
+        x, y: position of a turn pixel in the loop
+        way: program counter direction when entering the pixel (0 = north, 1 = east, 2 = south, 3 = west)
+
+    Author:
+        Tomas Bedrich
+    """
+
+    WAYS = ("north", "east", "south", "west")
+
+    def __init__(self, x, y, way):
+        super(LoopException, self).__init__(
+            "The program counter is trapped in a loop at [{},{}] heading {}.".format(x, y, self.WAYS[way]))
+        self.x = x
+        self.y = y
+        self.way = way
+
 
 if __name__ == '__main__':
     print("This file is not meant to be executed directly. Please use it as a module instead.")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+
+import os
+import tempfile
+from hashlib import sha256
+
+
+class Cache(object):
+
+    """
+    Content-addressed on-disk cache of conversion results.
+
+    Entries are files named by a sha256 key (see `key`), spread to subdirectories by the first two hex digits.
+    Entries are written atomically (a temporary file is renamed), so processes can share one directory.
+    When the total size exceeds the limit, least recently used entries are removed.
+
+    Author:
+        Tomas Bedrich
+
+    Examples:
+        >>> cache = Cache(tempfile.mkdtemp(), size=10)
+        >>> key = cache.key(b"source", "brainfuck")
+        >>> cache.get(key) is None
+        True
+        >>> cache.put(key, b"123456")
+        >>> cache.get(key)
+        b'123456'
+        >>> other = cache.key(b"other", "brainfuck")
+        >>> cache.put(other, b"789012")  # over the size, one entry is evicted
+        >>> [cache.get(key), cache.get(other)].count(None)
+        1
+    """
+
+    VERSION = b"pyfuck-cache-1"  # change to invalidate entries of older formats
+
+    def __init__(self, directory, size=256 * 1024 * 1024):
+        """
+        Args:
+            directory: Where to keep entries, created if missing.
+            size: Maximum total size of entries in bytes.
+        """
+        super(Cache, self).__init__()
+        self.directory = directory
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def key(cls, *parts):
+        """
+        Computes a key from parts - bytes are hashed, other parts are included by their repr().
+
+        Returns:
+            A hex string.
+        """
+        digest = sha256(cls.VERSION)
+        for part in parts:
+            if not isinstance(part, (bytes, bytearray, memoryview)):
+                part = repr(part).encode()
+            digest.update(sha256(part).digest())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Returns:
+            Cached bytes, or None.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # recently used
+        except FileNotFoundError:  # missing or just evicted
+            return None
+        return data
+
+    def put(self, key, data):
+        """
+        Stores bytes under a key, then evicts least recently used entries above the size limit.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for bucket in os.scandir(self.directory):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.startswith("."):  # being written
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:  # evicted by another process
+                pass
+            total -= size
+
+
+if __name__ == '__main__':
+    print("This file is not meant to be executed directly. Please use it as a module instead.")
@@ -2,10 +2,16 @@
 
 
 import logging
+import os
+import time
 import zlib
-from math import floor
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate, chain
 from io import IOBase
 
+from pyfuck.stats import NULL_STATS
+
 
 BYTEORDER = "big"  # PNG is big endian
 RGB = 3  # 3 colour components
@@ -27,12 +33,26 @@ class PNG(object):
     CHUNK_LEN = 4  # bytes
     CHUNK_TYPE = 4  # bytes
     CHUNK_CRC = 4  # bytes
+    PALETTE_MAX = 256  # colours, more colourful images are written as truecolour
+
+    # compression presets - zlib level, zlib strategy and scanline filtering
+    # (adaptive filtering tries every filter type on each row, it is several times slower)
+    PRESETS = {
+        "fast": {"level": 1, "strategy": zlib.Z_DEFAULT_STRATEGY, "filtering": 0},
+        "default": {"level": 6, "strategy": zlib.Z_DEFAULT_STRATEGY, "filtering": 0},
+        "best": {"level": 9, "strategy": zlib.Z_FILTERED, "filtering": "adaptive"},
+    }
 
     def __init__(self):
         super(PNG, self).__init__()
-        PNG.IEND = Chunk(0, b"IEND", b"", b"\xaeB`\x82")
 
         self.header = None
+        self.palette = None
+        self._indices = None
+        self._rgb = None
+        self._pixels = None
+        self._decoded = None  # rows decoded so far by a lazy load
+        self._reader = None  # the rest of rows
         self.close = False
 
     def __del__(self):
@@ -46,19 +66,21 @@ class PNG(object):
     def _open(self, target, mode="rb"):
         self._close()
         if issubclass(type(target), IOBase):
-            self.filename = target.name
+            self.filename = getattr(target, "name", "<buffer>")
             self.file = target
         else:
             self.filename = target
             self.file = open(self.filename, mode)
             self.close = True
 
-    def load(self, target):
+    def load(self, target, lazy=False, stats=None):
         """
         Loads a PNG file to actual instance.
 
         Args:
             target: source
+            lazy: read only the header and palette now, image data are decoded on first access (see `rows`)
+            stats: pyfuck.stats.Stats recording decompression and unfiltering
 
         Raises:
             pyfuck.png.ValidationException, IOError
@@ -81,240 +103,264 @@ class PNG(object):
             >>> PNG().load("test/assets/not.found") #doctest: +ELLIPSIS
             Traceback (most recent call last):
             FileNotFoundError: ...
+
+            >>> p = PNG().load("test/assets/squares.png", lazy=True)
+            >>> next(p.rows())
+            b'\\xff\\x00\\x00\\x00\\xff\\x00\\x00\\x00\\xff'
+            >>> p.pixels[2]
+            [(255, 255, 0), (255, 0, 255), (0, 255, 255)]
         """
         self._open(target, "rb")
-        self._read()
+        self._read(stats)
+        if not lazy:
+            self._decode()
         return self
 
-    def save(self, target):
+    def save(self, target, preset="default", level=None, strategy=None, filtering=None, workers=None):
         """
         Saves an instance as a PNG file.
 
         Args:
             target: destination
+            preset: name of compression preset from `PRESETS` - "fast", "default" or "best"
+            level: zlib compression level (0-9), overrides the preset
+            strategy: zlib compression strategy (e.g. zlib.Z_FILTERED), overrides the preset
+            filtering: scanline filter type (0-4) or "adaptive", overrides the preset
+            workers: number of threads compressing large images (default: number of CPUs)
 
         Raises:
-            IOError
+            IOError, KeyError
 
         Examples:
             >>> p = PNG()
             >>> colours = (255, 0, 0), (0, 255, 0), (0, 0, 255)
             >>> p.pixels = [[random.choice(colours) for x in range(3)] for y in range(3)]
-            >>> p.save("test/assets/saved.png")
+            >>> target = io.BytesIO()
+            >>> p.save(target)
+            >>> p.save(io.BytesIO(), "fast")
+            >>> p.save(io.BytesIO(), level=9, filtering=4)
+            >>> PNG().load(io.BytesIO(target.getvalue())).pixels == p.pixels
+            True
         """
         self._open(target, "wb")
-        self._write()
+        self._write(preset=preset, level=level, strategy=strategy, filtering=filtering, workers=workers)
 
-    def _read(self):
+    def _read(self, stats=None):
         """
-        Parses the PNG and saves data to self for further manipulations.
+        Parses the PNG header and prepares image data for decoding.
+
+        Args:
+            stats: pyfuck.stats.Stats recording decompression and unfiltering
 
         Raises:
             pyfuck.png.ValidationException, IOError
         """
-        logging.debug("PNG reading started.")
-
-        # init generator
-        reader = self._reader()
-        next(reader)
-
-        # validate header
-        if reader.send(len(PNG.SIGNATURE)) != PNG.SIGNATURE:
-            self._err("The file is not a valid PNG image (signature doesn't match).")
-
-        logging.debug("Signature OK.")
-
-        chunks = []
-        while True:
-
-            # read length
-            length = int.from_bytes(reader.send(PNG.CHUNK_LEN), BYTEORDER)
-
-            # read type
-            type = reader.send(PNG.CHUNK_TYPE)
-
-            # read data
-            if length > 0:
-                data = reader.send(length)
-            else:
-                data = b""
-
-            # read CRC
-            crc = reader.send(PNG.CHUNK_CRC)
-
-            # create chunk object or end
-            if type == b"IHDR":
-                self.header = IHDR(data, crc)
-            elif type == b"PLTE":
-                self.palette = PLTE(length, data, crc)
-            elif type == b"IEND":
-                break
-            else:
-                # raises exception if not valid
-                chunks.append(Chunk(length, type, data, crc))
-
-            logging.debug("{} Chunk read OK.".format(type))
-
-        if not self.header:
-            self._err("Missing PNG header.")
-
-        if not self.header.isSimplified():
-            self._err("The file is not a simplified PNG:\n" + str(self.header) +
-                      "\nSupported values are: bit depth: 1, 2, 4, 8; colour type: 2, 3; " +
-                      "compression: 0; filter: 0; interlace: 0.")
-
-        # decompress
-        try:
-            decompressed = zlib.decompress(b"".join(chunk.data for chunk in chunks if chunk.type == b"IDAT"))
-        except zlib.error:
-            self._err("PNG data cannot be decompressed.")
+        reader = PNGReader(self.file, stats)
+        self.header = reader.header
+        self.palette = reader.palette
+        self._indices = None
+        self._rgb = None
+        self._pixels = None  # created lazily
+        self._decoded = []
+        self._reader = reader.rows()
+
+    def _decode(self):
+        """
+        Finishes decoding of a (lazily) loaded image.
 
-        logging.debug("Decompressed OK.")
+        Raises:
+            pyfuck.png.ValidationException, IOError
+        """
+        if self._reader is None:
+            return
+        rows = self._decoded
+        rows.extend(self._reader)
+        self._decoded = self._reader = None
 
-        # scanline extraction
         if self.header.colour == 2:  # truecolour
-            # one line length = (filter + width * (R, G, B) * depth / 8 (in bytes)
-            lineLength = 1 + self.header.width * RGB * self.header.depth // 8
-        elif self.header.colour == 3:  # indexed-colour
-            lineLength = 1 + self.header.width * self.header.depth // 8
-
-        scanlines = [decompressed[y * lineLength: (y + 1) * lineLength] for y in range(self.header.height)]
-
-        logging.debug("Scanlines extracted OK.")
-
-        raw = [list(map(int, row)) for row in scanlines]
-
-        # filter reconstruction
-        for y, row in enumerate(scanlines):
-            for x, byte in enumerate(row):
-                if x == 0:  # set filter for each scanline
-                    fil = byte
-                    continue
-
-                if fil:
-                    a = raw[y][x - RGB] if x > RGB else 0
-
-                    if fil == 1:  # sub
-                        byte += a
+            self._rgb = rows
+        else:  # indexed-colour
+            self._indices = rows
 
-                    else:
-                        b = raw[y - 1][x] if y > 0 else 0
-
-                        if fil == 2:  # up
-                            byte += b
-
-                        elif fil == 3:  # average
-                            byte += floor((a + b) / 2)
-
-                        elif fil == 4:  # paeth
-                            c = raw[y - 1][x - RGB] if x > RGB and y > 0 else 0
-                            _ = a + b - c
-                            pa, pb, pc = abs(_ - a), abs(_ - b), abs(_ - c)
-                            if pa <= pb and pa <= pc:
-                                byte += a
-                            elif pb <= pc:
-                                byte += b
-                            else:
-                                byte += c
-
-                    byte %= 256
-
-                raw[y][x] = byte
+    def rows(self):
+        """
+        Image rows as stored in the file - interleaved RGB samples for truecolour images or palette indices
+        for indexed-colour images (bytes).
 
-        for y, row in enumerate(raw):
-            raw[y] = row[1:]
+        Rows of a lazily loaded image are decoded only as far as they are iterated and are kept for later use,
+        so reading first few rows of a huge image is cheap.
 
-        logging.debug("Raw data reconstruction OK.")
+        Raises:
+            pyfuck.png.ValidationException, IOError
 
-        # group bytes to pixels
-        if self.header.colour == 2:  # truecolour
-            self._pixels = [[tuple(row[x:x + RGB]) for x in range(0, len(row), RGB)] for row in raw]
-        elif self.header.colour == 3:  # indexed-colour
-            def getColour(index):
-                return self.palette.palette[index]
-            shifts = list(reversed(range(0, 8, self.header.depth)))
-            self._pixels = [[getColour(row[i // len(shifts)] >> shift & 2 ** self.header.depth - 1)
-                             for i, shift in enumerate(len(row) * shifts)] for row in raw]
-
-        logging.debug("Colour reconstruction OK.")
-        logging.debug("PNG loaded.")
+        Returns:
+            A generator of rows.
 
-    def _write(self):
+        Examples:
+            >>> p = PNG().load("test/assets/palette.png", lazy=True)
+            >>> len(next(p.rows())) == p.header.width
+            True
         """
-        Outputs data from self to file - aka writes the PNG file.
+        y = 0
+        while self._reader is not None:
+            if y == len(self._decoded):
+                row = next(self._reader, None)
+                if row is None:
+                    self._decode()
+                    break
+                self._decoded.append(row)
+            yield self._decoded[y]
+            y += 1
+        yield from (self.rgb if self.indices is None else self.indices)[y:]
+
+    def _write(self, **options):
         """
-        logging.debug("PNG writing started.")
-
-        # init generator
-        writer = self._writer()
-        next(writer)
-
-        writer.send(PNG.SIGNATURE)
+        Outputs data from self to file - aka writes the PNG file.
 
-        logging.debug("Signature written.")
+        Args:
+            options: PNGWriter options
+        """
+        # images with few colours are written as indexed-colour
+        colours, indices = self._indexed()
+        pixels = self.rgb if indices is None else indices
 
-        # write header
-        writer.send(self.header)
+        writer = PNGWriter(self.file, self.header.width, self.header.height, colours, **options)
+        for row in pixels:
+            writer.writeRow(row)
+        writer.close()
 
-        logging.debug("Header written.")
+    def _indexed(self):
+        """
+        Prepares indexed-colour representation of the image, if it has at most `PALETTE_MAX` colours.
 
-        # generate raw bytes
-        raw = bytearray()
-        for row in self._pixels:
-            raw.append(0)  # filter 0
-            for pixel in row:
-                raw.extend(pixel)
+        Returns:
+            A tuple of colours list and list of index rows (bytes), or (None, None) for truecolour images.
 
-        # write data
-        type = b"IDAT"
-        compressed = zlib.compress(raw)
-        crc = zlib.crc32(type + compressed).to_bytes(4, BYTEORDER)
-        length = len(compressed)
-        writer.send(Chunk(length, type, compressed, crc))
+        Examples:
+            >>> p = PNG()
+            >>> p.pixels = [[(0, 0, 0), (255, 0, 0)], [(255, 0, 0), (0, 0, 0)]]
+            >>> p._indexed()
+            ([(0, 0, 0), (255, 0, 0)], [b'\\x00\\x01', b'\\x01\\x00'])
+        """
+        if self.indices is not None and len(self.palette.palette) <= self.PALETTE_MAX:
+            return self.palette.palette, self.indices
+
+        # find distinct colours, give up early
+        rgb = self.rgb
+        index = {}
+        for row in rgb:
+            for pixel in zip(row[0::RGB], row[1::RGB], row[2::RGB]):
+                if pixel not in index:
+                    if len(index) == self.PALETTE_MAX:
+                        return None, None
+                    index[pixel] = len(index)
+
+        lookup = index.__getitem__
+        return list(index), [bytes(map(lookup, zip(row[0::RGB], row[1::RGB], row[2::RGB]))) for row in rgb]
 
-        logging.debug("Data written.")
+    @property
+    def indices(self):
+        """
+        Image data as rows of palette indices (bytes), or None for truecolour images.
+        """
+        self._decode()
+        return self._indices
 
-        writer.send(PNG.IEND)
+    @property
+    def pixels(self):
+        """
+        Image data as rows of RGB tuples.
 
-        logging.debug("IEND chunk written.")
-        logging.debug("PNG saved.")
+        Loaded images keep only RGB samples (see `rgb`) or palette indices (see `indices`),
+        pixels are created on first access. The rows can be changed in place, so from then on the pixels
+        are the image data - the other representations are dropped and derived from them when needed.
 
-    def _reader(self):
+        Examples:
+            >>> p = PNG().load("test/assets/squares.png")
+            >>> p.pixels[0][0] = (0, 0, 0)
+            >>> p.rgb[0][:RGB]
+            b'\\x00\\x00\\x00'
         """
-        Binary file reader.
-
-        This is generator object which recieves number of bytes to read.
+        self._decode()
+        if self._pixels is None and (self._indices is not None or self._rgb is not None):
+            if self._indices is not None:
+                colours = self.palette.palette
+                self._pixels = [list(map(colours.__getitem__, row)) for row in self._indices]
+            else:
+                self._pixels = [list(zip(row[0::RGB], row[1::RGB], row[2::RGB])) for row in self._rgb]
+            self.palette = None
+            self._indices = None
+            self._rgb = None
+            self.header = IHDR.initSimplified(self.header.width, self.header.height)
+        return self._pixels
 
-        Returns:
-            A generator object.
+    @property
+    def rgb(self):
         """
-        howMuch = yield
-        byte = self.file.read(howMuch)
-        while byte != b"":
-            howMuch = yield byte
-            if not howMuch:
-                howMuch = 1
-            byte = self.file.read(howMuch)
+        Image data as rows of interleaved RGB samples (bytes).
 
-        self._err("Unexpected file end.")
+        Examples:
+            >>> PNG().load("test/assets/squares.png").rgb[0]
+            b'\\xff\\x00\\x00\\x00\\xff\\x00\\x00\\x00\\xff'
+            >>> PNG().load("test/assets/palette.png").rgb[-1][-3:]
+            b'\\x00\\x00\\xff'
+        """
+        self._decode()
+        if self._pixels is not None:  # not cached, the pixels may be changed in place (see `pixels`)
+            return [bytes(chain.from_iterable(row)) for row in self._pixels]
+        if self._rgb is None and self._indices is not None:
+            colours = [bytes(colour) for colour in self.palette.palette]
+            self._rgb = [b"".join(map(colours.__getitem__, row)) for row in self._indices]
+        return self._rgb
+
+    @rgb.setter
+    def rgb(self, value):
+        """
+        Image data (rows of interleaved RGB samples) setter.
 
-    def _writer(self):
+        Raises:
+            pyfuck.png.ValidationException
+        """
+        rowLen = len(value[0])
+        if not rowLen or rowLen % RGB or any(len(row) != rowLen for row in value):
+            raise ValidationException("The image is not rectangular.")
+
+        self._rgb = [bytes(row) for row in value]
+        self._pixels = None
+        self.palette = None
+        self._indices = None
+        self._decoded = self._reader = None
+        self.header = IHDR.initSimplified(rowLen // RGB, len(value))
+
+    def setIndices(self, colours, indices):
         """
-        Binary file writer.
+        Sets indexed-colour image data.
 
-        This is generator object which recieves bytes to write.
+        Args:
+            colours: list of RGB colours (palette)
+            indices: list of rows of palette indices (bytes)
 
-        Returns:
-            A generator object.
-        """
-        data = True
-        while data:
-            data = yield
-            self.file.write(bytes(data))
+        Raises:
+            pyfuck.png.ValidationException
 
-    @property
-    def pixels(self):
-        return self._pixels
+        Examples:
+            >>> p = PNG()
+            >>> p.setIndices([(0, 0, 0), (255, 255, 255)], [b"\\x00\\x01"])
+            >>> p.pixels
+            [[(0, 0, 0), (255, 255, 255)]]
+        """
+        rowLen = len(indices[0])
+        if not rowLen or any(len(row) != rowLen for row in indices):
+            raise ValidationException("The image is not rectangular.")
+        if max(max(row) for row in indices) >= len(colours):
+            raise ValidationException("Palette index out of range.")
+
+        self.palette = PLTE.initColours(colours)
+        self._indices = [bytes(row) for row in indices]
+        self._rgb = None
+        self._pixels = None
+        self._decoded = self._reader = None
+        self.header = IHDR.initSimplified(rowLen, len(indices), 8, 3)
 
     @pixels.setter
     def pixels(self, value):
@@ -350,21 +396,434 @@ class PNG(object):
 
         # seems ok
         self._pixels = value
+        self.palette = None
+        self._indices = None
+        self._rgb = None
+        self._decoded = self._reader = None
         self.header = IHDR.initSimplified(prevLen, len(value))
 
         logging.debug("PNG pixels set.")
 
-    def _err(self, msg):
-        raise ValidationException("'{}': ".format(self.filename) + msg)
-
     def __eq__(self, other):
-        return self.pixels == other.pixels
+        return self.rgb == other.rgb
 
     def __str__(self):
         return super(PNG, self).__str__() + "\n" + \
             "filename: {}".format(self.filename)
 
 
+class PNGReader(object):
+
+    """
+    Incremental PNG decoder.
+
+    The signature, header and palette are read on creation, image data are decompressed and reconstructed
+    row by row as they are iterated, so the memory used is proportional to one row.
+
+    Author:
+        Tomas Bedrich
+
+    Examples:
+        >>> reader = PNGReader("test/assets/squares.png")
+        >>> reader.header.width, reader.header.height
+        (3, 3)
+        >>> next(reader.rows())
+        b'\\xff\\x00\\x00\\x00\\xff\\x00\\x00\\x00\\xff'
+        >>> reader.close()
+    """
+
+    DECOMPRESS_SIZE = 128 * 1024  # max bytes decompressed at once
+
+    def __init__(self, target, stats=None):
+        """
+        Reads chunks up to the first IDAT chunk.
+
+        Args:
+            target: source, a filename or binary file object
+            stats: pyfuck.stats.Stats recording decompression and unfiltering
+
+        Raises:
+            pyfuck.png.ValidationException, IOError
+        """
+        super(PNGReader, self).__init__()
+        self.stats = stats if stats is not None else NULL_STATS
+        if issubclass(type(target), IOBase):
+            self.filename = getattr(target, "name", "<buffer>")
+            self.file = target
+            self.owner = False
+        else:
+            self.filename = target
+            self.file = open(target, "rb")
+            self.owner = True
+
+        self.header = None
+        self.palette = None
+
+        logging.debug("PNG reading started.")
+
+        # validate header
+        if self._read(len(PNG.SIGNATURE)) != PNG.SIGNATURE:
+            self._err("The file is not a valid PNG image (signature doesn't match).")
+
+        logging.debug("Signature OK.")
+
+        while True:
+            chunk = self._chunk()
+            if chunk.type == IHDR.TYPE:
+                self.header = IHDR(chunk.data, chunk.crc.to_bytes(PNG.CHUNK_CRC, BYTEORDER))
+            elif chunk.type == PLTE.TYPE:
+                self.palette = PLTE(chunk.len, chunk.data, chunk.crc.to_bytes(PNG.CHUNK_CRC, BYTEORDER))
+            elif chunk.type in (b"IDAT", b"IEND"):
+                self.chunk = chunk  # first chunk of image data
+                break
+
+        if not self.header:
+            self._err("Missing PNG header.")
+
+        if not self.header.isSimplified():
+            self._err("The file is not a simplified PNG:\n" + str(self.header) +
+                      "\nSupported values are: bit depth: 1, 2, 4, 8; colour type: 2, 3; " +
+                      "compression: 0; filter: 0; interlace: 0.")
+
+        if self.header.colour == 3 and not self.palette:
+            self._err("Missing PNG palette.")
+
+    def rows(self):
+        """
+        Decompresses and reconstructs image rows.
+
+        Raises:
+            pyfuck.png.ValidationException, IOError
+
+        Returns:
+            A generator of rows - interleaved RGB samples for truecolour images or palette indices
+            for indexed-colour images (bytes).
+        """
+        header = self.header
+        channels = RGB if header.colour == 2 else 1
+
+        # one line length = filter + width * channels * depth / 8 (in bytes, rounded up)
+        lineLength = 1 + (header.width * channels * header.depth + 7) // 8
+        bpp = max(1, channels * header.depth // 8)  # bytes per complete pixel
+        table = unpackTable(header.depth) if header.colour == 3 and header.depth < 8 else None
+        colours = len(self.palette.palette) if self.palette else 0
+
+        stats, clock = self.stats, time.perf_counter
+        decompressor = zlib.decompressobj()
+        data = bytearray()
+        prev = bytes(lineLength - 1)
+        for y in range(header.height):
+
+            # decompress at least one line
+            while len(data) < lineLength:
+                if decompressor.unconsumed_tail:
+                    compressed = decompressor.unconsumed_tail
+                elif self.chunk.type == b"IDAT":
+                    compressed = self.chunk.data
+                    stats.add("png.compressed", len(compressed))
+                    self.chunk = self._chunk()
+                else:
+                    self._err("PNG data are truncated.")
+                start = clock()
+                try:
+                    data += decompressor.decompress(compressed, max(self.DECOMPRESS_SIZE, lineLength))
+                except zlib.error:
+                    self._err("PNG data cannot be decompressed.")
+                stats.time("png.decompress", clock() - start)
+
+            # filter reconstruction
+            line = bytes(data[:lineLength])
+            del data[:lineLength]
+            start = clock()
+            try:
+                prev = unfilter(line[0], line[1:], prev, bpp)
+            except ValueError as e:
+                self._err(str(e))
+            stats.time("png.unfilter", clock() - start)
+            stats.add("png.raw", lineLength)
+
+            # colour reconstruction
+            if header.colour == 2:
+                yield prev
+            else:
+                row = b"".join(map(table.__getitem__, prev))[:header.width] if table else prev
+                if max(row) >= colours:
+                    self._err("Palette index out of range.")
+                yield row
+
+        logging.debug("Raw data reconstruction OK.")
+
+        # skip the rest up to IEND
+        while self.chunk.type != b"IEND":
+            self.chunk = self._chunk()
+
+        logging.debug("PNG loaded.")
+
+        self.close()
+
+    def close(self):
+        if self.owner:
+            self.file.close()
+            self.owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _chunk(self):
+        """
+        Reads one chunk.
+
+        Raises:
+            pyfuck.png.ValidationException, IOError
+        """
+        length = int.from_bytes(self._read(PNG.CHUNK_LEN), BYTEORDER)
+        type = self._read(PNG.CHUNK_TYPE)
+        data = self._read(length)
+        crc = self._read(PNG.CHUNK_CRC)
+
+        # raises exception if not valid
+        chunk = Chunk(length, type, data, crc)
+
+        logging.debug("{} Chunk read OK.".format(type))
+        return chunk
+
+    def _read(self, length):
+        data = self.file.read(length)
+        if len(data) != length:
+            self._err("Unexpected file end.")
+        return data
+
+    def _err(self, msg):
+        raise ValidationException("'{}': ".format(self.filename) + msg)
+
+
+class PNGWriter(object):
+
+    """
+    Incremental PNG encoder.
+
+    Rows are filtered and compressed as they are written and IDAT chunks of bounded size are flushed
+    to the file immediately, so the memory used is proportional to one row (and a few compressed blocks).
+
+    Large images are compressed by multiple threads (zlib releases the GIL), pigz-style: the data are
+    split to blocks compressed independently, each block primed with the preceding 32 KiB as a dictionary.
+
+    Author:
+        Tomas Bedrich
+
+    Examples:
+        >>> target = io.BytesIO()
+        >>> with PNGWriter(target, 2, 2) as writer:
+        ...     writer.writeRow([(255, 0, 0), (0, 255, 0)])
+        ...     writer.writeRow(b"\\x00\\x00\\xff\\x00\\x00\\x00")
+        >>> PNG().load(io.BytesIO(target.getvalue())).pixels
+        [[(255, 0, 0), (0, 255, 0)], [(0, 0, 255), (0, 0, 0)]]
+
+        >>> target = io.BytesIO()
+        >>> with PNGWriter(target, 3, 1, colours=[(0, 0, 0), (255, 255, 255)]) as writer:
+        ...     writer.writeRow(b"\\x00\\x01\\x00")
+        >>> PNG().load(io.BytesIO(target.getvalue())).indices
+        [b'\\x00\\x01\\x00']
+    """
+
+    BLOCK_SIZE = 128 * 1024  # bytes of raw data compressed by one thread, also the IDAT chunk size
+
+    def __init__(self, target, width, height, colours=None, preset="default",
+                 level=None, strategy=None, filtering=None, workers=None):
+        """
+        Writes the PNG signature, header and palette.
+
+        Args:
+            target: destination, a filename or binary file object
+            width: image width
+            height: image height
+            colours: list of RGB colours for indexed-colour images, rows are then bytes of palette indices
+            preset: name of compression preset from `PNG.PRESETS` - "fast", "default" or "best"
+            level: zlib compression level (0-9), overrides the preset
+            strategy: zlib compression strategy (e.g. zlib.Z_FILTERED), overrides the preset
+            filtering: scanline filter type (0-4) or "adaptive", overrides the preset
+            workers: number of threads compressing large images (default: number of CPUs)
+
+        Raises:
+            IOError, KeyError
+        """
+        super(PNGWriter, self).__init__()
+        options = dict(PNG.PRESETS[preset])
+        for name, value in ("level", level), ("strategy", strategy), ("filtering", filtering):
+            if value is not None:
+                options[name] = value
+        self.level, self.strategy, self.filtering = options["level"], options["strategy"], options["filtering"]
+
+        if issubclass(type(target), IOBase):
+            self.file = target
+            self.owner = False
+        else:
+            self.file = open(target, "wb")
+            self.owner = True
+        self.width = width
+        self.height = height
+        self.colours = colours
+        self.y = 0
+
+        logging.debug("PNG writing started.")
+
+        self.file.write(PNG.SIGNATURE)
+        if colours is None:
+            self.depth = 8
+            self.bpp = RGB
+            self._writeChunk(IHDR.TYPE, IHDR.initSimplified(width, height).data)
+        else:
+            self.depth = next(depth for depth in (1, 2, 4, 8) if len(colours) <= 2 ** depth)
+            self.bpp = 1
+            # filtering rarely helps indexed-colour images (see http://www.w3.org/TR/PNG/#12Filter-selection)
+            if filtering is None:
+                self.filtering = 0
+            self._writeChunk(IHDR.TYPE, IHDR.initSimplified(width, height, self.depth, 3).data)
+            self._writeChunk(PLTE.TYPE, PLTE.initColours(colours).data)
+
+        logging.debug("Header written.")
+
+        # compression state
+        self.prev = bytes((width * self.depth * (1 if colours else RGB) + 7) // 8)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and height * (1 + len(self.prev)) > self.BLOCK_SIZE:
+            self.pool = ThreadPoolExecutor(workers)
+            self.workers = workers
+            self.compressed = deque()  # futures of compressed blocks, in order
+            self.adler = zlib.adler32(b"")
+            self.dictionary = b""
+            self.written = 0  # compressed blocks
+            self.finished = False  # all blocks submitted
+        else:
+            self.pool = None
+            self.compressor = zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS, 9, self.strategy)
+        self.block = bytearray()
+
+    def writeRow(self, row):
+        """
+        Filters, compresses and possibly writes one row.
+
+        Args:
+            row: for truecolour images list of RGB tuples or bytes of interleaved RGB samples,
+                 for indexed-colour images bytes of palette indices
+
+        Raises:
+            pyfuck.png.ValidationException, IOError
+        """
+        if self.y == self.height:
+            raise ValidationException("All {} rows were already written.".format(self.height))
+
+        if self.colours is not None:
+            row = packRow(row, self.depth)
+        elif not isinstance(row, (bytes, bytearray)):
+            row = bytes(chain.from_iterable(row))
+        if len(row) != len(self.prev):
+            raise ValidationException("The row has {} bytes instead of {}.".format(len(row), len(self.prev)))
+        self.y += 1
+
+        if self.filtering == "adaptive":
+            # minimum sum of absolute differences heuristic
+            filtered = [filterRow(type, row, self.prev, self.bpp) for type in range(5)]
+            type = min(range(5), key=lambda type: sum(filtered[type].translate(_ABS_DIFFERENCE)))
+            filtered = filtered[type]
+        else:
+            type = self.filtering
+            filtered = filterRow(type, row, self.prev, self.bpp)
+        self.prev = row
+
+        if self.pool:
+            self.block.append(type)
+            self.block.extend(filtered)
+            if len(self.block) >= self.BLOCK_SIZE:
+                self._submit(last=False)
+        else:
+            self.block.extend(self.compressor.compress(bytes((type,))))
+            self.block.extend(self.compressor.compress(filtered))
+            while len(self.block) >= self.BLOCK_SIZE:
+                self._writeChunk(b"IDAT", self.block[:self.BLOCK_SIZE])
+                del self.block[:self.BLOCK_SIZE]
+
+    def close(self):
+        """
+        Flushes the compressed data and writes the IEND chunk.
+
+        Raises:
+            pyfuck.png.ValidationException, IOError
+        """
+        if self.y != self.height:
+            raise ValidationException("Only {} of {} rows were written.".format(self.y, self.height))
+
+        if self.pool:
+            self._submit(last=True)
+            self.finished = True
+            while self.compressed:
+                self._writeCompressed()
+            self.pool.shutdown()
+        else:
+            self.block.extend(self.compressor.flush())
+            self._writeChunk(b"IDAT", self.block)
+
+        logging.debug("Data written.")
+
+        self._writeChunk(b"IEND", b"")
+
+        logging.debug("PNG saved.")
+
+        if self.owner:
+            self.file.close()
+
+    def _submit(self, last):
+        """
+        Compresses the current block in a thread pool, writes already compressed blocks.
+        """
+        block = bytes(self.block)
+        self.block = bytearray()
+        self.adler = zlib.adler32(block, self.adler)
+        self.compressed.append(
+            self.pool.submit(compressBlock, block, self.dictionary, self.level, self.strategy, last))
+        self.dictionary = (self.dictionary + block)[-_WINDOW_SIZE:]
+
+        # wait for the oldest blocks to bound the memory
+        while len(self.compressed) > 2 * self.workers:
+            self._writeCompressed()
+
+    def _writeCompressed(self):
+        """
+        Writes the oldest compressed block as an IDAT chunk (raw deflate data => zlib stream).
+        """
+        last = self.compressed[0] is self.compressed[-1] and self.finished
+        data = self.compressed.popleft().result()
+        if not self.written:
+            data = zlib.compress(b"", self.level)[:2] + data
+        if last:
+            data += self.adler.to_bytes(4, BYTEORDER)
+        self.written += 1
+        self._writeChunk(b"IDAT", data)
+
+    def _writeChunk(self, type, data):
+        """
+        Writes one chunk, computing its CRC incrementally (without concatenating type and data).
+        """
+        crc = zlib.crc32(data, zlib.crc32(type))
+        self.file.write(len(data).to_bytes(PNG.CHUNK_LEN, BYTEORDER))
+        self.file.write(type)
+        self.file.write(data)
+        self.file.write(crc.to_bytes(PNG.CHUNK_CRC, BYTEORDER))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        elif self.owner:
+            self.file.close()
+
+
 class Chunk(object):
 
     """
@@ -473,15 +932,15 @@ class IHDR(Chunk):
         super(IHDR, self).__init__(13, IHDR.TYPE, data, crc)
 
     @classmethod
-    def initSimplified(cls, width, height):
+    def initSimplified(cls, width, height, depth=8, colour=2):
         def get(data, len):
             return data.to_bytes(len, BYTEORDER)
 
         data = bytes()
         data += get(width, 4)  # width
         data += get(height, 4)  # height
-        data += get(8, 1)  # depth
-        data += get(2, 1)  # colour
+        data += get(depth, 1)  # depth
+        data += get(colour, 1)  # colour
         data += get(0, 1)  # compression
         data += get(0, 1)  # filter
         data += get(0, 1)  # interlace
@@ -539,6 +998,18 @@ class PLTE(Chunk):
         RGB = 3  # 3 colour components
         self.palette = [tuple(parseInt(data, 3 * i + j) for j in range(RGB)) for i in range(self.len // RGB)]
 
+    @classmethod
+    def initColours(cls, colours):
+        """
+        Creates a palette chunk from list of RGB colours.
+
+        Examples:
+            >>> PLTE.initColours([(0, 255, 0), (255, 0, 0)]).palette
+            [(0, 255, 0), (255, 0, 0)]
+        """
+        data = bytes(component for colour in colours for component in colour)
+        return cls(len(data), data, zlib.crc32(cls.TYPE + data).to_bytes(4, BYTEORDER))
+
     def isValid(self):
         return super(PLTE, self).isValid() and (0 < self.len <= 256 * 3) and (self.len % 3 == 0)
 
@@ -577,6 +1048,204 @@ def parseInt(data, start=0, len=1):
     return int.from_bytes(data[start:start + len], BYTEORDER)
 
 
+def unfilter(type, line, prev, bpp):
+    """
+    Reconstructs one scanline.
+
+    Args:
+        type: filter type
+        line: filtered scanline (without the filter type byte)
+        prev: previous reconstructed scanline (zeros for the first one)
+        bpp: number of bytes per complete pixel (at least 1)
+
+    Raises:
+        ValueError
+
+    Returns:
+        Reconstructed scanline bytes.
+
+    Examples:
+        >>> unfilter(1, b"\\x01\\x02\\x01\\x02", bytes(4), 2)
+        b'\\x01\\x02\\x02\\x04'
+        >>> unfilter(2, b"\\x01\\xff", b"\\x01\\x01", 1)
+        b'\\x02\\x00'
+        >>> unfilter(5, b"", b"", 1)
+        Traceback (most recent call last):
+        ValueError: Unknown filter type 5.
+    """
+    if type == 0:  # none
+        return bytes(line)
+
+    res = bytearray(line)
+    if type == 1:  # sub
+        for i in range(bpp):
+            res[i::bpp] = bytes(accumulate(res[i::bpp], lambda a, x: (a + x) & 0xFF))
+
+    elif type == 2:  # up
+        res = bytearray((x + b) & 0xFF for x, b in zip(line, prev))
+
+    elif type == 3:  # average
+        for i, b in enumerate(prev):
+            a = res[i - bpp] if i >= bpp else 0
+            res[i] = (res[i] + ((a + b) >> 1)) & 0xFF
+
+    elif type == 4:  # paeth
+        for i, b in enumerate(prev):
+            if i >= bpp:
+                a, c = res[i - bpp], prev[i - bpp]
+            else:
+                a = c = 0
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            if pa <= pb and pa <= pc:
+                res[i] = (res[i] + a) & 0xFF
+            elif pb <= pc:
+                res[i] = (res[i] + b) & 0xFF
+            else:
+                res[i] = (res[i] + c) & 0xFF
+
+    else:
+        raise ValueError("Unknown filter type {}.".format(type))
+
+    return bytes(res)
+
+
+def filterRow(type, row, prev, bpp):
+    """
+    Filters one scanline, this is an inverse of `unfilter`.
+
+    Args:
+        type: filter type
+        row: raw scanline (without the filter type byte)
+        prev: previous raw scanline (zeros for the first one)
+        bpp: number of bytes per complete pixel (at least 1)
+
+    Raises:
+        ValueError
+
+    Returns:
+        Filtered scanline bytes.
+
+    Examples:
+        >>> filterRow(1, b"\\x01\\x02\\x02\\x04", bytes(4), 2)
+        b'\\x01\\x02\\x01\\x02'
+        >>> row, prev = bytes(random.randrange(256) for _ in range(30)), bytes(random.randrange(256) for _ in range(30))
+        >>> all(unfilter(type, filterRow(type, row, prev, 3), prev, 3) == row for type in range(5))
+        True
+    """
+    if type == 0:  # none
+        return bytes(row)
+
+    left = bytes(bpp) + row[:-bpp]
+
+    if type == 1:  # sub
+        return bytes((x - a) & 0xFF for x, a in zip(row, left))
+
+    elif type == 2:  # up
+        return bytes((x - b) & 0xFF for x, b in zip(row, prev))
+
+    elif type == 3:  # average
+        return bytes((x - ((a + b) >> 1)) & 0xFF for x, a, b in zip(row, left, prev))
+
+    elif type == 4:  # paeth
+        def paeth(x, a, b, c):
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            if pa <= pb and pa <= pc:
+                return (x - a) & 0xFF
+            elif pb <= pc:
+                return (x - b) & 0xFF
+            return (x - c) & 0xFF
+        return bytes(map(paeth, row, left, prev, bytes(bpp) + prev[:-bpp]))
+
+    raise ValueError("Unknown filter type {}.".format(type))
+
+
+# filtered byte to absolute value of its signed interpretation
+_ABS_DIFFERENCE = bytes(min(byte, 256 - byte) for byte in range(256))
+
+
+def compressBlock(block, dictionary, level, strategy, last):
+    """
+    Compresses one block of data to raw deflate stream.
+
+    The block is primed by the preceding data as a dictionary and ends with a sync flush (or a final block),
+    so independently compressed blocks concatenate to one valid deflate stream.
+
+    Args:
+        block: bytes to compress
+        dictionary: up to 32 KiB of data preceding the block
+        level: zlib compression level
+        strategy: zlib compression strategy
+        last: True for the last block of the stream
+
+    Examples:
+        >>> data = bytes(random.randrange(4) for _ in range(100000))
+        >>> blocks = [compressBlock(data[i:i + 40000], data[max(0, i - 32768):i], 6, 0, i + 40000 >= len(data))
+        ...           for i in range(0, len(data), 40000)]
+        >>> zlib.decompress(b"".join(blocks), -zlib.MAX_WBITS) == data
+        True
+    """
+    options = {"zdict": dictionary} if dictionary else {}
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 9, strategy, **options)
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+_WINDOW_SIZE = 32 * 1024  # deflate sliding window
+
+
+def unpackTable(depth):
+    """
+    Returns a 256 entries long table which maps one byte to its unpacked sub-byte samples.
+
+    Tables are computed only once for each bit depth.
+
+    Args:
+        depth: bit depth (1, 2 or 4)
+
+    Examples:
+        >>> unpackTable(2)[0b00011011]
+        b'\\x00\\x01\\x02\\x03'
+        >>> unpackTable(4)[0xa5]
+        b'\\n\\x05'
+    """
+    try:
+        return _UNPACK_TABLES[depth]
+    except KeyError:
+        shifts = range(8 - depth, -1, -depth)
+        mask = 2 ** depth - 1
+        table = _UNPACK_TABLES[depth] = [bytes(byte >> shift & mask for shift in shifts) for byte in range(256)]
+        return table
+
+
+_UNPACK_TABLES = {}
+
+
+def packRow(row, depth):
+    """
+    Packs samples of one scanline to bytes, the last byte is padded by zero bits.
+
+    Args:
+        row: bytes with one sample per byte
+        depth: bit depth (1, 2, 4 or 8)
+
+    Examples:
+        >>> packRow(b"\\x00\\x01\\x02\\x03\\x01", 2)
+        b'\\x1b@'
+        >>> packRow(b"\\x0a\\x05", 4)
+        b'\\xa5'
+    """
+    if depth == 8:
+        return bytes(row)
+
+    per = 8 // depth
+    row = bytes(row) + bytes(-len(row) % per)
+    packed = row[0::per]
+    for i in range(1, per):
+        packed = [byte << depth | sample for byte, sample in zip(packed, row[i::per])]
+    return bytes(packed)
+
+
 def bitReader(data):
     """
     A bit reader.
@@ -610,5 +1279,55 @@ def bitReader(data):
         howMuch = yield [next(bit) for _ in range(howMuch)]
 
 
+def copyChunks(source, target, strip=False):
+    """
+    Copies a PNG file chunk by chunk, without decompressing the image data.
+
+    Args:
+        source: binary file object positioned at the PNG signature
+        target: binary file object
+        strip: copy only critical chunks (IHDR, PLTE, IDAT, IEND) - drops metadata like gamma or text
+
+    Raises:
+        pyfuck.png.ValidationException, IOError
+
+    Examples:
+        >>> target = io.BytesIO()
+        >>> with open("test/assets/palette.png", "rb") as f:
+        ...     copyChunks(f, target, strip=True)
+        >>> len(target.getvalue())
+        115
+        >>> PNG().load(io.BytesIO(target.getvalue())) == PNG().load("test/assets/palette.png")
+        True
+    """
+    signature = source.read(len(PNG.SIGNATURE))
+    if signature != PNG.SIGNATURE:
+        raise ValidationException("The file is not a valid PNG image (signature doesn't match).")
+    target.write(signature)
+
+    type = None
+    while type != b"IEND":
+        head = source.read(PNG.CHUNK_LEN + PNG.CHUNK_TYPE)
+        if len(head) != PNG.CHUNK_LEN + PNG.CHUNK_TYPE:
+            raise ValidationException("Unexpected file end.")
+        type = head[PNG.CHUNK_LEN:]
+        keep = not strip or not type[0] & _ANCILLARY
+
+        if keep:
+            target.write(head)
+        remaining = int.from_bytes(head[:PNG.CHUNK_LEN], BYTEORDER) + PNG.CHUNK_CRC
+        while remaining:
+            data = source.read(min(remaining, _COPY_SIZE))
+            if not data:
+                raise ValidationException("Unexpected file end.")
+            if keep:
+                target.write(data)
+            remaining -= len(data)
+
+
+_ANCILLARY = 0x20  # lowercase first letter of a chunk type
+_COPY_SIZE = 1024 * 1024
+
+
 if __name__ == '__main__':
     print("This file is not meant to be executed directly. Please use it as a module instead.")
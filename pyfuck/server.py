@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import TCPServer
+from urllib.parse import parse_qs, urlsplit
+
+from pyfuck.png import ValidationException
+from pyfuck.api import Engine
+
+
+class Server(object):
+
+    """
+    Long-lived interpreter and converter.
+
+    Compiled programs and programs decoded from images are kept in LRU caches, the work itself is done
+    by a thread or process pool. Requests are served over HTTP (see `serve`):
+
+        POST /run?type=auto&limit=<length>&input=<text>      body: source, response: program output
+        POST /convert?output=<type>&type=auto&carrier=<name>
+             &compression=default&width=<pixels>&ratio=1&optimize=1      body: source, response: converted source
+        GET /stats                                           response: JSON with counters
+
+    Carrier images of Braincopter output are looked up by name in a directory given at startup, so clients
+    cannot read other files of the server. Runs are stopped after a number of executed instructions.
+
+    Author:
+        Tomas Bedrich
+
+    Examples:
+        >>> with Server(workers=2) as server:
+        ...     server.run(b"++++++++[>++++++++<-]>+.,.", input="a")
+        ...     server.run(b"++++++++[>++++++++<-]>+.,.", input="z")
+        ...     server.stats()["caches"]["programs"]
+        b'Aa'
+        b'Az'
+        {'hits': 1, 'misses': 1, 'size': 1}
+    """
+
+    TYPES = ("auto",) + Engine.TYPES
+    STEPS = 10 ** 8  # default maximum of instructions executed by a run
+
+    def __init__(self, workers=None, pool="thread", cache=128, carriers=None, steps=STEPS):
+        """
+        Args:
+            workers: Size of the pool (default: number of CPUs).
+            pool: "thread" or "process".
+            cache: Number of entries of each cache.
+            carriers: Directory of carrier images (default: none, conversions to Braincopter are refused).
+            steps: Maximum number of instructions executed by a run (None is unlimited).
+        """
+        super(Server, self).__init__()
+        if pool not in ("thread", "process"):
+            raise ValueError("Unknown pool '{}'.".format(pool))
+        self.carriers = os.path.realpath(carriers) if carriers is not None else None
+        self.steps = steps
+        self.executor = (ThreadPoolExecutor if pool == "thread" else ProcessPoolExecutor)(workers)
+        self.programs = LRUCache(cache)  # compiled programs
+        self.sources = LRUCache(cache)  # Brainfuck programs decoded from images
+        self.lock = threading.Lock()
+        self.latency = {}  # per action: count, total and max time
+
+    def run(self, source, type="auto", limit=None, input=""):
+        """
+        Runs a program.
+
+        Args:
+            source: Program source - Brainfuck text or PNG image (bytes).
+            type: Source type (see TYPES).
+            limit: Maximum length of a program decoded from an image.
+            input: User input, the program fails when it reads more (default: input after "!" in the source).
+
+        Raises:
+            EOFError, ValueError (also when the run exceeds the steps limit), pyfuck.png.ValidationException
+
+        Returns:
+            The program output (bytes).
+        """
+        key = (sha256(source).digest(), type, limit)
+        compiled = self.programs.get(key)
+        if compiled is None:
+            compiled = self.executor.submit(_compile, source, type, limit).result()
+            self.programs.put(key, compiled)
+        compiled, inline = compiled
+        return self.executor.submit(_execute, compiled, input or inline, self.steps).result()
+
+    def convert(self, source, output, type="auto", limit=None, carrier=None, optimize=False, **options):
+        """
+        Converts a program to another type.
+
+        Args:
+            source: Program source - Brainfuck text or PNG image (bytes).
+            output: Output type.
+            type: Source type (see TYPES).
+            limit: Maximum length of a program decoded from an image.
+            carrier: Name of a PNG image carrying Braincopter output, in the carriers directory.
+            optimize: Minify the program first.
+            options: compression, width and ratio (see `pyfuck convert --help`)
+
+        Raises:
+            EOFError, ValueError, IOError, pyfuck.png.ValidationException
+
+        Returns:
+            The converted program (bytes).
+        """
+        if output not in self.TYPES[1:]:
+            raise ValueError("Unknown output type '{}'.".format(output))
+
+        key = (sha256(source).digest(), type, limit, optimize)
+        decoded = self.sources.get(key)
+        if decoded is None:
+            decoded = self.executor.submit(_decode, source, type, limit, optimize).result()
+            self.sources.put(key, decoded)
+        type, program = decoded
+
+        if type == output and not optimize:
+            return source
+        return self.executor.submit(_encode, program, output, self._carrier(carrier), **options).result()
+
+    def _carrier(self, name):
+        """
+        Returns:
+            Path of a carrier image, which must be in the carriers directory.
+
+        Raises:
+            ValueError
+        """
+        if name is None:
+            return None
+        if self.carriers is None:
+            raise ValueError("Carrier images are not available, the server has no carriers directory.")
+        path = os.path.realpath(os.path.join(self.carriers, name))
+        if os.path.commonpath([self.carriers, path]) != self.carriers:
+            raise ValueError("Carrier '{}' is not in the carriers directory.".format(name))
+        return path
+
+    def measure(self, action, seconds):
+        """
+        Records latency of one request.
+        """
+        with self.lock:
+            count, total, longest = self.latency.get(action, (0, 0.0, 0.0))
+            self.latency[action] = count + 1, total + seconds, max(longest, seconds)
+
+    def stats(self):
+        """
+        Returns:
+            A dict with request latencies and cache counters.
+        """
+        with self.lock:
+            latency = {action: {"count": count, "mean": total / count, "max": longest}
+                       for action, (count, total, longest) in self.latency.items()}
+        return {
+            "latency": latency,
+            "caches": {"programs": self.programs.stats(), "sources": self.sources.stats()},
+        }
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class LRUCache(object):
+
+    """
+    Thread-safe least recently used cache with hit and miss counters.
+
+    Author:
+        Tomas Bedrich
+
+    Examples:
+        >>> cache = LRUCache(2)
+        >>> cache.put("a", 1); cache.put("b", 2); cache.get("a"); cache.put("c", 3)
+        1
+        >>> cache.get("b") is None
+        True
+        >>> cache.stats()
+        {'hits': 1, 'misses': 1, 'size': 2}
+    """
+
+    def __init__(self, size):
+        super(LRUCache, self).__init__()
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                self.items.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.items)}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    """
+    HTTP front end of a Server (see Server for the protocol).
+
+    Author:
+        Tomas Bedrich
+    """
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/stats":
+            return self.send_error(404)
+        self._reply(200, json.dumps(self.server.engine.stats()).encode(), "application/json")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        action = url.path.strip("/")
+        if action not in ("run", "convert"):
+            return self.send_error(404)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        source = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        start = time.perf_counter()
+        try:
+            options = {"type": query.get("type", "auto"),
+                       "limit": int(query["limit"]) if "limit" in query else None}
+            if options["type"] not in Server.TYPES:
+                raise ValueError("Unknown source type '{}'.".format(options["type"]))
+            if action == "run":
+                body = self.server.engine.run(source, input=query.get("input", ""), **options)
+            else:
+                body = self.server.engine.convert(
+                    source, query.get("output"), carrier=query.get("carrier"),
+                    optimize=query.get("optimize", "0") not in ("", "0", "false"),
+                    compression=query.get("compression", "default"),
+                    width=int(query["width"]) if "width" in query else None,
+                    ratio=float(query.get("ratio", 1.0)), **options)
+        except (ValueError, EOFError, IOError, KeyError, ValidationException) as e:
+            self.server.engine.measure("error", time.perf_counter() - start)
+            return self._reply(400, "{}\n".format(e).encode(), "text/plain")
+
+        self.server.engine.measure(action, time.perf_counter() - start)
+        self._reply(200, body, "application/octet-stream")
+
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else self.server.server_address
+
+    def log_message(self, format, *args):
+        logging.debug("%s - " + format, self.address_string(), *args)
+
+    def _reply(self, code, body, contentType):
+        self.send_response(code)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class HTTPServer(ThreadingHTTPServer):
+
+    """
+    Threading HTTP server of a Server.
+
+    Author:
+        Tomas Bedrich
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, engine):
+        self.engine = engine
+        super(HTTPServer, self).__init__(address, RequestHandler)
+
+
+class UnixHTTPServer(HTTPServer):
+
+    """
+    Threading HTTP server of a Server, listening on a Unix socket.
+
+    Author:
+        Tomas Bedrich
+    """
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        TCPServer.server_bind(self)
+        self.server_name, self.server_port = self.server_address, 0
+
+
+def serve(address, workers=None, pool="thread", cache=128, carriers=None, steps=Server.STEPS):
+    """
+    Serves requests until interrupted.
+
+    Args:
+        address: A (host, port) tuple or a Unix socket path.
+        workers, pool, cache, carriers, steps: See Server.
+    """
+    with Server(workers, pool, cache, carriers, steps) as engine:
+        server = (UnixHTTPServer if isinstance(address, str) else HTTPServer)(address, engine)
+        logging.info("Serving on {}.".format(address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if isinstance(address, str):
+                os.unlink(address)
+
+
+# jobs run in the pool - plain functions, so that they can be sent to other processes ==============
+_engine = None  # one per process, engines are thread-safe
+
+
+def _worker():
+    global _engine
+    if _engine is None:
+        _engine = Engine()
+    return _engine
+
+
+def _compile(source, type, limit):
+    return _worker().compile(source, type, limit)
+
+
+def _execute(compiled, input, steps):
+    return _worker().run(compiled, input, steps=steps)
+
+
+def _decode(source, type, limit, optimize):
+    return _worker().to_brainfuck(source, type, limit, optimize)
+
+
+def _encode(program, output, carrier, **options):
+    return _worker().convert(program, output, carrier, **options)
+
+
+if __name__ == '__main__':
+    print("This file is not meant to be executed directly. Please use it as a module instead.")
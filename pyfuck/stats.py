@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Stats(object):
+
+    """
+    Wall time of processing stages and counters of processed data.
+
+    Stages and counters are named "<component>.<what>", e.g. "png.unfilter" or "brainfuck.instructions".
+    Functions accepting a `stats` argument record to it, by default to `NULL_STATS` which ignores everything.
+    Stages may nest - e.g. pixel grouping of a lazily loaded image includes decoding of its rows.
+    An instance is meant for one thread.
+
+    Author:
+        Tomas Bedrich
+
+    Examples:
+        >>> stats = Stats()
+        >>> with stats.stage("work"):
+        ...     stats.add("work.items", 3)
+        >>> stats.peak("work.size", 5); stats.peak("work.size", 2)
+        >>> stats.counters
+        OrderedDict([('work.items', 3), ('work.size', 5)])
+        >>> stats.stages["work"]["calls"]
+        1
+    """
+
+    def __init__(self):
+        super(Stats, self).__init__()
+        self.stages = OrderedDict()  # name => {"time": seconds, "calls": count}
+        self.counters = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures wall time of a block, repeated stages add up.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.time(name, time.perf_counter() - start)
+
+    def time(self, name, seconds):
+        """
+        Adds wall time to a stage.
+        """
+        stage = self.stages.setdefault(name, {"time": 0.0, "calls": 0})
+        stage["time"] += seconds
+        stage["calls"] += 1
+
+    def add(self, name, value):
+        """
+        Adds to a counter.
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def peak(self, name, value):
+        """
+        Records maximum of a counter.
+        """
+        self.counters[name] = max(self.counters.get(name, value), value)
+
+    def report(self, format="human"):
+        """
+        Formats collected data.
+
+        Args:
+            format: "human" (a table) or "json".
+
+        Returns:
+            A string.
+
+        Examples:
+            >>> stats = Stats()
+            >>> stats.time("png.unfilter", 0.25)
+            >>> stats.add("png.rows", 100)
+            >>> print(stats.report())
+            stage                     time [ms]    calls
+            png.unfilter                  250.0        1
+            <BLANKLINE>
+            counter                       value
+            png.rows                        100
+            >>> stats.report("json")
+            '{"stages": {"png.unfilter": {"time": 0.25, "calls": 1}}, "counters": {"png.rows": 100}}'
+        """
+        if format == "json":
+            return json.dumps({"stages": self.stages, "counters": self.counters})
+
+        lines = ["{:<24}{:>11}{:>9}".format("stage", "time [ms]", "calls")]
+        lines += ["{:<24}{:>11.1f}{:>9}".format(name, 1000 * stage["time"], stage["calls"])
+                  for name, stage in self.stages.items()]
+        lines += ["", "{:<24}{:>11}".format("counter", "value")]
+        lines += ["{:<24}{:>11}".format(name, value) for name, value in self.counters.items()]
+        return "\n".join(lines)
+
+
+class NullStats(Stats):
+
+    """
+    Stats ignoring everything - the default of functions accepting stats.
+
+    Author:
+        Tomas Bedrich
+    """
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def time(self, name, seconds):
+        pass
+
+    def add(self, name, value):
+        pass
+
+    def peak(self, name, value):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+if __name__ == '__main__':
+    print("This file is not meant to be executed directly. Please use it as a module instead.")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+
+import unittest
+import doctest
+import io
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pyfuck.api
+from pyfuck.api import Engine
+from pyfuck.png import PNG, PNGWriter, IHDR, Chunk, ValidationException
+
+
+class TestEngine(unittest.TestCase):
+
+    hello_worlds = list(
+        map(lambda f: "test/assets/hello_world." + f, ["brainfuck", "brainloller.png", "braincopter.png"]))
+
+    def setUp(self):
+        self.engine = Engine()
+
+    def test_doctests(self):
+        """
+        Runs doctests.
+        """
+        result = doctest.testmod(pyfuck.api)
+        self.assertEqual(result.failed, 0)
+
+    def test_sources(self):
+        for filename in self.hello_worlds:
+            with self.subTest(filename), open(filename, "rb") as f:
+                contents = f.read()
+                f.seek(0)
+                type, program = self.engine.load(contents)
+                for source in [contents, f, program]:
+                    self.assertEqual(b"Hello World!\n", self.engine.run(source))
+
+    def test_load_lazy(self):
+        # a noisy image is sniffed from its first rows only
+        buffer = io.BytesIO()
+        with PNGWriter(buffer, 1000, 1000, preset="fast") as writer:
+            for y in range(1000):
+                writer.writeRow(os.urandom(3000))
+
+        type, image = self.engine.load(buffer.getvalue())
+        self.assertEqual("braincopter", type)
+        self.assertLess(len(image._decoded), 10)
+        self.assertEqual(1000, len(image.rgb))
+
+    def test_convert(self):
+        for filename, to in zip(self.hello_worlds, ["brainloller", "braincopter", "brainfuck"]):
+            with self.subTest(filename), open(filename, "rb") as f:
+                converted = self.engine.convert(f, to, "test/assets/earth.png")
+                self.assertEqual(to, self.engine.load(converted)[0])
+                self.assertEqual(b"Hello World!\n", self.engine.run(converted))
+
+        with self.assertRaises(ValueError):
+            self.engine.convert("+.", "braincopter")
+
+    def test_passthrough(self):
+        # image data are not decoded, unless verified
+        header = IHDR.initSimplified(1, 1)
+        data = b"not deflated"
+        png = PNG.SIGNATURE + bytes(header) + \
+            bytes(Chunk(len(data), b"IDAT", data, zlib.crc32(b"IDAT" + data).to_bytes(4, "big"))) + \
+            bytes(Chunk(0, b"IEND", b"", zlib.crc32(b"IEND").to_bytes(4, "big")))
+
+        self.assertEqual(png, self.engine.convert(png, "braincopter", type="braincopter"))
+        with self.assertRaises(ValidationException):
+            self.engine.convert(png, "braincopter", type="braincopter", verify=True)
+
+    def test_threads(self):
+        with open(self.hello_worlds[2], "rb") as f:
+            source = f.read()
+        with ThreadPoolExecutor(4) as executor:
+            outputs = list(executor.map(self.engine.run, [source] * 8))
+        self.assertEqual([b"Hello World!\n"] * 8, outputs)
+
+
+if __name__ == "__main__":
+    unittest.main()
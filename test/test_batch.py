@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+
+import unittest
+import doctest
+import logging
+import os
+import shutil
+import subprocess
+import sys
+from tempfile import mkdtemp
+
+import pyfuck.batch
+from pyfuck.batch import convert_tree
+from pyfuck.api import Engine
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.source = mkdtemp()
+        self.destination = mkdtemp()
+        os.makedirs(os.path.join(self.source, "a", "b"))
+        shutil.copy("test/assets/hello_world.brainfuck", self.source)
+        shutil.copy("test/assets/hello_world.brainloller.png", os.path.join(self.source, "a"))
+        shutil.copy("test/assets/hello_world.braincopter.png", os.path.join(self.source, "a", "b"))
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.destination)
+
+    def test_doctests(self):
+        """
+        Runs doctests.
+        """
+        result = doctest.testmod(pyfuck.batch, extraglobs={"shutil": shutil})
+        self.assertEqual(result.failed, 0)
+
+    def test_tree(self):
+        for jobs in (1, 2):
+            for output in Engine.TYPES:
+                with self.subTest(jobs=jobs, output=output):
+                    destination = os.path.join(self.destination, "{}-{}".format(output, jobs))
+                    result = convert_tree(self.source, destination, output, "test/assets/earth.png", jobs)
+                    self.assertEqual(result, {"converted": 3, "skipped": 0, "failed": 0})
+
+                    suffix = pyfuck.batch.SUFFIXES[output][0]
+                    for name in ("hello_world", "a/hello_world", "a/b/hello_world"):
+                        with open(os.path.join(destination, name + suffix), "rb") as f:
+                            self.assertEqual(Engine().run(f.read()), b"Hello World!\n")
+
+    def test_mixed(self):
+        """
+        Tests image and Brainfuck sources converted by threads of one process.
+        """
+        shutil.rmtree(self.source)
+        os.mkdir(self.source)
+        for i in range(4):
+            for type in "braincopter", "brainloller", "brainfuck":  # images first, decoded at once
+                shutil.copy("test/assets/hello_world." + type + (".png" if type != "brainfuck" else ""),
+                            os.path.join(self.source, "{}-{}".format(type, i)))
+        code = ("import sys; from pyfuck.batch import convert_tree; "
+                "print(convert_tree(sys.argv[1], sys.argv[2], 'brainfuck', jobs=1))")
+        output = subprocess.run([sys.executable, "-c", code, self.source, self.destination],
+                                stdout=subprocess.PIPE, check=True).stdout  # a fresh process, nothing imported yet
+        self.assertEqual(b"{'converted': 12, 'skipped': 0, 'failed': 0}\n", output)
+
+    def test_up_to_date(self):
+        convert = lambda **options: convert_tree(self.source, self.destination, "brainloller", jobs=1, **options)
+        self.assertEqual(convert()["converted"], 3)
+        self.assertEqual(convert()["skipped"], 3)
+
+        # touched, but the same content
+        path = os.path.join(self.source, "hello_world.brainfuck")
+        os.utime(path, ns=(0, 0))
+        self.assertEqual(convert(), {"converted": 0, "skipped": 3, "failed": 0})
+
+        # changed content
+        with open(path, "a") as f:
+            f.write("\n")
+        self.assertEqual(convert(), {"converted": 1, "skipped": 2, "failed": 0})
+
+        # removed output
+        os.unlink(os.path.join(self.destination, "a", "hello_world.brainloller.png"))
+        self.assertEqual(convert(), {"converted": 1, "skipped": 2, "failed": 0})
+
+        # changed options
+        self.assertEqual(convert(compression="fast")["converted"], 3)
+
+    def test_failures(self):
+        with open(os.path.join(self.source, "a", "broken.png"), "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\nbroken")
+        logging.disable(logging.ERROR)
+        try:
+            result = convert_tree(self.source, self.destination, "brainfuck", jobs=2)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(result, {"converted": 3, "skipped": 0, "failed": 1})
+        self.assertFalse(os.path.exists(os.path.join(self.destination, "a", "broken.brainfuck")))
+
+    def test_invalid_images(self):
+        """
+        Tests sources which are not PNG images fail alone, when the source type is given.
+        """
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                destination = os.path.join(self.destination, str(jobs))
+                logging.disable(logging.ERROR)
+                try:
+                    result = convert_tree(self.source, destination, "brainfuck", jobs=jobs, type="brainloller")
+                finally:
+                    logging.disable(logging.NOTSET)
+                self.assertEqual(result, {"converted": 2, "skipped": 0, "failed": 1})
+
+    def test_collisions(self):
+        shutil.copy("test/assets/hello_world.brainloller.png", os.path.join(self.source, "hello_world.png"))
+        logging.disable(logging.ERROR)
+        try:
+            result = convert_tree(self.source, self.destination, "brainfuck", jobs=1)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(result, {"converted": 3, "skipped": 0, "failed": 1})
+
+    def test_nested_destination(self):
+        destination = os.path.join(self.source, "converted")
+        self.assertEqual(convert_tree(self.source, destination, "brainfuck", jobs=1)["converted"], 3)
+        self.assertEqual(convert_tree(self.source, destination, "brainfuck", jobs=1)["skipped"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+
+import unittest
+import doctest
+import io
+import json
+
+import pyfuck.bench
+from pyfuck import bench
+from pyfuck.api import Engine
+
+
+class TestBench(unittest.TestCase):
+
+    def test_doctests(self):
+        """
+        Runs doctests.
+        """
+        result = doctest.testmod(pyfuck.bench)
+        self.assertEqual(result.failed, 0)
+
+    def test_workloads(self):
+        """
+        Tests generated programs give the expected output, also minified.
+        """
+        brainfuck = Engine().brainfuck
+        for name, generator in bench.WORKLOADS.items():
+            with self.subTest(name):
+                program, input, expected = generator(0.02)
+                self.assertEqual(Engine().run(program, input), expected.encode("latin-1"))
+                self.assertEqual(Engine().run(brainfuck.minify(program), input), expected.encode("latin-1"))
+
+    def test_suite(self):
+        results = bench.run(scale=0.01, repeat=1, only="echo")
+        self.assertEqual(list(results["cases"]), ["echo/{}/O{}".format(language, level)
+                                                  for language in bench.LANGUAGES for level in bench.LEVELS])
+        for result in results["cases"].values():
+            self.assertGreater(result["instructions/s"], 0)
+            self.assertGreater(result["peak"], 0)
+
+        # a saved baseline compares equal to itself, slower results regress
+        baseline = json.loads(bench.report(results, format="json"))
+        self.assertEqual(bench.compare(results, baseline), [])
+        for result in baseline["cases"].values():
+            result["time"] /= 2
+        self.assertEqual({metric for name, metric, ratio in bench.compare(results, baseline)}, {"time"})
+        self.assertIn("echo/brainfuck/O0", bench.report(results, baseline))
+
+        baseline["scale"] = 1.0
+        self.assertRaises(ValueError, bench.compare, results, baseline)
+
+    def test_image_suites(self):
+        results = bench.run("png", scale=0.001, repeat=1, memory=False)
+        self.assertEqual(len(results["cases"]), 2 * len(bench.KINDS))
+        self.assertEqual(results["cases"]["png.load/paeth/1K"]["pixels"], 992)
+
+        results = bench.run("languages", scale=0.001, repeat=1, memory=False)
+        self.assertIn("braincopter.to_brainfuck/0.01/1K", results["cases"])
+        self.assertIn("brainloller.to_brainloller/1.0/1K", results["cases"])
+        self.assertTrue(all(result["pixels/s"] > 0 for result in results["cases"].values()))
+
+    def test_synthetic(self):
+        from pyfuck.png import PNG
+        for kind in bench.KINDS:
+            with self.subTest(kind):
+                image = PNG().load(io.BytesIO(bench.synthetic(3000, kind)))
+                self.assertEqual((image.header.width, image.header.height), (55, 54))
+                if kind.startswith("palette"):
+                    self.assertEqual(image.header.depth, bench.KINDS[kind])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,10 +3,12 @@
 
 import unittest
 import doctest
+import io
+from unittest import mock
 
 import pyfuck
 from pyfuck.braincopter import Braincopter
-from pyfuck.png import PNG
+from pyfuck.png import PNG, PNGReader
 
 
 class TestBraincopter(unittest.TestCase):
@@ -26,6 +28,74 @@ class TestBraincopter(unittest.TestCase):
         res = bc.to_braincopter(contents, target)
         self.assertEqual(contents, bc.to_brainfuck(res))
 
+    def test_to_braincopter_pure(self):
+        """
+        Tests encoding with and without NumPy gives the same image.
+        """
+        bc = Braincopter()
+        with open("test/assets/hello_world.brainfuck") as f:
+            contents = f.read()
+        numpy = pyfuck.braincopter.numpy
+        try:
+            pyfuck.braincopter.numpy = None
+            image = bc.to_braincopter(contents, PNG().load("test/assets/earth.png"))
+        finally:
+            pyfuck.braincopter.numpy = numpy
+        self.assertEqual(image, bc.to_braincopter(contents, PNG().load("test/assets/earth.png")))
+        self.assertRaises(IOError, bc.to_braincopter, contents * 100, PNG().load("test/assets/squares.png"))
+
+    def test_to_brainfuck(self):
+        """
+        Tests decoding with and without NumPy gives the same program and keeps the image intact.
+        """
+        image = PNG().load("test/assets/hello_world.braincopter.png")
+        rgb = list(image.rgb)
+        numpy = pyfuck.braincopter.numpy
+        try:
+            pyfuck.braincopter.numpy = None
+            program = Braincopter().to_brainfuck(image)
+        finally:
+            pyfuck.braincopter.numpy = numpy
+        self.assertEqual(program, Braincopter().to_brainfuck(image))
+        self.assertEqual(rgb, image.rgb)
+
+    def test_to_brainfuck_parallel(self):
+        """
+        Tests classification by bands in multiple processes gives the same program.
+        """
+        image = PNG().load("test/assets/hello_world.braincopter.png")
+        parallel = Braincopter(workers=3)
+        parallel.PARALLEL_PIXELS = 0
+        self.assertEqual(parallel._plane(image), Braincopter()._plane(image))
+        self.assertEqual(parallel.to_brainfuck(image), Braincopter().to_brainfuck(image))
+
+    def test_transcode(self):
+        """
+        Tests streaming encoding gives the same image as encoding in memory.
+        """
+        bc = Braincopter()
+        with open("test/assets/hello_world.brainfuck") as f:
+            contents = f.read()
+        f = io.BytesIO()
+        bc.transcode(contents, "test/assets/palette.png", f, preset="fast")
+        f.seek(0)
+        self.assertEqual(bc.to_braincopter(contents, PNG().load("test/assets/palette.png")), PNG().load(f))
+        self.assertRaises(IOError, bc.transcode, contents, "test/assets/squares.png", io.BytesIO())
+
+    def test_transcode_closes(self):
+        """
+        Tests the source image is closed when encoding fails.
+        """
+        for source, options in ("test/assets/squares.png", {}), ("test/assets/palette.png", {"preset": "unknown"}):
+            with self.subTest(source=source, options=options), \
+                    mock.patch.object(PNGReader, "close", autospec=True, side_effect=PNGReader.close) as close:
+                with self.assertRaises((IOError, KeyError)):
+                    Braincopter().transcode("+" * 100, source, io.BytesIO(), **options)
+                close.assert_called_once()
+
+    def test_capacity(self):
+        self.assertEqual(Braincopter.capacity(351, 351), 2 * 350 + 349 * 349)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -3,6 +3,7 @@
 
 import unittest
 import doctest
+import io
 
 import pyfuck
 from pyfuck.brainfuck import Brainfuck
@@ -20,6 +21,19 @@ class TestBrainfuck(unittest.TestCase):
         result = doctest.testmod(pyfuck.brainfuck, extraglobs={"b": self.bf})
         self.assertEqual(result.failed, 0)
 
+    def test_compile(self):
+        compiled = self.bf._compile("+++[>++<-]>.")
+        self.assertEqual([("+", 3), ("[", 6), (">", 1), ("+", 2), ("<", 1), ("-", 1), ("]", 1), (">", 1), (".", 1)],
+                         list(compiled))
+        out = io.StringIO()
+        self.bf.execute(compiled, out)
+        self.assertEqual("\x06", out.getvalue())
+
+    def test_execute_clamps(self):
+        out = io.StringIO()
+        self.bf.eval("<<+.", out)
+        self.assertEqual("\x01", out.getvalue())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -3,8 +3,12 @@
 
 import unittest
 import doctest
+import io
+import struct
+import zlib
 
 import pyfuck
+from pyfuck.api import Engine
 from pyfuck.brainloller import Brainloller
 from pyfuck.png import PNG
 
@@ -19,11 +23,63 @@ class TestBrainloller(unittest.TestCase):
         self.assertEqual(result.failed, 0)
 
     def test_to_brainloller(self):
-        with open("test/assets/hello_world.brainfuck") as f:
-            image = Brainloller().to_brainloller(f.read())
         ref = PNG().load("test/assets/hello_world.brainloller.png")
+        with open("test/assets/hello_world.brainfuck") as f:
+            image = Brainloller().to_brainloller(f.read(), width=ref.header.width)
         self.assertEqual(ref, image)
 
+    def test_to_brainloller_folded(self):
+        bl = Brainloller()
+        with open("test/assets/hello_world.brainfuck") as f:
+            contents = f.read()
+        image = bl.to_brainloller(contents)
+        self.assertEqual((11, 13), (image.header.width, image.header.height))
+        self.assertEqual(bl.to_brainfuck(PNG().load("test/assets/hello_world.brainloller.png")), bl.to_brainfuck(image))
+        self.assertEqual(bl.to_brainfuck(image), bl.to_brainfuck(bl.to_brainloller(contents, width=3)))
+
+    def test_to_brainfuck_palette(self):
+        bl = Brainloller()
+        palette = PNG().load("test/assets/hello_world.brainloller.2.png")
+        truecolour = PNG()
+        truecolour.pixels = palette.pixels
+        self.assertEqual(bl.to_brainfuck(truecolour), bl.to_brainfuck(palette))
+
+    def test_sniff_suggested_palette(self):
+        """
+        Tests a truecolour image with a (suggested) palette is sampled by its RGB samples.
+        """
+        with open("test/assets/hello_world.brainloller.png", "rb") as f:
+            data = f.read()
+        colours = bytes(range(48))
+        plte = struct.pack(">I", len(colours)) + b"PLTE" + colours + struct.pack(">I", zlib.crc32(b"PLTE" + colours))
+        header = len(PNG.SIGNATURE) + 25  # IHDR chunk
+        image = PNG().load(io.BytesIO(data[:header] + plte + data[header:]), lazy=True)
+        self.assertEqual((2, 16), (image.header.colour, len(image.palette.palette)))
+        self.assertTrue(Brainloller().sniff(image)[0])
+        self.assertEqual(b"Hello World!\n", Engine().run(data[:header] + plte + data[header:]))
+
+    def test_walk(self):
+        """
+        Tests the program counter turns in every direction and leaves the image at any border.
+        """
+        bl = Brainloller()
+        # east, south, west, north and out
+        plane = [b"++R", b">\x00-", b"R.R"]
+        self.assertEqual("++-.>+", bl.to_brainfuck(self._image(plane)))
+
+    def test_limit(self):
+        image = PNG().load("test/assets/hello_world.brainloller.png")
+        program = Brainloller().to_brainfuck(image, limit=111)
+        self.assertEqual(111, len(program))
+        self.assertRaises(ValueError, Brainloller().to_brainfuck, image, limit=110)
+
+    @staticmethod
+    def _image(plane):
+        colours = {ord(command): colour for colour, command in Brainloller.COMMANDS.items()}
+        image = PNG()
+        image.pixels = [[colours.get(code, (0, 0, 0)) for code in row] for row in plane]
+        return image
+
 
 if __name__ == "__main__":
     unittest.main()
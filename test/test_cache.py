@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+
+import unittest
+import doctest
+import os
+import shutil
+from tempfile import mkdtemp
+
+import pyfuck.cache
+from pyfuck.cache import Cache
+from pyfuck.api import Engine
+from pyfuck.stats import Stats
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.cache = Cache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_doctests(self):
+        """
+        Runs doctests.
+        """
+        result = doctest.testmod(pyfuck.cache)
+        self.assertEqual(result.failed, 0)
+
+    def test_keys(self):
+        self.assertEqual(self.cache.key(b"a", "brainfuck"), self.cache.key(b"a", "brainfuck"))
+        self.assertNotEqual(self.cache.key(b"a", "brainfuck"), self.cache.key(b"a", "brainloller"))
+        self.assertNotEqual(self.cache.key(b"a", "braincopter", b"carrier"),
+                            self.cache.key(b"a", "braincopter", b"other carrier"))
+
+    def test_eviction(self):
+        cache = Cache(self.directory, size=250)  # two entries fit
+        keys = [cache.key(i) for i in range(3)]
+        for time, key in enumerate(keys[:2]):
+            cache.put(key, bytes(100))
+            os.utime(cache._path(key), (time, time))
+        cache.get(keys[0])  # recently used
+        cache.put(keys[2], bytes(100))
+
+        self.assertEqual([True, False, True], [cache.get(key) is not None for key in keys])
+        leftovers = [name for bucket in os.listdir(self.directory)
+                     for name in os.listdir(os.path.join(self.directory, bucket)) if name.startswith(".")]
+        self.assertEqual([], leftovers)
+
+    def test_engine(self):
+        engine = Engine(self.cache)
+        with open("test/assets/hello_world.braincopter.png", "rb") as f:
+            source = f.read()
+
+        for hit in [False, True]:
+            with self.subTest(hit=hit):
+                stats = Stats()
+                self.assertEqual(b"Hello World!\n", engine.run(source, stats=stats))
+                self.assertEqual(1, stats.counters["cache.hits" if hit else "cache.misses"])
+                self.assertEqual(hit, "png.unfilter" not in stats.stages)
+
+                stats = Stats()
+                image = engine.convert(source, "brainloller", stats=stats)
+                self.assertEqual(hit, "png.unfilter" not in stats.stages)
+                self.assertEqual(b"Hello World!\n", Engine().run(image))
+
+    def test_engine_brainfuck(self):
+        engine = Engine(self.cache)
+        for type in "auto", "brainfuck":
+            with self.subTest(type=type), open("test/assets/hello_world.brainfuck", "rb") as f:
+                self.assertEqual(b"Hello World!\n", engine.run(f, type=type))
+
+
+if __name__ == "__main__":
+    unittest.main()
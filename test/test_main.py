@@ -6,7 +6,10 @@ import logging
 import io
 import sys
 import itertools
-from tempfile import NamedTemporaryFile as mktemp
+import os
+import shutil
+import subprocess
+from tempfile import NamedTemporaryFile as mktemp, mkdtemp
 from os import unlink
 
 import pyfuck.__main__ as main
@@ -57,6 +60,73 @@ class TestInterpreter(unittest.TestCase):
                 # cleanup
                 unlink(tmp.name)
 
+    def test_optimize(self):
+        for source, output in itertools.product(self.hello_worlds, ["brainfuck", "brainloller"]):
+            with self.subTest(source=source, output=output):
+                tmp = mktemp(delete=False)
+                tmp.close()
+
+                args = main.parser_main.parse_args(["convert", "-O", "-o", output, source, tmp.name])
+                main.Interpreter(args).convert()
+
+                args = main.parser_main.parse_args(["run", tmp.name])
+                sys.stdout = io.StringIO()
+                main.Interpreter(args).run()
+                self.assertEqual("Hello World!\n", sys.stdout.getvalue())
+                unlink(tmp.name)
+
+    def test_layout(self):
+        # images with a mostly empty last row are still detected as Brainloller
+        with mktemp("w", suffix=".bf", delete=False) as source:
+            source.write("++++++++[>++++++++<-]>+.")
+        for options in ["-w", "40"], ["-w", "3"], ["-r", "0.05"]:
+            with self.subTest(options=options):
+                tmp = mktemp(delete=False)
+                tmp.close()
+
+                args = main.parser_main.parse_args(["convert", "-o", "brainloller"] + options + [source.name, tmp.name])
+                main.Interpreter(args).convert()
+
+                args = main.parser_main.parse_args(["run", tmp.name])
+                sys.stdout = io.StringIO()
+                main.Interpreter(args).run()
+                self.assertEqual("A", sys.stdout.getvalue())
+                unlink(tmp.name)
+        unlink(source.name)
+
+    def test_passthrough(self):
+        for source, output, options in [(self.hello_worlds[1], "brainloller", []),
+                                        (self.hello_worlds[2], "braincopter", ["--verify"]),
+                                        ("test/assets/palette.png", "brainloller", ["-t", "brainloller", "--strip"])]:
+            with self.subTest(source=source, options=options):
+                tmp = mktemp(delete=False)
+                tmp.close()
+
+                args = main.parser_main.parse_args(["convert", "-o", output] + options + [source, tmp.name])
+                main.Interpreter(args).convert()
+
+                with open(source, "rb") as original, open(tmp.name, "rb") as copy:
+                    original, copy = original.read(), copy.read()
+                if "--strip" in options:
+                    self.assertEqual(115, len(copy))
+                else:
+                    self.assertEqual(original, copy)
+                unlink(tmp.name)
+
+    def test_stats(self):
+        for options, start in ([], "stage"), (["--stats-format", "json"], "{"):
+            with self.subTest(options=options):
+                sys.stdout = io.StringIO()
+                stderr, sys.stderr = sys.stderr, io.StringIO()
+                try:
+                    args = main.parser_main.parse_args(["run", "--stats"] + options + [self.hello_worlds[1]])
+                    main.Interpreter(args).run()
+                    report = sys.stderr.getvalue()
+                finally:
+                    sys.stderr = stderr
+                self.assertEqual("Hello World!\n", sys.stdout.getvalue())
+                self.assertTrue(report.lstrip().startswith(start), report)
+
     def test_stdinout(self):
         sys.stdout = io.StringIO()
         sys.stdin = open("test/assets/hello_world.brainfuck")
@@ -64,6 +134,63 @@ class TestInterpreter(unittest.TestCase):
         main.Interpreter(args).run()
         self.assertEqual("Hello World!\n", sys.stdout.getvalue())
 
+    def test_startup(self):
+        """
+        Tests running plain Brainfuck loads no image modules and importing the CLI loads no heavy ones.
+        """
+        def modules(code):
+            code += "\nsys.stdout = sys.__stdout__\nprint(' '.join(sorted(sys.modules)))"
+            return set(subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True).stdout.split())
+
+        loaded = modules("import io, sys, pyfuck.__main__ as main\n"
+                         "sys.stdout = io.StringIO()\n"
+                         "args = main.parser_main.parse_args(['run', 'test/assets/hello_world.brainfuck'])\n"
+                         "main.Interpreter(args).run()")
+        for module in b"pyfuck.png", b"pyfuck.brainloller", b"pyfuck.braincopter", b"pyfuck.server", \
+                b"pyfuck.batch", b"pyfuck.cache", b"numpy", b"termios":
+            self.assertNotIn(module, loaded)
+
+        # compared to a bare argument parser, which loads zlib itself on some Python versions (through shutil)
+        loaded = modules("import sys, pyfuck.__main__") - \
+            modules("import sys, argparse\nargparse.ArgumentParser().add_argument('-x', help='x')")
+        for module in b"pyfuck.png", b"zlib", b"numpy":
+            self.assertNotIn(module, loaded)
+
+    def test_recursive(self):
+        source, destination = mkdtemp(), mkdtemp()
+        for directory, filename in enumerate(self.hello_worlds):
+            os.mkdir(os.path.join(source, str(directory)))
+            shutil.copy(filename, os.path.join(source, str(directory)))
+
+        args = main.parser_main.parse_args(["convert", "-R", "-j", "2", "-o", "brainloller", source, destination])
+        main.Interpreter(args).convert()
+        for directory in range(len(self.hello_worlds)):
+            args = main.parser_main.parse_args(
+                ["run", os.path.join(destination, str(directory), "hello_world.brainloller.png")])
+            sys.stdout = io.StringIO()
+            main.Interpreter(args).run()
+            self.assertEqual("Hello World!\n", sys.stdout.getvalue())
+
+        # metadata stripped, a failed file fails the command
+        shutil.copy("test/assets/palette.png", os.path.join(source, "0"))
+        args = main.parser_main.parse_args(
+            ["convert", "-R", "-j", "1", "-t", "brainloller", "--strip", "-o", "brainloller", source, destination])
+        logging.disable(logging.ERROR)
+        try:
+            self.assertEqual(1, main.Interpreter(args).convert())
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(115, os.path.getsize(os.path.join(destination, "0", "palette.brainloller.png")))
+
+        for options in ["--cache", destination], ["--stats"]:
+            status = subprocess.run([sys.executable, "-m", "pyfuck", "convert", "-R", "-o", "brainfuck", source,
+                                     destination] + options, stderr=subprocess.PIPE)
+            self.assertEqual(2, status.returncode)
+            self.assertIn(b"not supported with -R", status.stderr)
+
+        shutil.rmtree(source)
+        shutil.rmtree(destination)
+
 
 logging.basicConfig(level=logging.INFO)
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+
+import unittest
+import io
+import tempfile
+import tracemalloc
+
+from pyfuck import bench
+from pyfuck.brainfuck import Brainfuck
+from pyfuck.braincopter import Braincopter
+from pyfuck.png import PNG
+
+
+def _peak(function, *args, **kwargs):
+    """
+    Runs a function under tracemalloc.
+
+    Returns:
+        A tuple of the function result and peak size of memory allocated while it ran (in bytes).
+    """
+    tracemalloc.start()
+    try:
+        result = function(*args, **kwargs)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class TestMemory(unittest.TestCase):
+
+    """
+    Peak memory budgets of representative loads, so memory savings do not silently regress.
+
+    Budgets are in bytes per compiled instruction or per pixel, with some headroom over the measured
+    peaks (a compiled command takes 17 bytes - opcode, argument and origin; a decoded RGB pixel 3 bytes).
+    """
+
+    PIXELS = 20 * 10 ** 6
+    COMPILE_BUDGET = 24  # bytes per compiled instruction
+    DECODE_BUDGET = 4  # bytes per pixel
+    TRANSCODE_BUDGET = 0.25  # bytes per pixel of the carrier
+
+    @classmethod
+    def setUpClass(cls):
+        # unfiltered rows decode quickly even under tracemalloc
+        cls.image = bench.synthetic(cls.PIXELS, "none")
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.image
+
+    def test_compile(self):
+        program = "+++[>++<-]>[>+>-<<-]>.<,." * 4000
+        compiled, peak = _peak(Brainfuck()._compile, program)
+        self.assertEqual(len(compiled), 84000)
+        self.assertLess(peak / len(compiled), self.COMPILE_BUDGET)
+
+    def test_decode(self):
+        image, peak = _peak(PNG().load, io.BytesIO(self.image))
+        pixels = image.header.width * image.header.height
+        self.assertGreaterEqual(pixels, 0.99 * self.PIXELS)
+        self.assertLess(peak / pixels, self.DECODE_BUDGET)
+
+    def test_transcode(self):
+        # rows are streamed, so the memory used does not depend on the carrier size
+        program = "+++[>++<-]>[>+>-<<-]>.<,." * 400
+        with tempfile.TemporaryFile() as out:
+            _, peak = _peak(Braincopter().transcode, program, io.BytesIO(self.image), out, preset="fast")
+            out.seek(0)
+            self.assertEqual(Braincopter().to_brainfuck(PNG().load(out, lazy=True), limit=len(program)), program)
+        self.assertLess(peak / self.PIXELS, self.TRANSCODE_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
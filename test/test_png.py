@@ -3,9 +3,11 @@
 
 import unittest
 import doctest
+import io
+from itertools import chain
 
 import pyfuck
-from pyfuck.png import PNG
+from pyfuck.png import PNG, PNGWriter, ValidationException
 
 
 class TestPNG(unittest.TestCase):
@@ -15,7 +17,7 @@ class TestPNG(unittest.TestCase):
         Runs doctests.
         """
         import random
-        result = doctest.testmod(pyfuck.png, extraglobs={"random": random})
+        result = doctest.testmod(pyfuck.png, extraglobs={"random": random, "io": io})
         self.assertEqual(result.failed, 0)
 
     def test_filters(self):
@@ -34,6 +36,102 @@ class TestPNG(unittest.TestCase):
         """
         self.assertEqual(PNG().load("test/assets/palette.png").pixels[-1][-1], (0, 0, 255))
 
+    def test_indices(self):
+        """
+        Tests PNG indexed-colour images are kept as an index plane.
+        """
+        p = PNG().load("test/assets/hello_world.brainloller.2.png")
+        self.assertEqual(len(p.indices), p.header.height)
+        self.assertTrue(all(len(row) == p.header.width for row in p.indices))
+        self.assertEqual(p.palette.palette[p.indices[0][0]], p.pixels[0][0])
+
+    def test_pixels_changed(self):
+        """
+        Tests pixels changed in place are saved.
+        """
+        for filename in "test/assets/squares.png", "test/assets/palette.png", "test/assets/earth.png":
+            with self.subTest(filename):
+                p = PNG().load(filename)
+                p.pixels[0][0] = (1, 2, 3)
+                p.pixels[-1][-1] = (4, 5, 6)
+                f = io.BytesIO()
+                p.save(f)
+                f.seek(0)
+                loaded = PNG().load(f)
+                self.assertEqual(((1, 2, 3), (4, 5, 6)), (loaded.pixels[0][0], loaded.pixels[-1][-1]))
+                self.assertEqual(p, loaded)
+
+    def test_save_indexed(self):
+        """
+        Tests images with few colours are saved as indexed-colour.
+        """
+        for count, depth in (2, 1), (4, 2), (16, 4), (256, 8):
+            with self.subTest(colours=count):
+                p = PNG()
+                p.pixels = [[(i, 0, 255 - i) for i in range(count)] for y in range(3)]
+                f = io.BytesIO()
+                p.save(f)
+                f.seek(0)
+                loaded = PNG().load(f)
+                self.assertEqual((loaded.header.colour, loaded.header.depth), (3, depth))
+                self.assertEqual(p, loaded)
+
+    def test_save_filters(self):
+        """
+        Tests saving with every filter type and preset.
+        """
+        p = PNG().load("test/assets/filterPaeth.png")
+        for options in [{"filtering": type} for type in range(5)] + [{"preset": name} for name in PNG.PRESETS]:
+            with self.subTest(**options):
+                f = io.BytesIO()
+                p.save(f, **options)
+                f.seek(0)
+                self.assertEqual(p, PNG().load(f))
+
+    def test_save_parallel(self):
+        """
+        Tests large images are compressed by multiple threads to multiple IDAT chunks.
+        """
+        import random
+        p = PNG()
+        p.pixels = [[tuple(random.randrange(256) for _ in range(3)) for x in range(300)] for y in range(300)]
+        f = io.BytesIO()
+        p.save(f, "fast", workers=4)
+        self.assertGreater(f.getvalue().count(b"IDAT"), 1)
+        f.seek(0)
+        self.assertEqual(p, PNG().load(f))
+
+    def test_writer(self):
+        """
+        Tests the incremental writer, both serial and parallel.
+        """
+        import random
+        rows = [bytes(random.randrange(8) for _ in range(3 * 200)) for y in range(400)]
+        for workers in 1, 4:
+            with self.subTest(workers=workers):
+                f = io.BytesIO()
+                with PNGWriter(f, 200, 400, preset="fast", workers=workers) as writer:
+                    for row in rows:
+                        writer.writeRow(row)
+                f.seek(0)
+                p = PNG().load(f)
+                self.assertEqual([bytes(chain.from_iterable(row)) for row in p.pixels], rows)
+
+        # indexed-colour images are unfiltered, unless requested
+        colours = [(0, 0, 0), (255, 255, 255)]
+        self.assertEqual(0, PNGWriter(io.BytesIO(), 2, 1, colours, preset="best").filtering)
+        f = io.BytesIO()
+        with PNGWriter(f, 3, 2, colours, filtering=2) as writer:
+            self.assertEqual(2, writer.filtering)
+            writer.writeRow(b"\x00\x01\x00")
+            writer.writeRow(b"\x01\x01\x00")
+        f.seek(0)
+        self.assertEqual([b"\x00\x01\x00", b"\x01\x01\x00"], PNG().load(f).indices)
+
+        writer = PNGWriter(io.BytesIO(), 2, 1)
+        self.assertRaises(ValidationException, writer.writeRow, b"\x00")
+        self.assertRaises(ValidationException, writer.close)
+
 
 if __name__ == "__main__":
     unittest.main()
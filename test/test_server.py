@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+
+import unittest
+import doctest
+import json
+import os
+import socket
+import threading
+import http.client
+from tempfile import mkdtemp
+
+import pyfuck
+import pyfuck.server
+from pyfuck.server import Server, HTTPServer, UnixHTTPServer
+
+
+class TestServer(unittest.TestCase):
+
+    hello_worlds = list(
+        map(lambda f: "test/assets/hello_world." + f, ["brainfuck", "brainloller.png", "braincopter.png"]))
+
+    def test_doctests(self):
+        """
+        Runs doctests.
+        """
+        result = doctest.testmod(pyfuck.server)
+        self.assertEqual(result.failed, 0)
+
+    def test_engine(self):
+        for pool in ["thread", "process"]:
+            with self.subTest(pool), Server(workers=2, pool=pool) as server:
+                for filename in self.hello_worlds:
+                    with open(filename, "rb") as f:
+                        source = f.read()
+                    self.assertEqual(b"Hello World!\n", server.run(source))
+                    self.assertEqual(b"Hello World!\n", server.run(source))
+
+                    image = server.convert(source, "brainloller", optimize=True)
+                    self.assertEqual(b"Hello World!\n", server.run(image, "brainloller"))
+
+                self.assertEqual({"hits": 5, "misses": 4, "size": 4}, server.stats()["caches"]["programs"])
+
+    def test_limits(self):
+        with Server(workers=1, steps=1000) as server:
+            self.assertRaises(ValueError, server.run, b"+[]")
+            self.assertEqual(b"A", server.run(b"++++++++[>++++++++<-]>+."))
+            self.assertRaises(ValueError, server.convert, b"+.", "braincopter", carrier="earth.png")
+
+        with Server(workers=1, carriers="test/assets") as server:
+            image = server.convert(b"+.", "braincopter", carrier="earth.png")
+            self.assertEqual(b"\x01", server.run(image, "braincopter"))
+            for carrier in "../README.md", os.path.abspath("README.md"):
+                with self.subTest(carrier):
+                    self.assertRaises(ValueError, server.convert, b"+.", "braincopter", carrier=carrier)
+
+    def test_http(self):
+        with Server(workers=2) as engine:
+            server = HTTPServer(("127.0.0.1", 0), engine)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                connection = http.client.HTTPConnection(*server.server_address)
+
+                with open(self.hello_worlds[2], "rb") as f:
+                    connection.request("POST", "/convert?output=brainfuck", f.read())
+                response = connection.getresponse()
+                self.assertEqual(200, response.status)
+                program = response.read()
+
+                connection.request("POST", "/run?type=brainfuck", program)
+                self.assertEqual(b"Hello World!\n", connection.getresponse().read())
+
+                connection.request("POST", "/run?input=", b",")
+                response = connection.getresponse()
+                self.assertEqual(400, response.status)
+                response.read()
+
+                connection.request("GET", "/stats")
+                stats = json.loads(connection.getresponse().read().decode())
+                self.assertEqual(1, stats["latency"]["run"]["count"])
+                self.assertEqual(1, stats["latency"]["error"]["count"])
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix sockets are not available.")
+    def test_unix_socket(self):
+        path = os.path.join(mkdtemp(), "pyfuck.sock")
+        with Server(workers=1) as engine:
+            server = UnixHTTPServer(path, engine)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                connection = http.client.HTTPConnection("localhost")
+                connection.sock = socket.socket(socket.AF_UNIX)
+                connection.sock.connect(path)
+                connection.request("POST", "/run", b"++++++++[>++++++++<-]>+.")
+                self.assertEqual(b"A", connection.getresponse().read())
+            finally:
+                server.shutdown()
+                server.server_close()
+                os.unlink(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+
+import unittest
+import doctest
+import json
+
+import pyfuck.stats
+from pyfuck.stats import Stats, NULL_STATS
+from pyfuck.api import Engine
+
+
+class TestStats(unittest.TestCase):
+
+    def test_doctests(self):
+        """
+        Runs doctests.
+        """
+        result = doctest.testmod(pyfuck.stats)
+        self.assertEqual(result.failed, 0)
+
+    def test_stages(self):
+        stats = Stats()
+        with open("test/assets/hello_world.brainloller.png", "rb") as f:
+            self.assertEqual(b"Hello World!\n", Engine().run(f, stats=stats))
+
+        for stage in ["png.decompress", "png.unfilter", "sniff", "brainloller.plane", "brainloller.compile",
+                      "brainfuck.execute"]:
+            self.assertIn(stage, stats.stages)
+        self.assertEqual(111, stats.counters["brainloller.pixels"])
+        self.assertEqual(111, stats.counters["brainfuck.commands"])
+        self.assertGreater(stats.counters["brainfuck.instructions"], stats.counters["brainfuck.ops"])
+        self.assertEqual(set(json.loads(stats.report("json"))["counters"]), set(stats.counters))
+
+    def test_null(self):
+        Engine().run("+.", stats=NULL_STATS)
+        self.assertEqual({}, NULL_STATS.stages)
+        self.assertEqual({}, NULL_STATS.counters)
+
+
+if __name__ == "__main__":
+    unittest.main()